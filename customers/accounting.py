@@ -0,0 +1,230 @@
+import bisect
+import time
+import logging
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import AccountingCursor, Router, SessionLog, Subscription
+from .radius_pool import credentials, radius_db
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    'radacctid', 'acctuniqueid', 'acctsessionid', 'username', 'acctstarttime', 'acctstoptime',
+    'acctupdatetime', 'acctinputoctets', 'acctoutputoctets',
+)
+
+NEW_ROWS_SQL = (
+    f"SELECT {', '.join(COLUMNS)} FROM radacct WHERE radacctid > %s ORDER BY radacctid LIMIT %s"
+)
+# Keyset on (acctupdatetime, radacctid): interim updates and stops rewrite
+# existing rows in place, so their radacctid never moves forward.
+UPDATED_ROWS_SQL = (
+    f"SELECT {', '.join(COLUMNS)} FROM radacct "
+    f"WHERE acctupdatetime > %s OR (acctupdatetime = %s AND radacctid > %s) "
+    f"ORDER BY acctupdatetime, radacctid LIMIT %s"
+)
+
+
+class SubscriptionIndex:
+    """username -> subscriptions, loaded on demand and dropped after ``ttl`` seconds.
+
+    A username can be reused by a renewal, so each entry keeps every
+    subscription sorted by start_date and lookup() picks the one that was
+    running when the session started.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.loaded_at = time.monotonic()
+
+    def load(self, usernames):
+        if time.monotonic() - self.loaded_at > self.ttl:
+            self.entries = {}
+            self.loaded_at = time.monotonic()
+        # Unknown usernames are not remembered, so a brand-new subscription is
+        # matched on its very first accounting record.
+        missing = list(set(usernames) - set(self.entries))
+        for i in range(0, len(missing), 1000):
+            rows = Subscription.objects.filter(username__in=missing[i:i + 1000]).order_by('start_date').values_list(
+                'username', 'start_date', 'id'
+            )
+            for username, start_date, subscription_id in rows:
+                starts, ids = self.entries.setdefault(username, ([], []))
+                starts.append(start_date)
+                ids.append(subscription_id)
+
+    def lookup(self, username, at):
+        starts, ids = self.entries.get(username, ([], []))
+        if not ids:
+            return None
+        position = bisect.bisect_right(starts, at) - 1 if at else len(ids) - 1
+        return ids[max(position, 0)]
+
+
+def cursor_name(params):
+    return f"radacct:{params['host']}:{params['port']}/{params['db']}"
+
+
+def _aware(value, tz):
+    if value is None or timezone.is_aware(value):
+        return value
+    return value.replace(tzinfo=tz)
+
+
+def to_session_logs(rows, index, tz):
+    """Build unsaved SessionLog objects from radacct rows; rows without a known subscription are skipped."""
+    index.load({row[3] for row in rows})
+    logs = {}
+    for radacctid, unique_id, session_id, username, start, stop, update, octets_in, octets_out in rows:
+        start = _aware(start, tz)
+        subscription_id = index.lookup(username, start)
+        if subscription_id is None or start is None:
+            continue
+        logs[unique_id] = SessionLog(
+            subscription_id=subscription_id,
+            username=username,
+            acct_unique_id=unique_id,
+            acct_session_id=session_id or '',
+            start_time=start,
+            end_time=_aware(stop, tz),
+            data_used=(octets_in or 0) + (octets_out or 0),
+        )
+    return list(logs.values())
+
+
+def first_held(rows, index, tz, cutoff):
+    """Position of the first row with no subscription yet whose session started after ``cutoff``, or None.
+
+    Such a row may just be ahead of its subscription (e.g. one whose
+    transaction has not committed yet), so the cursor waits for it instead of
+    moving past; once the session is older than the grace window it is skipped.
+    """
+    index.load({row[3] for row in rows})
+    for position, row in enumerate(rows):
+        start = _aware(row[4], tz)
+        if start is not None and start > cutoff and index.lookup(row[3], start) is None:
+            return position
+    return None
+
+
+def upsert_session_logs(logs, batch_size, archived_before=None):
+    """Insert new sessions and refresh end_time/data_used of known ones, one statement per chunk.
+
+    Sessions that started before ``archived_before`` may already have been
+    moved to the archive (customers.archive), so they are only updated while
+    still in the table; a late stop never brings an archived row back.
+    """
+    old = [log for log in logs if archived_before and log.start_time < archived_before]
+    if old:
+        logs = [log for log in logs if not (archived_before and log.start_time < archived_before)]
+        now = timezone.now()
+        for i in range(0, len(old), batch_size):
+            chunk = old[i:i + batch_size]
+            ids = dict(SessionLog.objects.filter(
+                acct_unique_id__in=[log.acct_unique_id for log in chunk]
+            ).values_list('acct_unique_id', 'id'))
+            hot = [log for log in chunk if log.acct_unique_id in ids]
+            for log in hot:
+                log.id, log.updated_at = ids[log.acct_unique_id], now
+            SessionLog.objects.bulk_update(hot, ['end_time', 'data_used', 'updated_at'])
+    unique_fields = ['acct_unique_id'] if connection.features.supports_update_conflicts_with_target else None
+    for i in range(0, len(logs), batch_size):
+        SessionLog.objects.bulk_create(
+            logs[i:i + batch_size],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['end_time', 'data_used', 'updated_at'],
+        )
+
+
+def ingest(db, name, index, batch_size=None, max_batches=None):
+    """Copy new and updated radacct rows into SessionLog, advancing the cursor called ``name``.
+
+    Each batch is written together with the cursor move in one transaction,
+    so a crash replays at most one batch (upserts make that harmless). A pass
+    stops at a recent row whose username has no subscription yet and retries
+    it on the next run, for up to RADIUS_ACCT_UNMATCHED_GRACE seconds after
+    the session started. Returns counts.
+    """
+    batch_size = batch_size or settings.RADIUS_ACCT_BATCH_SIZE
+    max_batches = max_batches or settings.RADIUS_ACCT_MAX_BATCHES
+    tz = ZoneInfo(settings.RADIUS_DB_TIMEZONE)
+    cursor, _ = AccountingCursor.objects.get_or_create(name=name)
+    stats = {'rows': 0, 'sessions': 0, 'unmatched': 0, 'held': 0, 'batches': 0}
+    if cursor.last_update is None:
+        # First run: only updates from now on; history comes in through the id pass.
+        cursor.last_update = timezone.now() - timedelta(seconds=1)
+        cursor.save(update_fields=['last_update', 'updated_at'])
+    db_cursor = db.cursor()
+    for query in ('new', 'updated'):
+        while stats['batches'] < max_batches:
+            if query == 'new':
+                db_cursor.execute(NEW_ROWS_SQL, (cursor.last_id, batch_size))
+            else:
+                last_update = timezone.localtime(cursor.last_update, tz).replace(tzinfo=None)
+                db_cursor.execute(UPDATED_ROWS_SQL, (last_update, last_update, cursor.last_update_id, batch_size))
+            rows = db_cursor.fetchall()
+            db.commit()  # end the read snapshot so the next batch sees new rows
+            if not rows:
+                break
+            fetched = len(rows)
+            held = first_held(rows, index, tz, timezone.now() - timedelta(seconds=settings.RADIUS_ACCT_UNMATCHED_GRACE))
+            if held is not None:
+                stats['held'] += 1
+                rows = rows[:held]
+            if rows:
+                logs = to_session_logs(rows, index, tz)
+                with transaction.atomic():
+                    upsert_session_logs(
+                        logs, settings.RADIUS_ACCT_WRITE_BATCH_SIZE,
+                        archived_before=timezone.now() - timedelta(days=settings.SESSION_ARCHIVE_AFTER_DAYS),
+                    )
+                    if query == 'new':
+                        cursor.last_id = max(cursor.last_id, rows[-1][0])
+                    else:
+                        cursor.last_update, cursor.last_update_id = _aware(rows[-1][6], tz), rows[-1][0]
+                    cursor.save()
+                stats['rows'] += len(rows)
+                stats['sessions'] += len(logs)
+                stats['unmatched'] += len(rows) - len(logs)
+            stats['batches'] += 1
+            if held is not None or fetched < batch_size:
+                break
+    return stats
+
+
+def accounting_sources():
+    """One (name, router-or-None) per distinct FreeRADIUS database to read accounting from."""
+    sources = {cursor_name(credentials()): None}
+    for router in Router.objects.exclude(radius_server=''):
+        sources.setdefault(cursor_name(credentials(router)), router)
+    return sources
+
+
+_index = None
+
+
+def ingest_accounting():
+    """Ingest accounting from every RADIUS database; returns {cursor name: stats or error}."""
+    global _index
+    if _index is None:
+        _index = SubscriptionIndex(ttl=settings.RADIUS_ACCT_INDEX_TTL)
+    results = {}
+    for name, router in accounting_sources().items():
+        started = time.monotonic()
+        try:
+            with radius_db(router) as db:
+                stats = ingest(db, name, _index)
+        except Exception as e:
+            logger.error(f"Accounting ingestion from {name} failed: {e}")
+            results[name] = {'error': str(e)}
+            continue
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        if stats['rows']:
+            logger.info(f"Ingested {stats['rows']} radacct rows from {name} into {stats['sessions']} sessions in {stats['seconds']}s")
+        results[name] = stats
+    return results
@@ -6,10 +6,10 @@ from django.shortcuts import redirect, render
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from .models import Customer, AuditLog, Location, Router, Package, Subscription, SessionLog, Invoice, Compensation, SupportTicket, Voucher
-from .utils import generate_voucher_codes, send_sms
-import routeros_api
-import MySQLdb
+from .models import Customer, AuditLog, Location, Router, Package, Subscription, SessionLog, Invoice, Compensation, SupportTicket, Voucher, ProvisioningJob, SyncRetry, SubscriptionUsage
+from .utils import generate_voucher_codes, send_sms, send_email
+from . import health, audit
+from .provisioning import provision
 import logging
 
 logger = logging.getLogger(__name__)
@@ -101,14 +101,19 @@ class LocationAdmin(admin.ModelAdmin):
 
 @admin.register(Router)
 class RouterAdmin(admin.ModelAdmin):
-    list_display = ['name', 'location', 'connection_type', 'vpn_protocol', 'ip_address', 'created_at']
+    list_display = ['name', 'location', 'connection_type', 'vpn_protocol', 'ip_address', 'health_status', 'created_at']
     search_fields = ['name', 'ip_address']
     list_filter = ['location', 'connection_type', 'vpn_protocol', 'created_at']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['probe_routers', 'reset_health']
     fieldsets = (
         (None, {
             'fields': ('company', 'location', 'name', 'connection_type', 'ip_address', 'username', 'password', 'api_port')
         }),
+        ('Sync Settings', {
+            'fields': ('sync_concurrency',),
+            'classes': ('collapse',),
+        }),
         ('RADIUS Settings', {
             'fields': ('radius_server', 'radius_secret'),
             'classes': ('collapse',),
@@ -119,12 +124,33 @@ class RouterAdmin(admin.ModelAdmin):
         }),
     )
 
+    def health_status(self, obj):
+        if obj.connection_type == 'RADIUS':
+            return '-'
+        state = health.get_health(obj.id)
+        color = 'red' if health.is_open(state) else 'orange' if state['failures'] else 'green'
+        return format_html('<span style="color: {};">{}</span>', color, health.describe(state))
+    health_status.short_description = 'Health'
+
+    def probe_routers(self, request, queryset):
+        routers = list(queryset.exclude(connection_type='RADIUS'))
+        reachable = [router.name for router in routers if health.probe(router)]
+        self.message_user(request, f"{len(reachable)} of {len(routers)} routers answered.")
+    probe_routers.short_description = "Probe selected routers now"
+
+    def reset_health(self, request, queryset):
+        for router in queryset:
+            health.reset(router)
+        self.message_user(request, "Health history cleared; circuits closed.")
+    reset_health.short_description = "Close circuit / clear health history"
+
 @admin.register(Package)
 class PackageAdmin(admin.ModelAdmin):
     list_display = ['name', 'connection_type', 'price_display', 'download_bandwidth', 'upload_bandwidth', 'data_limit', 'company', 'created_at']
     search_fields = ['name']
     list_filter = ['connection_type', 'company', 'location', 'created_at']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['suspend_subscriptions']
     fieldsets = (
         (None, {
             'fields': ('company', 'location', 'router', 'name', 'connection_type', 'price', 'ip_address')
@@ -144,20 +170,85 @@ class PackageAdmin(admin.ModelAdmin):
         return obj.get_price_display()
     price_display.short_description = 'Price'
 
+    def suspend_subscriptions(self, request, queryset):
+        from .expiry import suspend_subscriptions
+        from .coalesce import trigger
+        from .tasks import sync_subscription_changes
+        stats = suspend_subscriptions(Subscription.objects.filter(package__in=queryset))
+        trigger(sync_subscription_changes)
+        self.message_user(
+            request, f"Suspended {stats['suspended']} subscriptions: {stats['disabled']} disabled on "
+                     f"{len(stats['routers'])} routers, {stats['failed']} queued for retry."
+        )
+    suspend_subscriptions.short_description = "Suspend all active subscriptions (package discontinued)"
+
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ['customer', 'package', 'connection_type', 'username', 'is_active', 'created_at']
     search_fields = ['customer__name', 'username']
     list_filter = ['connection_type', 'is_active', 'created_at']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['suspend_selected']
+
+    def suspend_selected(self, request, queryset):
+        from .expiry import suspend_subscriptions
+        from .coalesce import trigger
+        from .tasks import sync_subscription_changes
+        stats = suspend_subscriptions(queryset)
+        trigger(sync_subscription_changes)
+        self.message_user(
+            request, f"Suspended {stats['suspended']} subscriptions: {stats['disabled']} disabled on "
+                     f"{len(stats['routers'])} routers, {stats['failed']} queued for retry."
+        )
+    suspend_selected.short_description = "Suspend selected subscriptions"
 
 @admin.register(SessionLog)
 class SessionLogAdmin(admin.ModelAdmin):
     list_display = ['subscription', 'username', 'start_time', 'end_time', 'data_used', 'created_at']
-    search_fields = ['username']
+    search_fields = ['username', 'acct_session_id']
     list_filter = ['start_time', 'created_at']
     readonly_fields = ['created_at', 'updated_at']
 
+@admin.register(SubscriptionUsage)
+class SubscriptionUsageAdmin(admin.ModelAdmin):
+    list_display = ['subscription', 'bytes_in', 'bytes_out', 'last_seen', 'updated_at']
+    search_fields = ['subscription__username']
+    list_select_related = ['subscription']
+    readonly_fields = ['subscription', 'bytes_in', 'bytes_out', 'last_seen', 'updated_at']
+
+@admin.register(ProvisioningJob)
+class ProvisioningJobAdmin(admin.ModelAdmin):
+    list_display = ['subscription', 'event', 'status', 'network_status', 'notification_status', 'attempts', 'created_at', 'finished_at']
+    search_fields = ['subscription__username', 'token']
+    list_filter = ['event', 'status', 'network_status', 'notification_status', 'created_at']
+    readonly_fields = ['token', 'error', 'attempts', 'created_at', 'updated_at', 'finished_at']
+    actions = ['rerun_jobs']
+
+    def rerun_jobs(self, request, queryset):
+        from .tasks import run_provisioning_job
+        count = 0
+        for job in queryset.exclude(status='SUCCESS'):
+            run_provisioning_job.delay(job.id)
+            count += 1
+        self.message_user(request, f"Queued {count} provisioning jobs.")
+    rerun_jobs.short_description = "Re-run unfinished provisioning"
+
+@admin.register(SyncRetry)
+class SyncRetryAdmin(admin.ModelAdmin):
+    list_display = ['username', 'operation', 'status', 'router_id', 'attempts', 'next_attempt_at', 'last_error', 'updated_at']
+    search_fields = ['username', 'last_error']
+    list_filter = ['status', 'operation', 'router_id']
+    readonly_fields = ['subscription_id', 'router_id', 'username', 'operation', 'attempts', 'last_error', 'created_at', 'updated_at']
+    actions = ['replay_now']
+
+    def replay_now(self, request, queryset):
+        from .retry import replay
+        from .tasks import process_sync_retries
+        count = replay(queryset)
+        process_sync_retries.delay()
+        self.message_user(request, f"Queued {count} retries for an immediate attempt.")
+    replay_now.short_description = "Replay now (resets attempts)"
+
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = ['customer', 'amount_display', 'status', 'issued_date', 'created_at', 'sales_report']
@@ -198,12 +289,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
             if ticket.status != 'IN_PROGRESS':
                 ticket.status = 'IN_PROGRESS'
                 ticket.save()
-                AuditLog.objects.create(
-                    action='Status Changed',
-                    model='SupportTicket',
-                    object_id=ticket.id,
-                    user=request.user,
-                )
+                audit.log('Status Changed', 'SupportTicket', ticket.id, request.user)
                 send_sms(ticket.customer.phone, f"Your ticket #{ticket.ticket_number} is now in progress.")
                 send_email(
                     ticket.customer.email,
@@ -218,12 +304,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
             if ticket.status != 'CLOSED':
                 ticket.status = 'CLOSED'
                 ticket.save()
-                AuditLog.objects.create(
-                    action='Status Changed',
-                    model='SupportTicket',
-                    object_id=ticket.id,
-                    user=request.user,
-                )
+                audit.log('Status Changed', 'SupportTicket', ticket.id, request.user)
                 send_sms(ticket.customer.phone, f"Your ticket #{ticket.ticket_number} has been closed.")
                 send_email(
                     ticket.customer.email,
@@ -266,97 +347,17 @@ class VoucherAdmin(admin.ModelAdmin):
             logger.info(f"Generating {count} vouchers with length {length}, char_type {char_type}, prefix {prefix}, package {package.name}")
             try:
                 codes = generate_voucher_codes(count, length, char_type, prefix)
-                vouchers = []
-                for code in codes:
-                    voucher = Voucher.objects.create(
-                        code=code,
-                        prefix=prefix,
-                        package=package,
-                        is_active=True
-                    )
-                    vouchers.append(voucher)
-                    router = package.router
-                    if router.connection_type in ['API', 'VPN']:
-                        try:
-                            api = routeros_api.RouterOsApiPool(
-                                router.ip_address, username=router.username,
-                                password=router.password, port=router.api_port
-                            ).get_api()
-                            rate_limit = f"{package.upload_bandwidth}k/{package.download_bandwidth}k" if package.download_bandwidth and package.upload_bandwidth else ""
-                            data_limit_bytes = package.data_limit * 1024 * 1024 if package.data_limit else None
-                            if package.connection_type == 'HOTSPOT':
-                                params = {
-                                    'name': code,
-                                    'password': code,
-                                    'profile': package.name,
-                                    'limit-uptime': f"{package.duration_days or 0}d"
-                                }
-                                if rate_limit:
-                                    params['rate-limit'] = rate_limit
-                                if data_limit_bytes:
-                                    params['limit-bytes-total'] = str(data_limit_bytes)
-                                api.get_resource('/ip/hotspot/user').add(**params)
-                                logger.info(f"Synced voucher {code} to MikroTik Hotspot")
-                            elif package.connection_type == 'PPPOE':
-                                api.get_resource('/ppp/secret').add(
-                                    name=code, password=code, service='pppoe',
-                                    profile=package.name
-                                )
-                                logger.info(f"Synced voucher {code} to MikroTik PPPoE")
-                            elif package.connection_type == 'STATIC':
-                                api.get_resource('/ip/dhcp-server/lease').add(
-                                    address=package.ip_address or '192.168.1.100',
-                                    mac_address='',
-                                    comment=f"Voucher {code}",
-                                    server='all',
-                                    lease_time=f"{package.duration_days or 30}d"
-                                )
-                                logger.info(f"Synced voucher {code} to MikroTik Static Lease")
-                            elif package.connection_type == 'VPN':
-                                api.get_resource('/ppp/secret').add(
-                                    name=code, password=code, service='l2tp',
-                                    profile=package.name
-                                )
-                                logger.info(f"Synced voucher {code} to MikroTik VPN")
-                        except Exception as e:
-                            logger.error(f"Failed to sync voucher {code} to MikroTik: {e}")
-                            messages.warning(request, f"Failed to sync voucher {code} to MikroTik: {e}")
-                    elif router.connection_type == 'RADIUS':
-                        try:
-                            db = MySQLdb.connect(
-                                host=router.radius_server, user='radius_user',
-                                passwd=router.radius_secret, db='radius'
-                            )
-                            cursor = db.cursor()
-                            cursor.execute(
-                                "INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                (code, 'Cleartext-Password', ':=', code)
-                            )
-                            if data_limit_bytes:
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (code, 'Mikrotik-Total-Limit', ':=', str(data_limit_bytes))
-                                )
-                            if package.connection_type == 'STATIC':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (code, 'Framed-IP-Address', ':=', package.ip_address or '192.168.1.100')
-                                )
-                            elif package.connection_type == 'VPN':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (code, 'Service-Type', ':=', 'Framed-User')
-                                )
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (code, 'Framed-Protocol', ':=', 'L2TP')
-                                )
-                            db.commit()
-                            db.close()
-                            logger.info(f"Synced voucher {code} to RADIUS")
-                        except Exception as e:
-                            logger.error(f"Failed to sync voucher {code} to RADIUS: {e}")
-                            messages.warning(request, f"Failed to sync voucher {code} to RADIUS: {e}")
+                vouchers = Voucher.objects.bulk_create([
+                    Voucher(code=code, prefix=prefix, package=package, is_active=True)
+                    for code in codes
+                ])
+                result = provision(vouchers)
+                failures = [r for r in result['results'] if not r['ok']]
+                for failure in failures[:5]:
+                    messages.warning(request, f"Failed to sync voucher {failure['username']} to {failure['backend'] or 'router'}: {failure['error']}")
+                if len(failures) > 5:
+                    messages.warning(request, f"{len(failures) - 5} more vouchers failed to sync")
+                logger.info(f"Provisioned {result['ok']} of {len(vouchers)} vouchers ({result['failed']} failed)")
                 
                 messages.success(request, f"Generated {count} vouchers successfully")
                 logger.info(f"Successfully generated {count} vouchers")
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import binascii
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRouterOsError(Exception):
+    """A command was rejected by the router (!trap)."""
+
+
+class AsyncRouterOsConnectionError(AsyncRouterOsError):
+    """The API connection failed, timed out or was closed by the router (!fatal)."""
+
+
+# --- RouterOS API wire format (shared with customers.routeros_sim) ---
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    data = bytearray()
+    for word in words:
+        encoded = word.encode('utf-8')
+        data += encode_length(len(encoded))
+        data += encoded
+    data += b'\x00'
+    return bytes(data)
+
+
+async def read_length(reader):
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first & 0xC0 == 0x80:
+        return ((first & 0x3F) << 8) + (await reader.readexactly(1))[0]
+    if first & 0xE0 == 0xC0:
+        return ((first & 0x1F) << 16) + int.from_bytes(await reader.readexactly(2), 'big')
+    if first & 0xF0 == 0xE0:
+        return ((first & 0x0F) << 24) + int.from_bytes(await reader.readexactly(3), 'big')
+    return int.from_bytes(await reader.readexactly(4), 'big')
+
+
+async def read_sentence(reader):
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode('utf-8', errors='replace'))
+
+
+def parse_attributes(words):
+    """Turn ['=name=x', '.tag=3', ...] into ({'name': 'x'}, tag)."""
+    attributes, tag = {}, None
+    for word in words:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return attributes, tag
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    return str(value)
+
+
+def encode_key(key):
+    """Map Python-style keys to API keys the way routeros_api does (``mac_address`` -> ``mac-address``, ``id`` -> ``.id``)."""
+    key = key.replace('_', '-')
+    return f".{key}" if key in ('id', 'proplist') else key
+
+
+def attribute_words(attributes):
+    return [f"={encode_key(key)}={format_value(value)}" for key, value in attributes.items()]
+
+
+def query_words(filters):
+    return [f"?{encode_key(key)}={format_value(value)}" for key, value in filters.items()]
+
+
+# --- client ---
+
+class _Pending:
+    __slots__ = ('future', 'rows', 'error', 'done')
+
+    def __init__(self, future):
+        self.future = future
+        self.rows = []
+        self.error = None
+        self.done = {}
+
+
+class AsyncRouterOsClient:
+    """asyncio RouterOS API client.
+
+    One TCP connection per router; commands are tagged so several can be in
+    flight on the same connection. Rows come back as dicts keyed like
+    routeros_api's (``.id`` is exposed as ``id``).
+    """
+
+    def __init__(self, host, username, password, port=8728, timeout=15):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self._closed = True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise AsyncRouterOsConnectionError(f"Could not connect to {self.host}:{self.port}: {e}") from e
+        self._closed = False
+        self._read_task = asyncio.ensure_future(self._read_loop())
+        try:
+            await self._login()
+        except Exception:
+            await self.close()
+            raise
+
+    async def _login(self):
+        # RouterOS 6.43+ accepts the password directly; older versions answer
+        # with a challenge that has to be MD5-hashed with the password.
+        _, done = await self.talk('/login', {'name': self.username, 'password': self.password})
+        if 'ret' in done:
+            challenge = binascii.unhexlify(done['ret'])
+            digest = hashlib.md5(b'\x00' + self.password.encode('utf-8') + challenge).hexdigest()
+            await self.talk('/login', {'name': self.username, 'response': f"00{digest}"})
+
+    async def close(self):
+        self._closed = True
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+        self._fail_pending(AsyncRouterOsConnectionError(f"Connection to {self.host} closed"))
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for entry in pending.values():
+            if not entry.future.done():
+                entry.future.set_exception(error)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                words = await read_sentence(self._reader)
+                if not words:
+                    continue
+                reply, rest = words[0], words[1:]
+                attributes, tag = parse_attributes(rest)
+                if reply == '!fatal':
+                    raise AsyncRouterOsConnectionError(f"Router {self.host} closed the session: {rest}")
+                entry = self._pending.get(tag)
+                if entry is None:
+                    continue
+                if reply == '!re':
+                    entry.rows.append({('id' if key == '.id' else key): value for key, value in attributes.items()})
+                elif reply == '!trap':
+                    entry.error = attributes.get('message', 'command failed')
+                elif reply == '!done':
+                    del self._pending[tag]
+                    entry.done = attributes
+                    if not entry.future.done():
+                        entry.future.set_result(entry)
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, OSError, AsyncRouterOsConnectionError) as e:
+            self._closed = True
+            self._fail_pending(e if isinstance(e, AsyncRouterOsConnectionError)
+                               else AsyncRouterOsConnectionError(f"Lost connection to {self.host}: {e}"))
+
+    async def talk(self, command, attributes=None, queries=None, timeout=None):
+        """Send one command; returns (rows, done_attributes) or raises AsyncRouterOsError on !trap."""
+        if self._closed:
+            raise AsyncRouterOsConnectionError(f"Not connected to {self.host}")
+        tag = str(next(self._tags))
+        entry = _Pending(asyncio.get_running_loop().create_future())
+        self._pending[tag] = entry
+        words = [command] + attribute_words(attributes or {}) + list(queries or []) + [f".tag={tag}"]
+        try:
+            self._writer.write(encode_sentence(words))
+            await self._writer.drain()
+            await asyncio.wait_for(asyncio.shield(entry.future), timeout or self.timeout)
+        except asyncio.TimeoutError as e:
+            self._pending.pop(tag, None)
+            raise AsyncRouterOsConnectionError(f"{command} on {self.host} timed out") from e
+        except OSError as e:
+            self._pending.pop(tag, None)
+            raise AsyncRouterOsConnectionError(f"{command} on {self.host} failed: {e}") from e
+        if entry.error:
+            raise AsyncRouterOsError(f"{command} on {self.host}: {entry.error}")
+        return entry.rows, entry.done
+
+    async def print(self, path, proplist=None, **filters):
+        """Return rows under ``path``, optionally filtered by exact-match attributes."""
+        attributes = {'proplist': ','.join(proplist)} if proplist else {}
+        rows, _ = await self.talk(f"{path}/print", attributes, query_words(filters))
+        return rows
+
+    async def add(self, path, attributes):
+        _, done = await self.talk(f"{path}/add", attributes)
+        return done.get('ret')
+
+    async def set(self, path, id, attributes):
+        await self.talk(f"{path}/set", dict(attributes, id=id))
+
+    async def remove(self, path, *ids):
+        await self.talk(f"{path}/remove", {'id': ','.join(ids)})
+
+
+def client_for(router, timeout=15):
+    """Build an (unconnected) AsyncRouterOsClient from a Router."""
+    return AsyncRouterOsClient(
+        router.ip_address, router.username, router.password, port=router.api_port or 8728, timeout=timeout
+    )
+
+
+async def run_on_routers(routers, operation, concurrency=100, timeout=15):
+    """Run ``await operation(router, client)`` against many routers from one event loop.
+
+    At most ``concurrency`` routers are connected at once. Returns
+    {router.id: {'result', 'error', 'unreachable', 'seconds'}}, where
+    ``unreachable`` tells a connection failure or timeout from a rejected
+    command; one router failing never affects the others.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(router):
+        started = time.monotonic()
+        async with semaphore:
+            try:
+                async with client_for(router, timeout=timeout) as client:
+                    result = await operation(router, client)
+                return router.id, {
+                    'result': result, 'error': None, 'unreachable': False,
+                    'seconds': round(time.monotonic() - started, 3),
+                }
+            except Exception as e:
+                logger.error(f"Async RouterOS operation failed on {router.name}: {e}")
+                return router.id, {
+                    'result': None, 'error': str(e), 'unreachable': isinstance(e, AsyncRouterOsConnectionError),
+                    'seconds': round(time.monotonic() - started, 3),
+                }
+
+    return dict(await asyncio.gather(*(run(router) for router in routers)))
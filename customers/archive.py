@@ -0,0 +1,201 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import SessionLog
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+FIELDS = (
+    'id', 'subscription_id', 'subscription__customer_id', 'username', 'acct_unique_id', 'acct_session_id',
+    'start_time', 'end_time', 'data_used',
+)
+
+
+def _record(row):
+    record = dict(zip(FIELDS, row))
+    record['customer_id'] = record.pop('subscription__customer_id')
+    for key in ('start_time', 'end_time'):
+        if record[key] is not None:
+            record[key] = record[key].isoformat()
+    return record
+
+
+def load_manifest(archive_dir):
+    try:
+        with open(os.path.join(archive_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 1, 'partitions': []}
+
+
+def _save_manifest(archive_dir, manifest):
+    path = os.path.join(archive_dir, MANIFEST)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+class _Partition:
+    """One gzip'd NDJSON file being written for a single day of session start times."""
+
+    def __init__(self, archive_dir, day, run):
+        self.day = day
+        self.relative = os.path.join(day[:4], day[5:7], f"sessions-{day}.{run}.ndjson.gz")
+        self.path = os.path.join(archive_dir, self.relative)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = gzip.open(f"{self.path}.tmp", 'wt', encoding='utf-8', compresslevel=6)
+        self.rows = 0
+        self.first_start = self.last_start = None
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+        self.rows += 1
+        start = record['start_time']
+        self.first_start = min(self.first_start or start, start)
+        self.last_start = max(self.last_start or start, start)
+
+    def close(self):
+        self.file.close()
+        digest = hashlib.sha256()
+        with open(f"{self.path}.tmp", 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+            os.fsync(f.fileno())
+        os.replace(f"{self.path}.tmp", self.path)
+        return {
+            'file': self.relative,
+            'date': self.day,
+            'rows': self.rows,
+            'first_start': self.first_start,
+            'last_start': self.last_start,
+            'sha256': digest.hexdigest(),
+            'created_at': timezone.now().isoformat(),
+        }
+
+    def discard(self):
+        self.file.close()
+        os.remove(f"{self.path}.tmp")
+
+
+def archive_sessions(older_than_days=None, archive_dir=None, batch_size=None, max_rows=None):
+    """Move sessions that started and were last updated before the cutoff out of SessionLog.
+
+    Rows are streamed in id order into one gzip'd NDJSON file per start
+    date (``YYYY/MM/sessions-YYYY-MM-DD.<run>.ndjson.gz``), the files are
+    fsynced and added to the manifest, and only then are the rows deleted.
+    A crash before the delete leaves the rows in place to be archived
+    again; read_sessions() drops the duplicates. A row updated after it was
+    read (e.g. a late accounting stop) is no longer stale and is kept, to be
+    archived again later with its new values. Returns counts.
+    """
+    older_than_days = older_than_days or settings.SESSION_ARCHIVE_AFTER_DAYS
+    archive_dir = archive_dir or settings.SESSION_ARCHIVE_DIR
+    batch_size = batch_size or settings.SESSION_ARCHIVE_BATCH_SIZE
+    max_rows = max_rows or settings.SESSION_ARCHIVE_MAX_ROWS
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    stale = SessionLog.objects.filter(start_time__lt=cutoff, updated_at__lt=cutoff)
+    run = timezone.now().strftime('%Y%m%dT%H%M%S')
+    partitions, ids, last_id = {}, [], 0
+    try:
+        while len(ids) < max_rows:
+            rows = list(
+                stale.filter(id__gt=last_id).order_by('id').values_list(*FIELDS)[:min(batch_size, max_rows - len(ids))]
+            )
+            if not rows:
+                break
+            for row in rows:
+                record = _record(row)
+                day = record['start_time'][:10]
+                if day not in partitions:
+                    partitions[day] = _Partition(archive_dir, day, run)
+                partitions[day].write(record)
+                ids.append(record['id'])
+            last_id = rows[-1][0]
+    except Exception:
+        for partition in partitions.values():
+            partition.discard()
+        raise
+    if not ids:
+        return {'archived': 0, 'partitions': 0, 'seconds': round(time.monotonic() - started, 3)}
+
+    entries = [partition.close() for partition in partitions.values()]
+    manifest = load_manifest(archive_dir)
+    manifest['partitions'].extend(entries)
+    _save_manifest(archive_dir, manifest)
+    deleted = 0
+    for i in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            # Any write since the read bumped updated_at past the cutoff, so
+            # re-applying the stale filter only deletes rows as they were archived.
+            deleted += stale.filter(id__in=ids[i:i + batch_size]).delete()[0]
+    stats = {
+        'archived': len(ids),
+        'kept': len(ids) - deleted,
+        'partitions': len(entries),
+        'cutoff': cutoff.isoformat(),
+        'more': len(ids) >= max_rows,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    logger.info(f"Archived {len(ids)} sessions into {len(entries)} partitions in {stats['seconds']}s")
+    return stats
+
+
+def read_sessions(customer_id=None, subscription_ids=None, start=None, end=None, archive_dir=None):
+    """Yield archived session dicts matching the filters, oldest partition first.
+
+    ``start``/``end`` bound the session start time; partitions outside the
+    range are skipped using the manifest, so only the days asked for are
+    decompressed.
+    """
+    archive_dir = archive_dir or settings.SESSION_ARCHIVE_DIR
+    subscription_ids = set(subscription_ids) if subscription_ids is not None else None
+    # Partitions are named after the UTC date of their sessions' start.
+    start_day = start.astimezone(dt_timezone.utc).date().isoformat() if start else None
+    end_day = end.astimezone(dt_timezone.utc).date().isoformat() if end else None
+    seen = set()
+    # Newest run first within a day, so a session archived twice yields its latest values.
+    partitions = sorted(load_manifest(archive_dir)['partitions'], key=lambda entry: entry['created_at'], reverse=True)
+    for entry in sorted(partitions, key=lambda entry: entry['date']):
+        if (start_day and entry['date'] < start_day) or (end_day and entry['date'] > end_day):
+            continue
+        with gzip.open(os.path.join(archive_dir, entry['file']), 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if customer_id is not None and record['customer_id'] != customer_id:
+                    continue
+                if subscription_ids is not None and record['subscription_id'] not in subscription_ids:
+                    continue
+                start_time = datetime.fromisoformat(record['start_time'])
+                if (start and start_time < start) or (end and start_time >= end):
+                    continue
+                if record['id'] in seen:
+                    continue
+                seen.add(record['id'])
+                yield record
+
+
+def customer_history(customer_id, start=None, end=None):
+    """All sessions of a customer from the hot table and the archive, oldest first."""
+    hot = SessionLog.objects.filter(subscription__customer_id=customer_id)
+    if start:
+        hot = hot.filter(start_time__gte=start)
+    if end:
+        hot = hot.filter(start_time__lt=end)
+    sessions = [_record(row) for row in hot.values_list(*FIELDS)]
+    hot_ids = {session['id'] for session in sessions}
+    sessions.extend(
+        record for record in read_sessions(customer_id=customer_id, start=start, end=end) if record['id'] not in hot_ids
+    )
+    return sorted(sessions, key=lambda session: session['start_time'])
@@ -0,0 +1,82 @@
+import time
+import atexit
+import logging
+import threading
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer:
+    """Collects AuditLog entries in memory and writes them with bulk_create.
+
+    A flush happens once ``max_size`` entries are waiting or the oldest one
+    is ``max_age`` seconds old (checked on each add), and at the end of every
+    request (customers.middleware), Celery task and worker process
+    (customers.signals). Entries keep the time they were logged, not the
+    time they were flushed. The size and age triggers wait while the caller
+    is inside transaction.atomic(), so entries logged there are written after
+    it and survive a rollback; an explicit flush() inside an atomic block
+    writes within that transaction.
+    """
+
+    def __init__(self, max_size=500, max_age=5.0):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = []
+        self.oldest = None
+        self.lock = threading.Lock()
+
+    def add(self, entries):
+        with self.lock:
+            if not self.entries:
+                self.oldest = time.monotonic()
+            self.entries.extend(entries)
+            due = len(self.entries) >= self.max_size or time.monotonic() - self.oldest >= self.max_age
+        if due and not connection.in_atomic_block:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered; returns the number of entries written."""
+        with self.lock:
+            entries, self.entries = self.entries, []
+        if not entries:
+            return 0
+        try:
+            AuditLog.objects.bulk_create(entries, batch_size=1000)
+        except Exception as e:
+            logger.error(f"Failed to write {len(entries)} audit entries: {e}")
+            with self.lock:
+                # Keep them for the next flush unless the database has been
+                # failing for long enough that the buffer would grow unbounded.
+                if len(self.entries) + len(entries) <= self.max_size * 10:
+                    self.entries[:0] = entries
+                    self.oldest = time.monotonic()
+            return 0
+        return len(entries)
+
+
+_buffer = AuditBuffer(max_size=settings.AUDIT_BUFFER_SIZE, max_age=settings.AUDIT_FLUSH_INTERVAL)
+atexit.register(_buffer.flush)
+
+
+def entry(action, model, object_id, user=None):
+    """Build an unsaved AuditLog stamped with the current time."""
+    return AuditLog(action=action, model=model, object_id=str(object_id), user=user, created_at=timezone.now())
+
+
+def log(action, model, object_id, user=None):
+    """Buffered replacement for ``AuditLog.objects.create(...)``."""
+    _buffer.add([entry(action, model, object_id, user)])
+
+
+def log_many(entries):
+    """Buffer several entries built with entry()."""
+    _buffer.add(list(entries))
+
+
+def flush():
+    return _buffer.flush()
@@ -0,0 +1,47 @@
+import logging
+from .reconcile import HOTSPOT_USERS, PPP_SECRETS, QUEUES, queue_name, bulk_call
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_ids(resource, names):
+    """Map the given names to RouterOS ``.id``s with a single print; names not on the router are left out."""
+    names = set(names)
+    if not names:
+        return {}
+    rows = resource.call('print', {'proplist': '.id,name'})
+    return {row['name']: row['id'] for row in rows if row.get('name') in names and 'id' in row}
+
+
+def set_users_disabled(api, rows, disabled=True):
+    """Disable (or enable) many subscriptions' hotspot users and PPP secrets in a few round trips.
+
+    ``rows`` are (id, router_id, username, connection_type) tuples. Each table
+    is printed once to resolve names to ids and then changed with chunked
+    bulk commands; disabling also removes the PPP queues, which the next sync
+    re-adds for enabled users. Entries that are not on the router count as
+    done. Returns (done_ids, failed_ids).
+    """
+    command = 'disable' if disabled else 'enable'
+    by_path = {HOTSPOT_USERS: {}, PPP_SECRETS: {}}
+    queues = {}
+    for sub_id, _, username, connection_type in rows:
+        if connection_type == 'HOTSPOT':
+            by_path[HOTSPOT_USERS][username] = sub_id
+        elif connection_type == 'PPPOE' or connection_type.startswith('VPN'):
+            by_path[PPP_SECRETS][username] = sub_id
+            if disabled:
+                queues[queue_name(username)] = sub_id
+    failed_ids = set()
+    for path, owners in list(by_path.items()) + [(QUEUES, queues)]:
+        if not owners:
+            continue
+        resource = api.get_resource(path)
+        ids = resolve_ids(resource, owners)
+        owner_by_id = {row_id: owners[name] for name, row_id in ids.items()}
+        failed = bulk_call(resource, 'remove' if path == QUEUES else command, list(owner_by_id))
+        for row_id, error in failed.items():
+            logger.error(f"Failed to {command} {path} entry {row_id}: {error}")
+            failed_ids.add(owner_by_id[row_id])
+    done_ids = [row[0] for row in rows if row[0] not in failed_ids]
+    return done_ids, [row[0] for row in rows if row[0] in failed_ids]
@@ -0,0 +1,112 @@
+import uuid
+import inspect
+import logging
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('triggered', 'scheduled', 'merged', 'ran', 'skipped')
+
+
+def _key(kind, name):
+    return f"coalesce:{kind}:{name}"
+
+
+def _count(name, event):
+    key = _key(f"metrics:{event}", name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def trigger(task, window=None):
+    """Schedule ``task`` to run once ``window`` seconds from now.
+
+    Triggers that arrive while a run is already pending are merged into it.
+    """
+    window = settings.SYNC_COALESCE_WINDOW if window is None else window
+    _count(task.name, 'triggered')
+    if cache.add(_key('pending', task.name), 1, timeout=window + settings.SYNC_COALESCE_PENDING_GRACE):
+        task.apply_async(countdown=window)
+        _count(task.name, 'scheduled')
+        logger.debug(f"Scheduled {task.name} in {window}s")
+    else:
+        _count(task.name, 'merged')
+        logger.debug(f"Merged trigger for {task.name} into pending run")
+
+
+def _variant(signature, args, kwargs):
+    """Arguments of a call that differ from the defaults, as a cache-key-safe string."""
+    bound = signature.bind(*args, **kwargs)
+    explicit = {
+        name: value for name, value in bound.arguments.items()
+        if value != signature.parameters[name].default
+    }
+    return ','.join(f"{name}={value!r}" for name, value in sorted(explicit.items()))
+
+
+def single_flight(name=None, bypass=None):
+    """Decorator for task bodies: never run two copies at once across workers.
+
+    Clears the pending marker set by trigger() so changes arriving during the
+    run schedule a fresh one, then asks for a run by setting a rerun flag and
+    takes a cache lock. If another worker holds the lock the call returns
+    straight away and the holder runs the body again once it is done, so a
+    skipped call is never lost.
+
+    Calls only coalesce with calls made with the same arguments: the lock and
+    rerun keys include any argument that differs from its default, so e.g. a
+    ``mode='swap'`` run is never replaced by a default one. ``bypass`` is a
+    predicate on the call's arguments; when it is true the body runs directly,
+    without the lock (for read-only calls such as dry runs).
+    """
+    def decorator(func):
+        base_name = name or f"{func.__module__}.{func.__name__}"
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if bypass is not None and bypass(*args, **kwargs):
+                return func(*args, **kwargs)
+            variant = _variant(signature, args, kwargs)
+            lock_name = f"{base_name}({variant})" if variant else base_name
+            if not variant:
+                # trigger() schedules calls with the default arguments.
+                cache.delete(_key('pending', base_name))
+            rerun_key = _key('rerun', lock_name)
+            lock_key = _key('lock', lock_name)
+            cache.set(rerun_key, 1, timeout=settings.SYNC_LOCK_TIMEOUT)
+            result = {'skipped': True}
+            # Checked again after releasing the lock: a call skipped between
+            # our last check of the flag and the release is picked up here.
+            while cache.get(rerun_key) is not None:
+                token = uuid.uuid4().hex
+                if not cache.add(lock_key, token, timeout=settings.SYNC_LOCK_TIMEOUT):
+                    _count(base_name, 'skipped')
+                    logger.info(f"Skipped {lock_name}: another run holds the lock and will run again")
+                    return result
+                try:
+                    while cache.delete(rerun_key):
+                        _count(base_name, 'ran')
+                        result = func(*args, **kwargs)
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+            return result
+        return wrapper
+    return decorator
+
+
+def metrics(names):
+    """Return {name: {event: count, 'running': bool, 'pending': bool}} for the given task names."""
+    result = {}
+    for name in names:
+        counts = cache.get_many([_key(f"metrics:{event}", name) for event in EVENTS])
+        result[name] = {event: counts.get(_key(f"metrics:{event}", name), 0) for event in EVENTS}
+        result[name]['running'] = cache.get(_key('lock', name)) is not None
+        result[name]['pending'] = cache.get(_key('pending', name)) is not None
+    return result
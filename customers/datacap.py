@@ -0,0 +1,146 @@
+import time
+import logging
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+from .models import SessionLog, Subscription, SubscriptionUsage
+from .expiry import suspend_subscriptions
+from . import timeseries
+
+logger = logging.getLogger(__name__)
+
+LIMITED = {'is_active': True, 'package__data_limit__gt': 0}
+DAY = 86400
+
+
+def _array(rows, columns):
+    return np.array(rows, dtype=np.int64).reshape(-1, columns)
+
+
+def _scatter(ids, keys, values):
+    """Place ``values`` (keyed by ``keys``) at the positions of the sorted ``ids``; missing ids get 0."""
+    result = np.zeros(len(ids), dtype=np.int64)
+    if not len(ids) or not len(keys):
+        return result
+    positions = np.searchsorted(ids, keys)
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == keys[found]
+    result[positions[found]] = values[found]
+    return result
+
+
+def _series_totals(subscriptions):
+    """Total bytes per subscription since its start, read from the daily usage series.
+
+    Subscriptions are grouped by start day so each query() only spans as
+    many buckets as its group is old. Returns (ids, totals) arrays.
+    """
+    groups = defaultdict(list)
+    for subscription_id, start_date in subscriptions:
+        groups[start_date.date()].append((subscription_id, start_date))
+    keys, values = [], []
+    for group in groups.values():
+        start = min(start_date for _, start_date in group)
+        for subscription_id, (bytes_in, bytes_out) in timeseries.totals(
+            [subscription_id for subscription_id, _ in group], start, resolution=DAY
+        ).items():
+            keys.append(subscription_id)
+            values.append(bytes_in + bytes_out)
+    return np.array(keys, dtype=np.int64), np.array(values, dtype=np.int64)
+
+
+def load():
+    """Load every active capped subscription as sorted arrays.
+
+    Usage of subscriptions on API routers is the usage time series (see
+    customers.usage) since the subscription started. RADIUS routers are not
+    polled, so their subscriptions are measured by summing SessionLog.
+    Returns (ids, limit_bytes, used_bytes, notified_level).
+    """
+    rows = list(Subscription.objects.filter(**LIMITED).order_by('id').values_list(
+        'id', 'package__data_limit', 'start_date', 'router__connection_type'
+    ))
+    subscriptions = _array([row[:2] for row in rows], 2)
+    ids = subscriptions[:, 0]
+    limits = subscriptions[:, 1] * 1024 * 1024
+    polled_ids, polled = _series_totals(
+        (subscription_id, start_date) for subscription_id, _, start_date, connection_type in rows
+        if connection_type != 'RADIUS'
+    )
+    accounted = _array(list(SessionLog.objects.filter(
+        **{f"subscription__{key}": value for key, value in LIMITED.items()},
+        subscription__router__connection_type='RADIUS', data_used__isnull=False
+    ).values('subscription_id').annotate(total=Sum('data_used')).values_list('subscription_id', 'total')), 2)
+    notified = _array(list(SubscriptionUsage.objects.filter(
+        **{f"subscription__{key}": value for key, value in LIMITED.items()}
+    ).values_list('subscription_id', 'cap_level')), 2)
+    # The two sources cover disjoint sets of subscriptions.
+    used = _scatter(ids, polled_ids, polled) + _scatter(ids, accounted[:, 0], accounted[:, 1])
+    return ids, limits, used, _scatter(ids, notified[:, 0], notified[:, 1])
+
+
+def levels(limits, used, warning_percent):
+    """Vectorized threshold check: 100 where the cap is reached, ``warning_percent`` past the warning, else 0."""
+    percent = used * 100 // np.maximum(limits, 1)
+    return np.select([percent >= 100, percent >= warning_percent], [100, warning_percent], 0)
+
+
+def save_levels(subscription_ids, new_levels, batch_size=1000):
+    """Record the cap level acted on, creating usage rows for subscriptions only seen through RADIUS."""
+    unique_fields = ['subscription'] if connection.features.supports_update_conflicts_with_target else None
+    SubscriptionUsage.objects.bulk_create(
+        [SubscriptionUsage(subscription_id=int(subscription_id), cap_level=int(level))
+         for subscription_id, level in zip(subscription_ids, new_levels)],
+        batch_size=batch_size, update_conflicts=True, unique_fields=unique_fields, update_fields=['cap_level', 'updated_at']
+    )
+
+
+def enforce():
+    """Check every active capped subscription against its package's data_limit in one pass.
+
+    Subscriptions crossing DATA_CAP_WARNING_PERCENT get a warning; ones
+    reaching 100% are suspended in bulk when DATA_CAP_ACTION is 'disable'
+    and always notified. Each threshold is acted on once per subscription,
+    and notices are queued as batched Celery tasks. Returns counts and
+    timings.
+    """
+    from .tasks import send_data_cap_notices
+    started = time.monotonic()
+    ids, limits, used, notified = load()
+    loaded = time.monotonic()
+    current = levels(limits, used, settings.DATA_CAP_WARNING_PERCENT)
+    changed = current != notified
+    raised = current > notified
+    warned = ids[raised & (current == settings.DATA_CAP_WARNING_PERCENT)].tolist()
+    exceeded = ids[raised & (current == 100)].tolist()
+    checked = time.monotonic()
+
+    stats = {'checked': len(ids), 'warned': len(warned), 'exceeded': len(exceeded), 'suspended': 0}
+    if exceeded and settings.DATA_CAP_ACTION == 'disable':
+        stats['suspended'] = suspend_subscriptions(Subscription.objects.filter(id__in=exceeded))['suspended']
+    if changed.any():
+        save_levels(ids[changed], current[changed])
+    batch_size = settings.DATA_CAP_NOTICE_BATCH_SIZE
+    for level, subscription_ids in ((settings.DATA_CAP_WARNING_PERCENT, warned), (100, exceeded)):
+        for i in range(0, len(subscription_ids), batch_size):
+            send_data_cap_notices.delay(subscription_ids[i:i + batch_size], level)
+    stats.update(
+        load_seconds=round(loaded - started, 3),
+        check_seconds=round(checked - loaded, 4),
+        seconds=round(time.monotonic() - started, 3),
+    )
+    if warned or exceeded:
+        logger.info(f"Data caps: {stats}")
+    return stats
+
+
+def notice(subscription, level):
+    """Text of the SMS sent when ``subscription`` reaches ``level`` percent of its data limit."""
+    package = subscription.package
+    if level < 100:
+        return f"You have used {level}% of the {package.data_limit} MB data allowance on {package.name}."
+    if settings.DATA_CAP_ACTION == 'disable':
+        return f"You have used all {package.data_limit} MB of {package.name}. Your connection has been paused; buy a new package to reconnect."
+    return f"You have used all {package.data_limit} MB of {package.name}."
@@ -0,0 +1,167 @@
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Router, Subscription, SubscriptionChange
+from .bulk_state import set_users_disabled
+from .routeros import router_api
+from . import audit, retry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _deactivate(queryset, now, change_type):
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().filter(is_active=True).values_list(
+            'id', 'router_id', 'username', 'connection_type'
+        ))
+        for chunk in _chunks(rows):
+            Subscription.objects.filter(id__in=[row[0] for row in chunk], is_active=True).update(
+                is_active=False, updated_at=now
+            )
+        SubscriptionChange.objects.bulk_create([
+            SubscriptionChange(subscription_id=sub_id, router_id=router_id, username=username, change_type=change_type)
+            for sub_id, router_id, username, _ in rows
+        ], batch_size=1000)
+    return rows
+
+
+def deactivate_expired(now=None, ids=None):
+    """Flip every active subscription past its end_date to inactive in bulk.
+
+    The expired rows are locked and their ids read, then deactivated with
+    chunked UPDATEs in the same transaction; EXPIRED outbox rows are written
+    alongside since update() bypasses the model signals. ``ids`` restricts the
+    pass to specific subscriptions. Returns the deactivated rows as
+    (id, router_id, username, connection_type) tuples.
+    """
+    now = now or timezone.now()
+    expired = Subscription.objects.filter(end_date__lt=now)
+    if ids is not None:
+        expired = expired.filter(id__in=list(ids))
+    return _deactivate(expired, now, 'EXPIRED')
+
+
+def disable_on_router(api, rows):
+    """Disable the given (id, router_id, username, connection_type) rows over one session.
+
+    Uses bulk commands, so a few thousand users take a handful of round
+    trips. Returns (disabled_ids, failed_ids).
+    """
+    return set_users_disabled(api, rows, disabled=True)
+
+
+def _disable_router_group(router, rows):
+    started = time.monotonic()
+    try:
+        with router_api(router) as api:
+            disabled, failed = disable_on_router(api, rows)
+        error = None
+    except Exception as e:
+        logger.error(f"Error disabling {len(rows)} expired subscriptions on router {router.name}: {e}")
+        disabled, failed, error = [], [row[0] for row in rows], str(e)
+    finally:
+        connection.close()
+    return {
+        'router': router.name,
+        'disabled': disabled,
+        'failed': failed,
+        'error': error,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+
+def disable_on_routers(rows):
+    """Disable deactivated subscriptions on their routers, one session per router, routers in parallel."""
+    groups = defaultdict(list)
+    for row in rows:
+        if row[1]:
+            groups[row[1]].append(row)
+    routers = {
+        router.id: router
+        for router in Router.objects.filter(id__in=list(groups)).exclude(connection_type='RADIUS')
+    }
+    groups = {router_id: group for router_id, group in groups.items() if router_id in routers}
+    if not groups:
+        return {}
+    workers = max(1, min(settings.ROUTER_SYNC_CONCURRENCY, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='expire-router') as pool:
+        futures = {
+            router_id: pool.submit(_disable_router_group, routers[router_id], group)
+            for router_id, group in groups.items()
+        }
+        return {router_id: future.result() for router_id, future in futures.items()}
+
+
+def _disable_deactivated(rows, started):
+    """Disable deactivated rows on their routers, queue retries and audit; returns stats."""
+    results = disable_on_routers(rows) if rows else {}
+    disabled_ids = [sub_id for result in results.values() for sub_id in result['disabled']]
+    failed_ids = [sub_id for result in results.values() for sub_id in result['failed']]
+    usernames = {row[0]: row[2] for row in rows}
+    retry.record_failures('DISABLE', [
+        (sub_id, router_id, usernames[sub_id], result['error'] or 'disable failed')
+        for router_id, result in results.items() for sub_id in result['failed']
+    ])
+    audit.log_many(
+        [audit.entry('disable_subscription', 'Subscription', sub_id) for sub_id in disabled_ids] +
+        [audit.entry('disable_subscription_failed', 'Subscription', sub_id) for sub_id in failed_ids]
+    )
+    return {
+        'disabled': len(disabled_ids),
+        'failed': len(failed_ids),
+        'routers': {
+            str(router_id): {
+                'router': result['router'],
+                'disabled': len(result['disabled']),
+                'failed': len(result['failed']),
+                'error': result['error'],
+                'seconds': result['seconds'],
+            }
+            for router_id, result in results.items()
+        },
+        'seconds': round(time.monotonic() - started, 3),
+    }
+
+
+def expire_subscriptions(now=None, ids=None):
+    """Deactivate expired subscriptions and disable them on their routers in bulk.
+
+    Router failures are queued in SyncRetry. Returns counts plus per-router
+    timings and failures.
+    """
+    started = time.monotonic()
+    rows = deactivate_expired(now=now, ids=ids)
+    stats = dict(_disable_deactivated(rows, started), expired=len(rows))
+    if rows:
+        logger.info(
+            f"Expired {len(rows)} subscriptions in {stats['seconds']}s: "
+            f"{stats['disabled']} disabled on {len(stats['routers'])} routers, {stats['failed']} failed"
+        )
+    return stats
+
+
+def suspend_subscriptions(queryset):
+    """Deactivate every active subscription in ``queryset`` regardless of end_date and disable it in bulk.
+
+    For mass events such as a discontinued package or a withdrawn voucher
+    batch. Returns the same stats as expire_subscriptions, with 'suspended'.
+    """
+    started = time.monotonic()
+    rows = _deactivate(queryset, timezone.now(), 'UPDATED')
+    stats = dict(_disable_deactivated(rows, started), suspended=len(rows))
+    logger.info(
+        f"Suspended {len(rows)} subscriptions in {stats['seconds']}s: "
+        f"{stats['disabled']} disabled on {len(stats['routers'])} routers, {stats['failed']} failed"
+    )
+    return stats
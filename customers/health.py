@@ -0,0 +1,148 @@
+import time
+import logging
+from django.conf import settings
+from django.core.cache import cache
+import routeros_api
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN = 'closed', 'open'
+
+
+def _key(router_id):
+    return f"router-health:{router_id}"
+
+
+def _initial():
+    return {
+        'state': CLOSED,
+        'failures': 0,
+        'latency_ms': None,
+        'last_error': '',
+        'last_success': None,
+        'last_failure': None,
+        'opened_at': None,
+        'next_probe': None,
+        'probes': 0,
+    }
+
+
+def get_health(router_id):
+    """Return the health record for one router (a closed, empty record if none is stored)."""
+    return cache.get(_key(router_id)) or _initial()
+
+
+def get_health_many(router_ids):
+    """Return {router_id: health record} for several routers in one cache round trip."""
+    router_ids = list(router_ids)
+    stored = cache.get_many([_key(router_id) for router_id in router_ids])
+    return {router_id: stored.get(_key(router_id)) or _initial() for router_id in router_ids}
+
+
+def _save(router_id, health):
+    cache.set(_key(router_id), health, timeout=settings.ROUTER_HEALTH_TTL)
+
+
+def is_open(health):
+    return health['state'] == OPEN
+
+
+def unavailable(routers):
+    """Return the ids of the given routers whose circuit is open."""
+    routers = list(routers)
+    health = get_health_many(router.id for router in routers)
+    return {router_id for router_id, record in health.items() if is_open(record)}
+
+
+def record_success(router, latency=None):
+    """Note a successful call; closes the circuit if it was open."""
+    health = get_health(router.id)
+    was_open = is_open(health)
+    if latency is not None:
+        latency_ms = latency * 1000
+        previous = health['latency_ms']
+        # Exponentially weighted so one slow call doesn't swamp the average.
+        health['latency_ms'] = round(latency_ms if previous is None else 0.8 * previous + 0.2 * latency_ms, 1)
+    health.update(state=CLOSED, failures=0, last_success=time.time(), opened_at=None, next_probe=None, probes=0)
+    _save(router.id, health)
+    if was_open:
+        logger.info(f"Router {router.name} is reachable again, circuit closed")
+    return health
+
+
+def record_failure(router, error):
+    """Note a failed connection; opens the circuit after ROUTER_CIRCUIT_FAILURE_THRESHOLD in a row."""
+    health = get_health(router.id)
+    now = time.time()
+    health['failures'] += 1
+    health['last_error'] = str(error)[:500]
+    health['last_failure'] = now
+    if is_open(health):
+        # A failed probe: back off before the next one.
+        health['probes'] += 1
+        delay = min(settings.ROUTER_CIRCUIT_PROBE_INTERVAL * 2 ** health['probes'], settings.ROUTER_CIRCUIT_MAX_PROBE_INTERVAL)
+        health['next_probe'] = now + delay
+    elif health['failures'] >= settings.ROUTER_CIRCUIT_FAILURE_THRESHOLD:
+        health.update(state=OPEN, opened_at=now, next_probe=now + settings.ROUTER_CIRCUIT_PROBE_INTERVAL, probes=0)
+        logger.warning(f"Router {router.name} failed {health['failures']} times in a row, circuit opened: {error}")
+    _save(router.id, health)
+    return health
+
+
+def reset(router):
+    """Forget a router's health history, closing its circuit."""
+    cache.delete(_key(router.id))
+
+
+def due_for_probe(routers):
+    """Return the routers whose circuit is open and whose next probe time has passed."""
+    routers = list(routers)
+    health = get_health_many(router.id for router in routers)
+    now = time.time()
+    return [
+        router for router in routers
+        if is_open(health[router.id]) and (health[router.id]['next_probe'] or 0) <= now
+    ]
+
+
+def probe(router):
+    """Open a fresh session to ``router`` outside the pool and read its identity.
+
+    Records the outcome, so a successful probe closes the circuit. Returns
+    True if the router answered.
+    """
+    started = time.monotonic()
+    api_pool = routeros_api.RouterOsApiPool(
+        router.ip_address,
+        username=router.username,
+        password=router.password,
+        port=router.api_port or 8728,
+        use_ssl=False,
+        plaintext_login=settings.ROUTEROS_PLAINTEXT_LOGIN
+    )
+    api_pool.socket_timeout = settings.ROUTER_CIRCUIT_PROBE_TIMEOUT
+    try:
+        api_pool.get_api().get_resource('/system/identity').get()
+    except Exception as e:
+        logger.info(f"Probe of router {router.name} failed: {e}")
+        record_failure(router, e)
+        return False
+    finally:
+        try:
+            api_pool.disconnect()
+        except Exception:
+            pass
+    record_success(router, time.monotonic() - started)
+    return True
+
+
+def describe(health):
+    """Short human-readable summary for the admin."""
+    if is_open(health):
+        retry = max(0, int((health['next_probe'] or 0) - time.time()))
+        return f"Open ({health['failures']} failures, probe in {retry}s): {health['last_error']}"
+    if health['failures']:
+        return f"Degraded ({health['failures']} failures): {health['last_error']}"
+    if health['latency_ms'] is not None:
+        return f"OK ({health['latency_ms']} ms)"
+    return "Unknown"
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from customers.archive import archive_sessions
+
+
+class Command(BaseCommand):
+    help = "Move old SessionLog rows into date-partitioned, compressed archive files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, help="Archive sessions idle for this many days (default SESSION_ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--all', action='store_true', help="Keep going until nothing is left to archive")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            stats = archive_sessions(older_than_days=options['older_than'])
+            total += stats['archived']
+            self.stdout.write(f"Archived {stats['archived']} sessions into {stats['partitions']} partitions in {stats['seconds']}s")
+            if not (options['all'] and stats.get('more')):
+                break
+        self.stdout.write(f"Done: {total} sessions archived")
@@ -0,0 +1,114 @@
+import time
+import uuid
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from companies.models import Company
+from customers import audit
+from customers.expiry import expire_subscriptions
+from customers.models import Customer, Location, Package, Router, Subscription
+from customers.routeros import get_router_pool
+from customers.routeros_sim import RouterSimulator
+from customers.sync import sync_routers
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark router sync and bulk expiry against simulated routers (no hardware needed). "
+        "Runs in a throwaway test database, never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routers', type=int, default=10)
+        parser.add_argument('--subscriptions', type=int, default=200, help="Subscriptions per router")
+        parser.add_argument('--latency-ms', type=float, default=0.0)
+        parser.add_argument('--failure-rate', type=float, default=0.0)
+        parser.add_argument('--drop-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        simulator = RouterSimulator(
+            count=options['routers'],
+            latency=options['latency_ms'] / 1000,
+            failure_rate=options['failure_rate'],
+            drop_rate=options['drop_rate'],
+            seed=options['seed'],
+        )
+        # Fixtures, audit entries and outbox rows all go to a test database
+        # created for this run, the same way the test runner does it.
+        database = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with simulator.running():
+                company = self.create_fixtures(simulator, options['subscriptions'])
+                try:
+                    for phase, (seconds, operations, failed) in self.run_phases(company).items():
+                        self.report(phase, seconds, operations, failed)
+                finally:
+                    for router in Router.objects.filter(company=company):
+                        get_router_pool().close_router(router.id)
+                    audit.flush()
+        finally:
+            connection.creation.destroy_test_db(database, verbosity=0)
+
+    def create_fixtures(self, simulator, per_router):
+        marker = uuid.uuid4().hex[:8]
+        company = Company.objects.create(name=f"RouterOS benchmark {marker}", email=f"benchmark-{marker}@sim.invalid")
+        location = Location.objects.create(company=company, name='Simulator')
+        customer = Customer.objects.create(
+            company=company, name='Benchmark', email=f"benchmark-{marker}@sim.invalid", raw_phone='0700000000',
+            password='benchmark'
+        )
+        now = timezone.now()
+        subscriptions = []
+        for sim_router, host, port in simulator.endpoints:
+            router = Router.objects.create(
+                company=company, location=location, name=sim_router.name, connection_type='API',
+                ip_address=host, api_port=port, username=sim_router.username, password=sim_router.password
+            )
+            packages = {
+                connection_type: Package.objects.create(
+                    company=company, location=location, router=router, name=f"bench-{connection_type.lower()}",
+                    connection_type=connection_type, download_bandwidth=10, upload_bandwidth=5, price=1,
+                    duration_days=1
+                )
+                for connection_type in ('HOTSPOT', 'PPPOE')
+            }
+            for index in range(per_router):
+                connection_type = 'PPPOE' if index % 5 == 0 else 'HOTSPOT'
+                subscriptions.append(Subscription(
+                    customer=customer, package=packages[connection_type], connection_type=connection_type,
+                    username=f"{marker}-{router.id}-{index}", password='bench', start_date=now,
+                    end_date=now + timedelta(days=1), router=router, is_active=True
+                ))
+        Subscription.objects.bulk_create(subscriptions, batch_size=1000)
+        self.stdout.write(f"Created {len(simulator.routers)} simulated routers with {len(subscriptions)} subscriptions")
+        return company
+
+    def report(self, phase, seconds, operations, failed):
+        rate = operations / seconds if seconds else 0
+        self.stdout.write(f"{phase:<22} {seconds:>8.2f}s {operations:>8} ops {rate:>10.0f} ops/s {failed:>6} failed")
+
+    def run_phases(self, company):
+        """Run each phase against ``company``'s routers; returns {phase: (seconds, operations, failed)}."""
+        subscriptions = Subscription.objects.filter(router__company=company).select_related('router', 'package')
+        phases = {}
+
+        stats = sync_routers(list(subscriptions))
+        phases['full sync (cold)'] = (stats['seconds'], stats['applied'], stats['failed'])
+
+        stats = sync_routers(list(subscriptions))
+        phases['full sync (no-op)'] = (stats['seconds'], stats['applied'], stats['failed'])
+
+        changed = list(subscriptions)[::10]
+        for sub in changed:
+            sub.password = 'rotated'
+        stats = sync_routers(changed, retired={})
+        phases['targeted sync (10%)'] = (stats['seconds'], stats['applied'], stats['failed'])
+
+        subscriptions.update(end_date=timezone.now() - timedelta(minutes=1))
+        started = time.monotonic()
+        stats = expire_subscriptions(ids=list(subscriptions.values_list('id', flat=True)))
+        phases['bulk expiry'] = (time.monotonic() - started, stats['disabled'], stats['failed'])
+        return phases
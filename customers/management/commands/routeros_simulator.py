@@ -0,0 +1,47 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from customers.routeros_sim import RouterSimulator
+
+
+class Command(BaseCommand):
+    help = "Serve simulated MikroTik routers over the RouterOS API protocol on localhost"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--routers', type=int, default=1, help="Number of simulated routers")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--base-port', type=int, default=18728, help="Port of the first router; the rest follow")
+        parser.add_argument('--username', default='admin')
+        parser.add_argument('--password', default='')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay added to every command")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of commands answered with !trap")
+        parser.add_argument('--drop-rate', type=float, default=0.0, help="Fraction of commands that drop the connection")
+        parser.add_argument('--users', type=int, default=0, help="Hotspot users to pre-load on every router")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        simulator = RouterSimulator(
+            count=options['routers'],
+            host=options['host'],
+            base_port=options['base_port'],
+            username=options['username'],
+            password=options['password'],
+            latency=options['latency_ms'] / 1000,
+            failure_rate=options['failure_rate'],
+            drop_rate=options['drop_rate'],
+            seed=options['seed'],
+        )
+        for router in simulator.routers:
+            router.seed('/ip/hotspot/user', (
+                {'name': f"{router.name}-user{index}", 'password': 'sim', 'profile': 'default'}
+                for index in range(options['users'])
+            ))
+        asyncio.run(self.serve(simulator))
+
+    async def serve(self, simulator):
+        await simulator.start()
+        first, last = simulator.ports[0], simulator.ports[-1]
+        self.stdout.write(f"Serving {len(simulator.routers)} simulated routers on {simulator.host}:{first}-{last} (Ctrl+C to stop)")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await simulator.stop()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from customers.coalesce import trigger
+from customers.scheduler import build_scheduler
+from customers.tasks import sync_subscription_changes
+
+
+class Command(BaseCommand):
+    help = "Run the expiry scheduler: disable subscriptions within seconds of their end_date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process due subscriptions once and exit")
+
+    def handle(self, *args, **options):
+        scheduler = build_scheduler()
+        on_expired = lambda: trigger(sync_subscription_changes)
+        if options['once']:
+            expired = scheduler.run_once(on_expired)
+            self.stdout.write(f"Expired {expired} subscriptions")
+            return
+        self.stdout.write(
+            f"Expiry scheduler running (horizon {scheduler.horizon}s, poll every {scheduler.poll_interval}s)"
+        )
+        scheduler.run_forever(on_expired)
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from customers.usage import build_collector
+
+
+class Command(BaseCommand):
+    help = "Poll live usage counters on every router and add the traffic to SubscriptionUsage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.USAGE_POLL_INTERVAL, help="Seconds between polls")
+
+    def handle(self, *args, **options):
+        collector = build_collector()
+        self.stdout.write(
+            f"Usage collector running (every {options['interval']}s, {collector.concurrency} routers at a time)"
+        )
+        collector.run_forever(options['interval'])
@@ -0,0 +1,15 @@
+import signal
+import sys
+from django.core.management.base import BaseCommand
+from customers.vpn import build_supervisor
+
+
+class Command(BaseCommand):
+    help = "Keep one VPN tunnel up per VPN router, reconnecting with backoff"
+
+    def handle(self, *args, **options):
+        supervisor = build_supervisor()
+        # Exit through run_forever's cleanup so tunnels are torn down on stop.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.stdout.write(f"VPN supervisor running (check every {supervisor.check_interval}s)")
+        supervisor.run_forever()
@@ -0,0 +1,19 @@
+from . import audit
+
+
+class AuditFlushMiddleware:
+    """Write the audit entries buffered during a request once its response is ready.
+
+    This runs inside the request rather than on ``request_finished``, where
+    Django's close_old_connections has already run and a flush would open a
+    fresh connection that outlives the request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            audit.flush()
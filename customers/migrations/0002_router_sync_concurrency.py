@@ -0,0 +1,18 @@
+# Generated by Django 5.1.8 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='router',
+            name='sync_concurrency',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Parallel API sessions used when syncing this router (leave blank for the global default)', null=True),
+        ),
+    ]
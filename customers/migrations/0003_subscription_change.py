@@ -0,0 +1,28 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0002_router_sync_concurrency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_id', models.BigIntegerField()),
+                ('router_id', models.BigIntegerField(blank=True, null=True)),
+                ('username', models.CharField(max_length=100)),
+                ('change_type', models.CharField(choices=[('CREATED', 'Created'), ('EXTENDED', 'Extended'), ('UPDATED', 'Updated'), ('EXPIRED', 'Expired'), ('DELETED', 'Deleted')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='customers_s_process_e39b23_idx')],
+            },
+        ),
+    ]
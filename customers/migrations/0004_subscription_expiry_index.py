@@ -0,0 +1,17 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0003_subscription_change'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['is_active', 'end_date'], name='customers_s_is_acti_d34565_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0005_provisioning_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_id', models.BigIntegerField()),
+                ('router_id', models.BigIntegerField(blank=True, null=True)),
+                ('username', models.CharField(max_length=100)),
+                ('operation', models.CharField(choices=[('SYNC', 'Router sync'), ('DISABLE', 'Router disable'), ('RADIUS', 'RADIUS sync')], max_length=20)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DEAD', 'Dead letter')], default='PENDING', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='customers_s_status_42416c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('subscription_id', 'operation'), name='unique_sync_retry')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0006_sync_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountingCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('last_id', models.BigIntegerField(default=0, help_text='Highest radacctid ingested')),
+                ('last_update', models.DateTimeField(blank=True, help_text='acctupdatetime of the last updated row ingested', null=True)),
+                ('last_update_id', models.BigIntegerField(default=0, help_text='radacctid of that row, to break acctupdatetime ties')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='sessionlog',
+            name='acct_session_id',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sessionlog',
+            name='acct_unique_id',
+            field=models.CharField(blank=True, help_text='FreeRADIUS radacct.acctuniqueid', max_length=32, null=True, unique=True),
+        ),
+    ]
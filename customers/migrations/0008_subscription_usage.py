@@ -0,0 +1,25 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0007_radius_accounting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bytes_in', models.BigIntegerField(default=0, help_text='Bytes uploaded by the subscriber')),
+                ('bytes_out', models.BigIntegerField(default=0, help_text='Bytes downloaded by the subscriber')),
+                ('last_seen', models.DateTimeField(blank=True, help_text='Last poll that saw traffic', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('subscription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='customers.subscription')),
+            ],
+        ),
+    ]
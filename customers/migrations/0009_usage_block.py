@@ -0,0 +1,28 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0008_subscription_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscription_id', models.BigIntegerField()),
+                ('resolution', models.PositiveIntegerField(help_text='Seconds per bucket')),
+                ('start', models.DateTimeField(help_text="Start of the block's first bucket")),
+                ('data', models.BinaryField(help_text='zlib-compressed int64 (bytes_in, bytes_out) per bucket')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'start'], name='customers_u_resolut_27bb9b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('subscription_id', 'resolution', 'start'), name='unique_usage_block')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.8 on 2026-10-17 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0009_usage_block'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriptionusage',
+            name='cap_level',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Highest data-cap threshold already acted on, in percent'),
+        ),
+    ]
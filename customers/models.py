@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.hashers import make_password
@@ -43,7 +44,7 @@ class AuditLog(models.Model):
     model = models.CharField(max_length=100)
     object_id = models.CharField(max_length=36)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)  # set when logged, not when the buffered write lands
 
     def __str__(self):
         return f"{self.action} on {self.model} {self.object_id}"
@@ -95,6 +96,7 @@ class Router(models.Model):
     vpn_wg_private_key = models.CharField(max_length=256, blank=True, help_text="WireGuard private key")
     vpn_wg_public_key = models.CharField(max_length=256, blank=True, help_text="WireGuard server public key")
     vpn_wg_endpoint_port = models.IntegerField(default=51820, blank=True, null=True, help_text="WireGuard endpoint port")
+    sync_concurrency = models.PositiveSmallIntegerField(blank=True, null=True, help_text="Parallel API sessions used when syncing this router (leave blank for the global default)")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -167,12 +169,118 @@ class Subscription(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'end_date']),
+        ]
+
     def __str__(self):
         return f"{self.customer.name} - {self.package.name}"
 
+class SubscriptionChange(models.Model):
+    """Outbox row recording that a subscription needs to be pushed to its router and RADIUS."""
+    CHANGE_TYPES = (
+        ('CREATED', 'Created'),
+        ('EXTENDED', 'Extended'),
+        ('UPDATED', 'Updated'),
+        ('EXPIRED', 'Expired'),
+        ('DELETED', 'Deleted'),
+    )
+    subscription_id = models.BigIntegerField()
+    router_id = models.BigIntegerField(blank=True, null=True)
+    username = models.CharField(max_length=100)
+    change_type = models.CharField(max_length=20, choices=CHANGE_TYPES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.change_type} subscription {self.subscription_id} ({self.username})"
+
+    @classmethod
+    def record(cls, subscription, change_type):
+        return cls.objects.create(
+            subscription_id=subscription.id,
+            router_id=subscription.router_id,
+            username=subscription.username,
+            change_type=change_type
+        )
+
+class ProvisioningJob(models.Model):
+    """Router/RADIUS push and customer notification for a new subscription, run on a worker."""
+    EVENTS = (
+        ('PAYMENT', 'Payment'),
+        ('VOUCHER', 'Voucher Redemption'),
+    )
+    STATUSES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCESS', 'Success'),
+        ('PARTIAL', 'Partial'),
+        ('FAILED', 'Failed'),
+    )
+    STEP_STATUSES = (
+        ('PENDING', 'Pending'),
+        ('SUCCESS', 'Success'),
+        ('FAILED', 'Failed'),
+    )
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE)
+    event = models.CharField(max_length=20, choices=EVENTS)
+    status = models.CharField(max_length=20, choices=STATUSES, default='PENDING')
+    network_status = models.CharField(max_length=20, choices=STEP_STATUSES, default='PENDING')
+    notification_status = models.CharField(max_length=20, choices=STEP_STATUSES, default='PENDING')
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.event} job for {self.subscription.username} ({self.status})"
+
+class SyncRetry(models.Model):
+    """A failed per-subscription router/RADIUS operation waiting to be retried (or dead-lettered)."""
+    OPERATIONS = (
+        ('SYNC', 'Router sync'),
+        ('DISABLE', 'Router disable'),
+        ('RADIUS', 'RADIUS sync'),
+    )
+    STATUSES = (
+        ('PENDING', 'Pending'),
+        ('DEAD', 'Dead letter'),
+    )
+    subscription_id = models.BigIntegerField()
+    router_id = models.BigIntegerField(blank=True, null=True)
+    username = models.CharField(max_length=100)
+    operation = models.CharField(max_length=20, choices=OPERATIONS)
+    status = models.CharField(max_length=20, choices=STATUSES, default='PENDING')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subscription_id', 'operation'], name='unique_sync_retry'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} retry for {self.username} ({self.status}, {self.attempts} attempts)"
+
 class SessionLog(models.Model):
     subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE)
     username = models.CharField(max_length=100)
+    acct_unique_id = models.CharField(max_length=32, unique=True, blank=True, null=True, help_text="FreeRADIUS radacct.acctuniqueid")
+    acct_session_id = models.CharField(max_length=64, blank=True)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField(blank=True, null=True)
     data_used = models.BigIntegerField(blank=True, null=True)
@@ -188,6 +296,48 @@ class SessionLog(models.Model):
     def __str__(self):
         return f"Session for {self.username} at {self.start_time}"
 
+class AccountingCursor(models.Model):
+    """High-water mark of the radacct rows already copied into SessionLog, one per RADIUS database."""
+    name = models.CharField(max_length=200, unique=True)
+    last_id = models.BigIntegerField(default=0, help_text="Highest radacctid ingested")
+    last_update = models.DateTimeField(blank=True, null=True, help_text="acctupdatetime of the last updated row ingested")
+    last_update_id = models.BigIntegerField(default=0, help_text="radacctid of that row, to break acctupdatetime ties")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.last_id}"
+
+class SubscriptionUsage(models.Model):
+    """Running byte totals per subscription, fed by the live usage collector."""
+    subscription = models.OneToOneField(Subscription, on_delete=models.CASCADE, related_name='usage')
+    bytes_in = models.BigIntegerField(default=0, help_text="Bytes uploaded by the subscriber")
+    bytes_out = models.BigIntegerField(default=0, help_text="Bytes downloaded by the subscriber")
+    last_seen = models.DateTimeField(blank=True, null=True, help_text="Last poll that saw traffic")
+    cap_level = models.PositiveSmallIntegerField(default=0, help_text="Highest data-cap threshold already acted on, in percent")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Usage for subscription {self.subscription_id}: {self.bytes_in + self.bytes_out} bytes"
+
+class UsageBlock(models.Model):
+    """A fixed run of byte-counter buckets for one subscription at one resolution (see customers.timeseries)."""
+    subscription_id = models.BigIntegerField()
+    resolution = models.PositiveIntegerField(help_text="Seconds per bucket")
+    start = models.DateTimeField(help_text="Start of the block's first bucket")
+    data = models.BinaryField(help_text="zlib-compressed int64 (bytes_in, bytes_out) per bucket")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['subscription_id', 'resolution', 'start'], name='unique_usage_block'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'start']),
+        ]
+
+    def __str__(self):
+        return f"{self.resolution}s usage of subscription {self.subscription_id} from {self.start}"
+
 class Invoice(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     subscription = models.ForeignKey(Subscription, on_delete=models.SET_NULL, blank=True, null=True)
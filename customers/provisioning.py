@@ -0,0 +1,316 @@
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from routeros_api.exceptions import RouterOsApiConnectionError, FatalRouterOsApiError
+from .models import ProvisioningJob, Voucher
+from .radius_pool import radius_db
+from .reconcile import (
+    HOTSPOT_USERS, PPP_SECRETS, RESOURCES, desired_entries, read_router_state, plan_changes, apply_changes,
+)
+from .routeros import router_api
+from . import radius, retry
+from .utils import send_sms, send_email
+
+logger = logging.getLogger(__name__)
+
+# Rows per executemany when writing RADIUS attributes.
+BATCH_SIZE = 500
+
+
+def get_rate_limit(package):
+    """Generate MikroTik rate-limit string for bandwidth settings."""
+    if package.download_bandwidth and package.upload_bandwidth:
+        return f"{package.upload_bandwidth}k/{package.download_bandwidth}k"
+    return ""
+
+
+def package_duration(package):
+    return (
+        timedelta(minutes=package.duration_minutes or 0) +
+        timedelta(hours=package.duration_hours or 0) +
+        timedelta(days=package.duration_days or 0)
+    )
+
+
+def data_limit_bytes(package):
+    return package.data_limit * 1024 * 1024 if package.data_limit else None
+
+
+class Account:
+    """What gets created on a router or RADIUS server for one subscription or voucher.
+
+    Quacks like a Subscription as far as reconcile.desired_entries() is concerned.
+    """
+    __slots__ = ('username', 'password', 'package', 'router', 'connection_type', 'label', 'comment', 'subscription_id')
+
+    def __init__(self, username, password, package, router, label, comment=None, subscription_id=None, connection_type=None):
+        self.username = username
+        self.password = password
+        self.package = package
+        self.router = router
+        self.connection_type = connection_type or package.connection_type
+        self.label = label
+        self.comment = comment
+        self.subscription_id = subscription_id
+
+
+def account_for(item):
+    """Build the Account for a Subscription or an unredeemed Voucher."""
+    if isinstance(item, Voucher):
+        return Account(item.code, item.code, item.package, item.package.router, f"Voucher {item.code}")
+    return Account(
+        item.username, item.password, item.package, item.router, f"Subscription {item.username}",
+        comment=f"Created={item.start_date:%b/%d/%Y %H:%M:%S} Expire={item.end_date:%b/%d/%Y %H:%M:%S}",
+        subscription_id=item.id, connection_type=item.connection_type
+    )
+
+
+def router_entries(account):
+    """Return [(resource_path, params)] to create on a MikroTik router for ``account``.
+
+    Hotspot users, PPP secrets and queues are reconcile.desired_entries(), so
+    the next reconcile finds nothing to change; the extras added here are not
+    compared by reconcile and are only sent when the entry is created.
+    """
+    package = account.package
+    if account.connection_type == 'STATIC':
+        return [('/ip/dhcp-server/lease', {
+            'address': package.ip_address or '192.168.1.100',
+            'mac_address': '',
+            'comment': account.label,
+            'server': 'all',
+            'lease_time': f"{package.duration_days or 30}d",
+        })]
+    entries = {path: dict(params) for path, params in desired_entries(account).items()}
+    if HOTSPOT_USERS in entries:
+        params = entries[HOTSPOT_USERS]
+        params['limit-uptime'] = f"{package.duration_days or 0}d"
+        rate_limit = get_rate_limit(package)
+        if rate_limit:
+            params['rate-limit'] = rate_limit
+        limit_bytes = data_limit_bytes(package)
+        if limit_bytes:
+            params['limit-bytes-total'] = str(limit_bytes)
+    for path in (HOTSPOT_USERS, PPP_SECRETS):
+        if path in entries and account.comment:
+            entries[path]['comment'] = account.comment
+    return list(entries.items())
+
+
+def radius_reply_rows(account):
+    """Return the radreply rows for ``account``; radcheck and groups come from radius.sync_users()."""
+    package = account.package
+    username = account.username
+    reply = []
+    limit_bytes = data_limit_bytes(package)
+    if limit_bytes:
+        reply.append((username, 'Mikrotik-Total-Limit', ':=', str(limit_bytes)))
+    if account.connection_type == 'STATIC':
+        reply.append((username, 'Framed-IP-Address', ':=', package.ip_address or '192.168.1.100'))
+    elif account.connection_type == 'VPN':
+        reply.append((username, 'Service-Type', ':=', 'Framed-User'))
+        reply.append((username, 'Framed-Protocol', ':=', 'L2TP'))
+    return reply
+
+
+def _provision_on_router(router, accounts):
+    """Create or update every account's entries over one router session; returns {username: error or None}.
+
+    Hotspot users, PPP secrets and queues go through the same read/plan/apply
+    as reconcile, so an entry the outbox sync (or an earlier attempt) already
+    created is left alone or updated instead of trapping on a duplicate add.
+    Nothing is removed. Other entries (DHCP leases) are added unless one with
+    the same comment exists.
+    """
+    errors = {account.username: None for account in accounts}
+    desired = {path: {} for path in RESOURCES}
+    owners = {}
+    others = []
+    for account in accounts:
+        for path, params in router_entries(account):
+            if path in desired:
+                desired[path][params['name']] = params
+                owners[(path, params['name'])] = account.username
+            else:
+                others.append((account, path, params))
+    with router_api(router) as api:
+        managed = {path: set(names) for path, names in desired.items()}
+        changes = plan_changes(desired, read_router_state(api, managed), {}, managed)
+        _, failed = apply_changes(api, changes)
+        for change, error in failed:
+            errors[owners[(change.path, change.name)]] = error
+        for account, path, params in others:
+            try:
+                resource = api.get_resource(path)
+                if not resource.get(comment=params['comment']):
+                    resource.add(**params)
+            except (RouterOsApiConnectionError, FatalRouterOsApiError, OSError):
+                raise
+            except Exception as e:
+                logger.error(f"Failed to sync {account.username} to MikroTik: {e}")
+                errors[account.username] = str(e)
+    return errors
+
+
+def _provision_on_radius(router, accounts):
+    """Rewrite every account's RADIUS rows in one transaction with batched statements.
+
+    radcheck/radusergroup are replaced through radius.sync_users() and
+    radreply rows are deleted before being inserted, so running this again
+    for the same accounts does not duplicate anything.
+    """
+    reply = [row for account in accounts for row in radius_reply_rows(account)]
+    usernames = list({account.username for account in accounts})
+    with radius_db(router) as db:
+        cursor = db.cursor()
+        radius.sync_users(cursor, accounts)
+        for i in range(0, len(usernames), BATCH_SIZE):
+            chunk = usernames[i:i + BATCH_SIZE]
+            cursor.execute(f"DELETE FROM radreply WHERE username IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        for i in range(0, len(reply), BATCH_SIZE):
+            cursor.executemany(
+                "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
+                reply[i:i + BATCH_SIZE]
+            )
+        db.commit()
+    return {account.username: None for account in accounts}
+
+
+def _provision_group(router, accounts):
+    started = time.monotonic()
+    backend = 'radius' if router.connection_type == 'RADIUS' else 'router'
+    try:
+        if backend == 'radius':
+            errors = _provision_on_radius(router, accounts)
+        elif router.connection_type in ['API', 'VPN']:
+            errors = _provision_on_router(router, accounts)
+        else:
+            raise ValueError(f"Unsupported connection type: {router.connection_type}")
+        error = None
+    except Exception as e:
+        logger.error(f"Failed to provision {len(accounts)} accounts on {router.name} ({backend}): {e}")
+        errors = {account.username: str(e) for account in accounts}
+        error = str(e)
+    finally:
+        connection.close()
+    return backend, errors, error, round(time.monotonic() - started, 3)
+
+
+def provision(items):
+    """Create subscriptions (or vouchers) on their routers / RADIUS servers in batches.
+
+    Items are grouped by router so each group uses one pooled RouterOS session
+    or one RADIUS transaction, and groups run in parallel. Returns
+    {'results': [{username, subscription_id, router, backend, ok, error}],
+    'routers': {router_id: {...}}, 'ok': n, 'failed': n}.
+    """
+    groups = defaultdict(list)
+    routers = {}
+    results = []
+    for item in items:
+        account = account_for(item)
+        if account.router is None:
+            results.append({
+                'username': account.username, 'subscription_id': account.subscription_id,
+                'router': None, 'backend': None, 'ok': False, 'error': 'No router assigned',
+            })
+            continue
+        routers[account.router.id] = account.router
+        groups[account.router.id].append(account)
+
+    router_stats = {}
+    if groups:
+        workers = max(1, min(settings.ROUTER_SYNC_CONCURRENCY, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='provision') as pool:
+            futures = {
+                router_id: pool.submit(_provision_group, routers[router_id], accounts)
+                for router_id, accounts in groups.items()
+            }
+            for router_id, future in futures.items():
+                backend, errors, error, seconds = future.result()
+                router = routers[router_id]
+                for account in groups[router_id]:
+                    account_error = errors.get(account.username)
+                    results.append({
+                        'username': account.username, 'subscription_id': account.subscription_id,
+                        'router': router.name, 'backend': backend,
+                        'ok': account_error is None, 'error': account_error,
+                    })
+                router_stats[str(router_id)] = {
+                    'router': router.name, 'backend': backend, 'count': len(groups[router_id]),
+                    'failed': sum(1 for value in errors.values() if value), 'error': error, 'seconds': seconds,
+                }
+    ok = sum(1 for result in results if result['ok'])
+    return {'results': results, 'routers': router_stats, 'ok': ok, 'failed': len(results) - ok}
+
+
+def notification(job):
+    """Return (sms, subject, body) telling the customer their credentials."""
+    subscription = job.subscription
+    customer = subscription.customer
+    package = subscription.package
+    credentials = f"Username: {subscription.username}, Password: {subscription.password}"
+    if job.event == 'VOUCHER':
+        return (
+            f"Voucher redeemed! {credentials}",
+            f"Voucher Redeemed for {package.name}",
+            f"Dear {customer.name},\n\nYour voucher has been redeemed. {credentials}\n\nBest,\n{package.company.name}"
+        )
+    return (
+        f"Payment successful! {credentials}",
+        f"Payment Successful for {package.name}",
+        f"Dear {customer.name},\n\nPayment successful! {credentials}\n\nBest,\n{package.company.name}"
+    )
+
+
+def enqueue(subscription, event):
+    """Record a provisioning job for ``subscription`` and queue it once the transaction commits."""
+    from .tasks import run_provisioning_job
+    job = ProvisioningJob.objects.create(subscription=subscription, event=event)
+    transaction.on_commit(lambda: run_provisioning_job.delay(job.id))
+    return job
+
+
+def run_job(job):
+    """Do the router/RADIUS push and the customer notification for ``job``.
+
+    Steps that already succeeded are not repeated when a job is re-run.
+    """
+    job.status = 'RUNNING'
+    job.attempts += 1
+    job.save(update_fields=['status', 'attempts', 'updated_at'])
+    errors = []
+    if job.network_status != 'SUCCESS':
+        result = provision([job.subscription])['results'][0]
+        job.network_status = 'SUCCESS' if result['ok'] else 'FAILED'
+        if not result['ok']:
+            errors.append(f"network: {result['error']}")
+            subscription = job.subscription
+            if subscription.router_id:
+                # The retry queue finishes the push and marks this job's network step done.
+                retry.record_failures(
+                    'RADIUS' if subscription.router.connection_type == 'RADIUS' else 'SYNC',
+                    [(subscription.id, subscription.router_id, subscription.username, result['error'])]
+                )
+    if job.notification_status != 'SUCCESS':
+        customer = job.subscription.customer
+        sms, subject, body = notification(job)
+        results = [send_sms(customer.phone, sms), send_email(customer.email, subject, body)]
+        failed = [result.get('error', 'failed') for result in results if isinstance(result, dict) and result.get('status') == 'error']
+        job.notification_status = 'FAILED' if failed else 'SUCCESS'
+        errors.extend(f"notification: {error}" for error in failed)
+    if job.network_status == 'SUCCESS' and job.notification_status == 'SUCCESS':
+        job.status = 'SUCCESS'
+    elif job.network_status == 'SUCCESS':
+        job.status = 'PARTIAL'
+    else:
+        job.status = 'FAILED'
+    job.error = '; '.join(errors)
+    job.finished_at = timezone.now()
+    job.save()
+    return job
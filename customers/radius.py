@@ -0,0 +1,237 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Natural key and value columns of each table the full sync manages.
+TABLES = {
+    'radcheck': (('username', 'attribute'), ('op', 'value')),
+    'radgroupcheck': (('groupname', 'attribute'), ('op', 'value')),
+    'radusergroup': (('username', 'groupname'), ('priority',)),
+}
+
+
+def group_name(sub):
+    return f"{sub.package.name}_{sub.connection_type}"
+
+
+def shared_users(package):
+    """Concurrent logins allowed per hotspot user (MikroTik's default is 1)."""
+    return getattr(package, 'shared_users', None) or 1
+
+
+def group_check_rows(sub):
+    """radgroupcheck rows for the group ``sub`` belongs to."""
+    groupname = group_name(sub)
+    rows = [(groupname, 'Auth-Type', ':=', 'Accept')]
+    if sub.connection_type == 'HOTSPOT':
+        rows.append((groupname, 'Simultaneous-Use', ':=', str(shared_users(sub.package))))
+    return rows
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def columns(table):
+    key_columns, value_columns = TABLES[table]
+    return key_columns + value_columns
+
+
+def bulk_insert(cursor, table, rows, batch_size=1000, target=None):
+    """Insert ``rows`` using multi-row VALUES statements of up to ``batch_size`` rows each.
+
+    ``target`` overrides the table written to (e.g. a shadow copy of ``table``).
+    """
+    names = columns(table)
+    target = target or table
+    row_sql = f"({_placeholders(names)})"
+    for i in range(0, len(rows), batch_size):
+        chunk = rows[i:i + batch_size]
+        cursor.execute(
+            f"INSERT INTO {target} ({', '.join(names)}) VALUES {', '.join([row_sql] * len(chunk))}",
+            [value for row in chunk for value in row]
+        )
+    return len(rows)
+
+
+def rate(rows, seconds):
+    return round(rows / seconds) if seconds else rows
+
+
+def sync_users(cursor, subscriptions, removed_usernames=()):
+    """Replace the radcheck/radusergroup rows for just these users.
+
+    Active ``subscriptions`` are (re)written, ``removed_usernames`` are deleted,
+    and the radgroupcheck rows of every group touched are refreshed. The caller
+    owns the transaction, so other users are never affected.
+    """
+    subscriptions = list(subscriptions)
+    usernames = list({sub.username for sub in subscriptions} | set(removed_usernames))
+    for i in range(0, len(usernames), 500):
+        chunk = usernames[i:i + 500]
+        cursor.execute(f"DELETE FROM radcheck WHERE username IN ({_placeholders(chunk)})", chunk)
+        cursor.execute(f"DELETE FROM radusergroup WHERE username IN ({_placeholders(chunk)})", chunk)
+
+    groups = {}
+    for sub in subscriptions:
+        groups.setdefault(group_name(sub), group_check_rows(sub))
+    if groups:
+        names = list(groups)
+        cursor.execute(f"DELETE FROM radgroupcheck WHERE groupname IN ({_placeholders(names)})", names)
+        bulk_insert(cursor, 'radgroupcheck', [row for rows in groups.values() for row in rows])
+    bulk_insert(cursor, 'radcheck', [(sub.username, 'Cleartext-Password', ':=', sub.password) for sub in subscriptions])
+    bulk_insert(cursor, 'radusergroup', [(sub.username, group_name(sub), 1) for sub in subscriptions])
+
+
+def desired_rows(subscriptions):
+    """Return {table: {key: values}} for every active subscription.
+
+    Group attributes are built once per package/connection type, not once per
+    subscriber.
+    """
+    rows = {table: {} for table in TABLES}
+    for sub in subscriptions:
+        rows['radcheck'][(sub.username, 'Cleartext-Password')] = (':=', sub.password)
+        groupname = group_name(sub)
+        if groupname not in rows['radgroupcheck']:
+            for group, attribute, op, value in group_check_rows(sub):
+                rows['radgroupcheck'][(group, attribute)] = (op, value)
+        rows['radusergroup'][(sub.username, groupname)] = ('1',)
+    return rows
+
+
+def read_rows(cursor, table):
+    """Return {key: [(id, values), ...]} for the rows currently in ``table``."""
+    key_columns, value_columns = TABLES[table]
+    cursor.execute(f"SELECT id, {', '.join(key_columns + value_columns)} FROM {table}")
+    current = {}
+    for row in cursor.fetchall():
+        key = tuple(row[1:1 + len(key_columns)])
+        values = tuple(str(value) for value in row[1 + len(key_columns):])
+        current.setdefault(key, []).append((row[0], values))
+    return current
+
+
+def diff_rows(desired, current):
+    """Return (inserts, updates, deletes) turning ``current`` into ``desired``."""
+    inserts, updates, deletes = [], [], []
+    for key, values in desired.items():
+        existing = current.get(key)
+        if not existing:
+            inserts.append(key + values)
+            continue
+        row_id, current_values = existing[0]
+        if current_values != values:
+            updates.append(values + (row_id,))
+        deletes.extend(row_id for row_id, _ in existing[1:])
+    for key, existing in current.items():
+        if key not in desired:
+            deletes.extend(row_id for row_id, _ in existing)
+    return inserts, updates, deletes
+
+
+def flatten(rows):
+    """Turn {key: values} into insertable row tuples."""
+    return [key + values for key, values in rows.items()]
+
+
+def apply_diff(cursor, table, inserts, updates, deletes, batch_size):
+    value_columns = TABLES[table][1]
+    for i in range(0, len(deletes), batch_size):
+        chunk = deletes[i:i + batch_size]
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({_placeholders(chunk)})", chunk)
+    assignments = ', '.join(f"{column} = %s" for column in value_columns)
+    for i in range(0, len(updates), batch_size):
+        cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id = %s", updates[i:i + batch_size])
+    bulk_insert(cursor, table, inserts, batch_size)
+
+
+def incremental_sync(db, subscriptions, batch_size=1000):
+    """Bring radcheck, radgroupcheck and radusergroup in line with ``subscriptions``.
+
+    Only the rows that differ are inserted, updated or deleted, in batches and
+    in a single transaction, so FreeRADIUS never sees empty tables and the
+    write volume tracks the amount of change. Returns per-table counts and
+    write throughput.
+    """
+    desired = desired_rows(subscriptions)
+    cursor = db.cursor()
+    stats = {}
+    try:
+        for table in TABLES:
+            started = time.monotonic()
+            inserts, updates, deletes = diff_rows(desired[table], read_rows(cursor, table))
+            apply_diff(cursor, table, inserts, updates, deletes, batch_size)
+            seconds = time.monotonic() - started
+            written = len(inserts) + len(updates) + len(deletes)
+            stats[table] = {
+                'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes),
+                'seconds': round(seconds, 3), 'rows_per_second': rate(written, seconds),
+            }
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return stats
+
+
+def truncate_sync(db, subscriptions, batch_size=1000):
+    """Legacy rebuild: empty the tables and bulk-load every row."""
+    desired = desired_rows(subscriptions)
+    cursor = db.cursor()
+    stats = {}
+    for table in TABLES:
+        cursor.execute(f"TRUNCATE TABLE {table}")
+    for table in TABLES:
+        started = time.monotonic()
+        rows = bulk_insert(cursor, table, flatten(desired[table]), batch_size)
+        seconds = time.monotonic() - started
+        stats[table] = {'inserted': rows, 'seconds': round(seconds, 3), 'rows_per_second': rate(rows, seconds)}
+    db.commit()
+    return stats
+
+
+def supports_swap(db):
+    """``CREATE TABLE ... LIKE`` and multi-table ``RENAME TABLE`` are MySQL/MariaDB only."""
+    return type(db).__module__.split('.')[0] in ('MySQLdb', 'pymysql')
+
+
+def swap_sync(db, subscriptions, batch_size=1000):
+    """Full rebuild into shadow tables, swapped in with one atomic RENAME TABLE.
+
+    Rows are streamed into ``<table>_new`` copies while FreeRADIUS keeps
+    reading the live tables; the swap renames all three tables in a single
+    statement, so readers see either the old set or the new set, never a mix.
+    The DDL is MySQL-only; on any other backend this falls back to
+    incremental_sync(), which is also atomic.
+    """
+    if not supports_swap(db):
+        logger.warning(f"Swap sync needs MySQL; falling back to an incremental sync on {type(db).__module__}")
+        return incremental_sync(db, subscriptions, batch_size)
+    cursor = db.cursor()
+    desired = desired_rows(subscriptions)
+    stats = {}
+    for table in TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_old")
+        cursor.execute(f"CREATE TABLE {table}_new LIKE {table}")
+    try:
+        for table in TABLES:
+            started = time.monotonic()
+            rows = bulk_insert(cursor, table, flatten(desired[table]), batch_size, target=f"{table}_new")
+            seconds = time.monotonic() - started
+            stats[table] = {'inserted': rows, 'seconds': round(seconds, 3), 'rows_per_second': rate(rows, seconds)}
+        db.commit()
+        cursor.execute("RENAME TABLE " + ', '.join(
+            f"{table} TO {table}_old, {table}_new TO {table}" for table in TABLES
+        ))
+    except Exception:
+        db.rollback()
+        for table in TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+        raise
+    for table in TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_old")
+    return stats
@@ -0,0 +1,186 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+import MySQLdb
+
+logger = logging.getLogger(__name__)
+
+
+class RadiusConnectionError(Exception):
+    """Raised when no connection to a FreeRADIUS database can be obtained."""
+
+
+def credentials(router=None):
+    """Connection parameters for the FreeRADIUS database serving ``router``.
+
+    Routers with a ``radius_server`` use it as host and ``radius_secret`` as
+    the database password; everything else comes from the RADIUS_DB_* settings.
+    This is the only place RADIUS database credentials are resolved.
+    """
+    params = {
+        'host': settings.RADIUS_DB_HOST,
+        'port': settings.RADIUS_DB_PORT,
+        'user': settings.RADIUS_DB_USER,
+        'passwd': settings.RADIUS_DB_PASSWORD,
+        'db': settings.RADIUS_DB_NAME,
+    }
+    if router is not None and router.radius_server:
+        params['host'] = router.radius_server
+        params['passwd'] = router.radius_secret or params['passwd']
+    return params
+
+
+class _PooledConnection:
+    def __init__(self, db):
+        self.db = db
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.db.close()
+        except Exception as e:
+            logger.debug(f"Error closing RADIUS connection: {e}")
+
+
+class _ServerSlot:
+    def __init__(self, max_connections):
+        self.idle = []
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+
+
+class RadiusConnectionPool:
+    """Process-wide pool of FreeRADIUS MySQL connections keyed by server.
+
+    Connections are reused across requests and tasks, pinged before reuse
+    when they have been idle for a while, capped per server, and opened with
+    connect/read/write timeouts so a dead server fails fast.
+    """
+
+    def __init__(self, max_connections=4, idle_timeout=300, health_check_interval=30,
+                 acquire_timeout=10, connect_timeout=5, query_timeout=30):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self.query_timeout = query_timeout
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _slot_for(self, key):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = _ServerSlot(self.max_connections)
+                self._slots[key] = slot
+            return slot
+
+    def _connect(self, params):
+        try:
+            db = MySQLdb.connect(
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.query_timeout,
+                write_timeout=self.query_timeout,
+                **params
+            )
+        except Exception as e:
+            raise RadiusConnectionError(f"Could not connect to RADIUS database on {params['host']}: {e}") from e
+        logger.debug(f"Opened RADIUS connection to {params['host']}")
+        return _PooledConnection(db)
+
+    def _is_healthy(self, conn):
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.db.ping()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, params):
+        key = (params['host'], params['port'], params['user'], params['passwd'], params['db'])
+        slot = self._slot_for(key)
+        if not slot.semaphore.acquire(timeout=self.acquire_timeout):
+            raise RadiusConnectionError(f"Timed out waiting for a free RADIUS connection to {params['host']}")
+        try:
+            while True:
+                with self._lock:
+                    conn = slot.idle.pop() if slot.idle else None
+                if conn is None:
+                    conn = self._connect(params)
+                    break
+                if time.monotonic() - conn.last_used > self.idle_timeout or not self._is_healthy(conn):
+                    conn.close()
+                    continue
+                break
+        except Exception:
+            slot.semaphore.release()
+            raise
+        conn.key = key
+        return conn
+
+    def release(self, conn, broken=False):
+        slot = self._slots.get(conn.key)
+        if slot is None or broken:
+            conn.close()
+        else:
+            conn.last_used = time.monotonic()
+            with self._lock:
+                slot.idle.append(conn)
+        if slot is not None:
+            slot.semaphore.release()
+
+    @contextmanager
+    def connection(self, router=None):
+        """Yield a MySQLdb connection to the RADIUS database for ``router``.
+
+        Uncommitted work is rolled back if the block raises; the connection is
+        discarded instead of pooled if the rollback itself fails.
+        """
+        conn = self.acquire(credentials(router))
+        broken = False
+        try:
+            yield conn.db
+        except Exception:
+            try:
+                conn.db.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close_all(self):
+        with self._lock:
+            slots, self._slots = self._slots, {}
+        for slot in slots.values():
+            for conn in slot.idle:
+                conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_radius_pool():
+    """Return the process-wide RadiusConnectionPool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RadiusConnectionPool(
+                    max_connections=settings.RADIUS_POOL_MAX_CONNECTIONS,
+                    idle_timeout=settings.RADIUS_POOL_IDLE_TIMEOUT,
+                    health_check_interval=settings.RADIUS_POOL_HEALTH_CHECK_INTERVAL,
+                    acquire_timeout=settings.RADIUS_POOL_ACQUIRE_TIMEOUT,
+                    connect_timeout=settings.RADIUS_DB_CONNECT_TIMEOUT,
+                    query_timeout=settings.RADIUS_DB_QUERY_TIMEOUT,
+                )
+    return _pool
+
+
+def radius_db(router=None):
+    """Context manager yielding a pooled FreeRADIUS connection (default server, or ``router``'s)."""
+    return get_radius_pool().connection(router)
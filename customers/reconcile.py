@@ -0,0 +1,268 @@
+import logging
+from collections import defaultdict
+from django.conf import settings
+from routeros_api.exceptions import RouterOsApiConnectionError, FatalRouterOsApiError
+from .radius import shared_users
+
+logger = logging.getLogger(__name__)
+
+HOTSPOT_USERS = '/ip/hotspot/user'
+PPP_SECRETS = '/ppp/secret'
+QUEUES = '/queue/simple'
+RESOURCES = (HOTSPOT_USERS, PPP_SECRETS, QUEUES)
+
+# Attributes compared against the router when deciding whether an entry needs
+# a `set`. Anything else in the desired entry (e.g. queue `target`, which
+# RouterOS rewrites, or hotspot `shared-users`) is only sent on `add`.
+COMPARED_ATTRIBUTES = {
+    HOTSPOT_USERS: ('password', 'profile', 'limit-bytes-in', 'limit-bytes-out', 'disabled'),
+    PPP_SECRETS: ('password', 'service', 'remote-address', 'disabled'),
+    QUEUES: ('max-limit', 'disabled'),
+}
+
+# PPP service used for VPN subscribers' secrets. RouterOS only knows its own
+# service names (pppoe, l2tp, pptp, ovpn, sstp, any).
+VPN_SERVICE = 'l2tp'
+
+# Tables each subscription connection type creates entries in.
+TYPE_RESOURCES = {
+    'HOTSPOT': (HOTSPOT_USERS,),
+    'PPPOE': (PPP_SECRETS, QUEUES),
+    'VPN': (PPP_SECRETS, QUEUES),
+}
+
+# Below this many names a targeted reconcile queries entries one by one
+# instead of printing the whole table.
+TARGETED_READ_LIMIT = 20
+
+_BOOLEANS = {'true': 'yes', 'yes': 'yes', 'false': 'no', 'no': 'no'}
+
+
+def queue_name(username):
+    return f"q_{username}"
+
+
+def username_of(path, name):
+    """The subscriber an entry in ``path`` belongs to (queues are named after their user)."""
+    if path == QUEUES and name.startswith('q_'):
+        return name[2:]
+    return name
+
+
+def _normalize(value):
+    value = '' if value is None else str(value)
+    return _BOOLEANS.get(value, value)
+
+
+def _max_limit(package):
+    return f"{int(package.upload_bandwidth * 1000000)}/{int(package.download_bandwidth * 1000000)}"
+
+
+def desired_entries(sub):
+    """Return {resource_path: attributes} describing how ``sub`` should look on its router."""
+    package = sub.package
+    if sub.connection_type == 'HOTSPOT':
+        return {HOTSPOT_USERS: {
+            'name': sub.username,
+            'password': sub.password,
+            'profile': package.name.lower(),
+            'limit-bytes-in': str(int(package.download_bandwidth * 1024 * 1024 * 1000)),
+            'limit-bytes-out': str(int(package.upload_bandwidth * 1024 * 1024 * 1000)),
+            'shared-users': str(shared_users(package)),
+            'disabled': 'no',
+        }}
+    if sub.connection_type == 'PPPOE':
+        return {
+            PPP_SECRETS: {
+                'name': sub.username,
+                'password': sub.password,
+                'service': 'pppoe',
+                'disabled': 'no',
+            },
+            QUEUES: {
+                'name': queue_name(sub.username),
+                'target': sub.username,
+                'max-limit': _max_limit(package),
+                'disabled': 'no',
+            },
+        }
+    if sub.connection_type.startswith('VPN'):
+        entries = {PPP_SECRETS: {
+            'name': sub.username,
+            'password': sub.password,
+            'service': VPN_SERVICE,
+            'remote-address': getattr(sub, 'static_ip', None) or '',
+            'disabled': 'no',
+        }}
+        if package.upload_bandwidth and package.download_bandwidth:
+            entries[QUEUES] = {
+                'name': queue_name(sub.username),
+                'target': sub.username,
+                'max-limit': _max_limit(package),
+                'disabled': 'no',
+            }
+        return entries
+    return {}
+
+
+def build_desired_state(subscriptions):
+    """Return ({path: {name: attributes}}, {(path, name): subscription_id})."""
+    state = {path: {} for path in RESOURCES}
+    owners = {}
+    for sub in subscriptions:
+        for path, attributes in desired_entries(sub).items():
+            state[path][attributes['name']] = attributes
+            owners[(path, attributes['name'])] = sub.id
+    return state, owners
+
+
+def managed_names(connection_types):
+    """Names the billing system owns on a router, per table.
+
+    ``connection_types`` maps usernames to the connection types their
+    subscriptions on the router have had. A name is only owned in those
+    types' tables, so a same-named entry in another table (made by hand, or
+    left from a type the user never had) is not touched. A username with no
+    known type (None, e.g. a deleted subscription) is owned in every table.
+    """
+    names = {path: set() for path in RESOURCES}
+    for username, types in connection_types.items():
+        paths = RESOURCES if not types else {path for kind in types for path in TYPE_RESOURCES.get(kind, ())}
+        for path in paths:
+            names[path].add(queue_name(username) if path == QUEUES else username)
+    return names
+
+
+def read_router_state(api, names=None):
+    """Read hotspot users, PPP secrets and simple queues from a router.
+
+    With ``names`` (as returned by managed_names) and only a handful of them,
+    entries are looked up individually instead of printing whole tables.
+    """
+    state = {}
+    for path in RESOURCES:
+        resource = api.get_resource(path)
+        wanted = names[path] if names is not None else None
+        if wanted is not None and len(wanted) <= TARGETED_READ_LIMIT:
+            rows = [row for name in wanted for row in resource.get(name=name)]
+        else:
+            rows = resource.get()
+        state[path] = {
+            row['name']: row for row in rows
+            if 'name' in row and (wanted is None or row['name'] in wanted)
+        }
+    return state
+
+
+class Change:
+    __slots__ = ('action', 'path', 'name', 'id', 'attributes', 'subscription_id')
+
+    def __init__(self, action, path, name, id=None, attributes=None, subscription_id=None):
+        self.action = action
+        self.path = path
+        self.name = name
+        self.id = id
+        self.attributes = attributes or {}
+        self.subscription_id = subscription_id
+
+    def as_dict(self):
+        return {
+            'action': self.action,
+            'path': self.path,
+            'name': self.name,
+            'attributes': self.attributes,
+            'subscription_id': self.subscription_id,
+        }
+
+
+def plan_changes(desired, current, owners, managed):
+    """Diff desired against current router state for the names in ``managed``."""
+    changes = []
+    for path in RESOURCES:
+        wanted = desired[path]
+        present = current.get(path, {})
+        for name, attributes in wanted.items():
+            row = present.get(name)
+            if row is None:
+                changes.append(Change('add', path, name, attributes=attributes, subscription_id=owners.get((path, name))))
+                continue
+            diff = {
+                key: attributes[key] for key in COMPARED_ATTRIBUTES[path]
+                if key in attributes and _normalize(row.get(key)) != _normalize(attributes[key])
+            }
+            if diff:
+                changes.append(Change('set', path, name, id=row['id'], attributes=diff, subscription_id=owners.get((path, name))))
+        for name in (managed[path] & set(present)) - set(wanted):
+            changes.append(Change('remove', path, name, id=present[name]['id']))
+    return changes
+
+
+def bulk_call(resource, command, ids, attributes=None, chunk_size=None):
+    """Run ``command`` (set/disable/enable/remove) on many entries at once.
+
+    RouterOS accepts a comma-separated ``numbers`` list, so each chunk of ids
+    is a single round trip. If a chunk is rejected it is split in half until
+    the offending entries are isolated. Returns {id: error} for the ids that
+    failed; connection errors propagate.
+    """
+    chunk_size = chunk_size or settings.ROUTER_BULK_CHUNK_SIZE
+    failed = {}
+
+    def run(chunk):
+        try:
+            resource.call(command, dict(attributes or {}, numbers=','.join(chunk)))
+        except (RouterOsApiConnectionError, FatalRouterOsApiError, OSError):
+            raise
+        except Exception as e:
+            if len(chunk) == 1:
+                failed[chunk[0]] = str(e)
+                return
+            middle = len(chunk) // 2
+            run(chunk[:middle])
+            run(chunk[middle:])
+
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        run(ids[i:i + chunk_size])
+    return failed
+
+
+def apply_changes(api, changes):
+    """Apply planned changes; returns (applied changes, [(change, error)] for the failed ones).
+
+    Adds are sent one by one in the given order. Sets with identical
+    attributes (e.g. re-enabling many users) and removals are then grouped per
+    table and sent as bulk commands, so they run after all the adds.
+    Connection errors propagate.
+    """
+    applied, failed = [], []
+    batches = defaultdict(list)
+    for change in changes:
+        if change.action == 'add':
+            try:
+                api.get_resource(change.path).call('add', change.attributes)
+                applied.append(change)
+            except (RouterOsApiConnectionError, FatalRouterOsApiError, OSError):
+                raise
+            except Exception as e:
+                logger.error(f"Failed to add {change.name} on {change.path}: {e}")
+                failed.append((change, str(e)))
+        else:
+            batches[(change.action, change.path, tuple(sorted(change.attributes.items())))].append(change)
+    for (action, path, attributes), group in batches.items():
+        by_id = {change.id: change for change in group}
+        errors = bulk_call(api.get_resource(path), action, list(by_id), dict(attributes) or None)
+        for change in group:
+            if change.id in errors:
+                logger.error(f"Failed to {action} {change.name} on {path}: {errors[change.id]}")
+                failed.append((change, errors[change.id]))
+            else:
+                applied.append(change)
+    return applied, failed
+
+
+def summarize(changes):
+    counts = defaultdict(int)
+    for change in changes:
+        counts[change.action] += 1
+    return {'add': counts['add'], 'set': counts['set'], 'remove': counts['remove']}
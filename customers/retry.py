@@ -0,0 +1,205 @@
+import random
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import ProvisioningJob, Router, Subscription, SyncRetry
+from . import health
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number ``attempts + 1``: exponential with equal jitter."""
+    delay = min(settings.SYNC_RETRY_MAX_DELAY, settings.SYNC_RETRY_BASE_DELAY * 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def record_failures(operation, rows):
+    """Queue retries for failed (subscription_id, router_id, username, error) rows.
+
+    Subscriptions that already have a pending or dead-lettered retry for this
+    operation keep it; everything else is scheduled for a first retry.
+    """
+    if not rows:
+        return 0
+    now = timezone.now()
+    SyncRetry.objects.bulk_create([
+        SyncRetry(
+            subscription_id=subscription_id, router_id=router_id, username=username, operation=operation,
+            last_error=str(error)[:1000], next_attempt_at=now + timedelta(seconds=backoff(0))
+        )
+        for subscription_id, router_id, username, error in rows
+    ], batch_size=1000, ignore_conflicts=True)
+    logger.info(f"Queued {len(rows)} {operation} retries")
+    return len(rows)
+
+
+def _retry_sync(router, retries):
+    from .sync import _reconcile_router, failed_subscriptions
+    from .reconcile import username_of
+    subs = {
+        sub.id: sub for sub in Subscription.objects.filter(
+            id__in=[retry.subscription_id for retry in retries]
+        ).select_related('router', 'package')
+    }
+    active = [sub for sub in subs.values() if sub.is_active and sub.router_id == router.id]
+    retired = {retry.username for retry in retries if retry.subscription_id not in {sub.id for sub in active}}
+    result = _reconcile_router(router, active, retired, False)
+    failed = failed_subscriptions(result, active)
+    if result['error']:
+        failed.update({retry.subscription_id: result['error'] for retry in retries})
+        return failed
+    # Removals carry no subscription id; match them back by username.
+    failed_names = {}
+    for change, error in result['failed']:
+        if change.subscription_id is None:
+            failed_names[username_of(change.path, change.name)] = error
+    failed.update({
+        retry.subscription_id: failed_names[retry.username]
+        for retry in retries if retry.username in failed_names and retry.username in retired
+    })
+    return failed
+
+
+def _retry_disable(router, retries):
+    from .expiry import _disable_router_group
+    rows = list(
+        Subscription.objects.filter(id__in=[retry.subscription_id for retry in retries], is_active=False)
+        .values_list('id', 'router_id', 'username', 'connection_type')
+    )
+    # Renewed or deleted subscriptions no longer need disabling.
+    if not rows:
+        return {}
+    result = _disable_router_group(router, rows)
+    return {sub_id: result['error'] or 'disable failed' for sub_id in result['failed']}
+
+
+def _retry_radius(router, retries):
+    from . import radius
+    from .radius_pool import radius_db
+    active = list(Subscription.objects.filter(
+        id__in=[retry.subscription_id for retry in retries], is_active=True
+    ).select_related('package'))
+    removed = {retry.username for retry in retries} - {sub.username for sub in active}
+    try:
+        with radius_db(router) as db:
+            radius.sync_users(db.cursor(), active, removed)
+            db.commit()
+    except Exception as e:
+        return {retry.subscription_id: str(e) for retry in retries}
+    return {}
+
+
+HANDLERS = {
+    'SYNC': _retry_sync,
+    'DISABLE': _retry_disable,
+    'RADIUS': _retry_radius,
+}
+
+
+def _retry_router(router, retries):
+    """Run one router's due retries; returns {(subscription_id, operation): error} for the ones that failed again."""
+    failed = {}
+    by_operation = defaultdict(list)
+    for retry in retries:
+        by_operation[retry.operation].append(retry)
+    try:
+        for operation, group in by_operation.items():
+            try:
+                errors = HANDLERS[operation](router, group)
+            except Exception as e:
+                logger.error(f"{operation} retries on router {router.name} failed: {e}")
+                errors = {retry.subscription_id: str(e) for retry in group}
+            failed.update({(retry.subscription_id, operation): errors[retry.subscription_id]
+                           for retry in group if retry.subscription_id in errors})
+    finally:
+        connection.close()
+    return failed
+
+
+def process_retries(now=None):
+    """Retry every due SyncRetry, routers in parallel.
+
+    At most SYNC_RETRY_PER_ROUTER_LIMIT retries per router are attempted per
+    pass, and routers whose circuit is open are postponed without spending an
+    attempt. Succeeded retries are deleted; failed ones back off and become
+    dead letters after SYNC_RETRY_MAX_ATTEMPTS. Returns counts.
+    """
+    now = now or timezone.now()
+    due = SyncRetry.objects.filter(status='PENDING', next_attempt_at__lte=now).order_by('next_attempt_at')
+    groups = defaultdict(list)
+    for retry in due[:settings.SYNC_RETRY_BATCH_SIZE]:
+        if len(groups[retry.router_id]) < settings.SYNC_RETRY_PER_ROUTER_LIMIT:
+            groups[retry.router_id].append(retry)
+    stats = {'attempted': 0, 'succeeded': 0, 'failed': 0, 'dead': 0, 'postponed': 0, 'dropped': 0}
+    if not groups:
+        return stats
+
+    routers = Router.objects.in_bulk([router_id for router_id in groups if router_id])
+    orphans = [retry.id for router_id, retries in groups.items() if router_id not in routers for retry in retries]
+    if orphans:
+        SyncRetry.objects.filter(id__in=orphans).delete()
+        stats['dropped'] = len(orphans)
+    groups = {router_id: retries for router_id, retries in groups.items() if router_id in routers}
+    down = health.unavailable(router for router in routers.values() if router.connection_type != 'RADIUS')
+    if down:
+        postponed = [retry.id for router_id in down for retry in groups.pop(router_id, [])]
+        SyncRetry.objects.filter(id__in=postponed).update(
+            next_attempt_at=now + timedelta(seconds=settings.ROUTER_CIRCUIT_PROBE_INTERVAL), updated_at=now
+        )
+        stats['postponed'] = len(postponed)
+    if not groups:
+        return stats
+
+    workers = max(1, min(settings.ROUTER_SYNC_CONCURRENCY, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync-retry') as pool:
+        futures = {
+            router_id: pool.submit(_retry_router, routers[router_id], retries)
+            for router_id, retries in groups.items()
+        }
+        failures = {router_id: future.result() for router_id, future in futures.items()}
+
+    succeeded, retried = [], []
+    for router_id, retries in groups.items():
+        for retry in retries:
+            error = failures[router_id].get((retry.subscription_id, retry.operation))
+            if error is None:
+                succeeded.append(retry)
+                continue
+            retry.attempts += 1
+            retry.last_error = str(error)[:1000]
+            retry.updated_at = now
+            if retry.attempts >= settings.SYNC_RETRY_MAX_ATTEMPTS:
+                retry.status = 'DEAD'
+                stats['dead'] += 1
+                logger.warning(f"Giving up on {retry.operation} for {retry.username} after {retry.attempts} attempts: {error}")
+            else:
+                retry.next_attempt_at = now + timedelta(seconds=backoff(retry.attempts))
+            retried.append(retry)
+    SyncRetry.objects.filter(id__in=[retry.id for retry in succeeded]).delete()
+    SyncRetry.objects.bulk_update(retried, ['attempts', 'last_error', 'status', 'next_attempt_at', 'updated_at'], batch_size=500)
+    _resolve_provisioning_jobs([retry.subscription_id for retry in succeeded if retry.operation in ('SYNC', 'RADIUS')])
+    stats.update(
+        attempted=len(succeeded) + len(retried), succeeded=len(succeeded), failed=len(retried) - stats['dead']
+    )
+    logger.info(f"Processed sync retries: {stats}")
+    return stats
+
+
+def _resolve_provisioning_jobs(subscription_ids):
+    """Mark provisioning jobs whose network step has now been done by a retry."""
+    if not subscription_ids:
+        return
+    jobs = ProvisioningJob.objects.filter(subscription_id__in=subscription_ids, network_status='FAILED')
+    now = timezone.now()
+    jobs.filter(notification_status='SUCCESS').update(network_status='SUCCESS', status='SUCCESS', error='', updated_at=now)
+    jobs.update(network_status='SUCCESS', status='PARTIAL', updated_at=now)
+
+
+def replay(queryset):
+    """Put retries (typically dead letters) back in the queue for an immediate attempt."""
+    return queryset.update(status='PENDING', attempts=0, next_attempt_at=timezone.now(), updated_at=timezone.now())
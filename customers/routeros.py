@@ -0,0 +1,221 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+import routeros_api
+from routeros_api.exceptions import RouterOsApiConnectionError, FatalRouterOsApiError
+from . import health
+
+logger = logging.getLogger(__name__)
+
+
+class RouterConnectionError(Exception):
+    """Raised when no RouterOS session can be obtained for a router."""
+
+
+class RouterPoolTimeout(RouterConnectionError):
+    """Raised when every pooled session to a router stays busy for too long."""
+
+
+class RouterUnavailable(RouterConnectionError):
+    """Raised without trying to connect while a router's circuit is open."""
+
+
+class _PooledConnection:
+    def __init__(self, api_pool, api):
+        self.api_pool = api_pool
+        self.api = api
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.api_pool.disconnect()
+        except Exception as e:
+            logger.debug(f"Error closing RouterOS session to {self.api_pool.host}: {e}")
+
+
+class _RouterSlot:
+    def __init__(self, max_connections, version):
+        self.version = version
+        self.idle = []
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+
+
+class RouterConnectionPool:
+    """Process-wide pool of authenticated RouterOS API sessions keyed by Router.id.
+
+    Sessions are reused across calls, health-checked when they have been idle
+    for a while, capped per router, and dropped as soon as the router's
+    ``updated_at`` changes so edited credentials take effect immediately.
+    """
+
+    def __init__(self, max_connections=4, idle_timeout=300, health_check_interval=30,
+                 acquire_timeout=30, socket_timeout=15, plaintext_login=True):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.socket_timeout = socket_timeout
+        self.plaintext_login = plaintext_login
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _slot_for(self, router):
+        version = router.updated_at
+        stale = []
+        with self._lock:
+            slot = self._slots.get(router.id)
+            if slot is None:
+                slot = _RouterSlot(self.max_connections, version)
+                self._slots[router.id] = slot
+            elif slot.version != version:
+                logger.info(f"Router {router.name} changed, dropping {len(slot.idle)} pooled sessions")
+                stale, slot.idle = slot.idle, []
+                slot.version = version
+        for conn in stale:
+            conn.close()
+        return slot
+
+    def _connect(self, router):
+        api_pool = routeros_api.RouterOsApiPool(
+            router.ip_address,
+            username=router.username,
+            password=router.password,
+            port=router.api_port or 8728,
+            use_ssl=False,
+            plaintext_login=self.plaintext_login
+        )
+        api_pool.socket_timeout = self.socket_timeout
+        try:
+            api = api_pool.get_api()
+        except Exception as e:
+            raise RouterConnectionError(f"Could not connect to router {router.name} ({router.ip_address}): {e}") from e
+        logger.debug(f"Opened RouterOS session to {router.name}")
+        return _PooledConnection(api_pool, api)
+
+    def _is_healthy(self, conn):
+        if not conn.api_pool.connected:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.api.get_resource('/system/identity').get()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, router):
+        slot = self._slot_for(router)
+        if not slot.semaphore.acquire(timeout=self.acquire_timeout):
+            raise RouterPoolTimeout(f"Timed out waiting for a free session to router {router.name}")
+        try:
+            while True:
+                with self._lock:
+                    conn = slot.idle.pop() if slot.idle else None
+                if conn is None:
+                    conn = self._connect(router)
+                    break
+                if time.monotonic() - conn.last_used > self.idle_timeout or not self._is_healthy(conn):
+                    conn.close()
+                    continue
+                break
+        except Exception:
+            slot.semaphore.release()
+            raise
+        conn.version = slot.version
+        return conn
+
+    def release(self, router, conn, broken=False):
+        slot = self._slots.get(router.id)
+        if slot is None:
+            conn.close()
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            reusable = not broken and conn.api_pool.connected and conn.version == slot.version
+            if reusable:
+                slot.idle.append(conn)
+        if not reusable:
+            conn.close()
+        slot.semaphore.release()
+
+    @contextmanager
+    def connection(self, router):
+        """Yield a ready RouterOS API for ``router`` and return it to the pool afterwards."""
+        conn = self.acquire(router)
+        broken = False
+        try:
+            yield conn.api
+        except (RouterOsApiConnectionError, FatalRouterOsApiError, OSError):
+            broken = True
+            raise
+        finally:
+            self.release(router, conn, broken=broken)
+
+    def close_router(self, router_id):
+        with self._lock:
+            slot = self._slots.pop(router_id, None)
+        if slot:
+            for conn in slot.idle:
+                conn.close()
+
+    def close_all(self):
+        with self._lock:
+            slots, self._slots = self._slots, {}
+        for slot in slots.values():
+            for conn in slot.idle:
+                conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_router_pool():
+    """Return the process-wide RouterConnectionPool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RouterConnectionPool(
+                    max_connections=settings.ROUTEROS_POOL_MAX_CONNECTIONS,
+                    idle_timeout=settings.ROUTEROS_POOL_IDLE_TIMEOUT,
+                    health_check_interval=settings.ROUTEROS_POOL_HEALTH_CHECK_INTERVAL,
+                    acquire_timeout=settings.ROUTEROS_POOL_ACQUIRE_TIMEOUT,
+                    socket_timeout=settings.ROUTEROS_SOCKET_TIMEOUT,
+                    plaintext_login=settings.ROUTEROS_PLAINTEXT_LOGIN,
+                )
+    return _pool
+
+
+def ensure_available(router):
+    """Raise RouterUnavailable if ``router``'s circuit is open, or VpnTunnelError if its VPN tunnel is down."""
+    state = health.get_health(router.id)
+    if health.is_open(state):
+        raise RouterUnavailable(f"Router {router.name} is unavailable (circuit open): {state['last_error']}")
+    if router.connection_type == 'VPN':
+        from .vpn import tunnel_for
+        tunnel_for(router)
+
+
+@contextmanager
+def router_api(router):
+    """Context manager yielding a pooled RouterOS API session for ``router``.
+
+    Fails fast with RouterUnavailable while the router's circuit is open (and
+    with VpnTunnelError while a VPN router's tunnel is down); connection
+    failures and successful session acquisitions are recorded in the health
+    registry.
+    """
+    ensure_available(router)
+    started = time.monotonic()
+    try:
+        with get_router_pool().connection(router) as api:
+            health.record_success(router, time.monotonic() - started)
+            yield api
+    except RouterPoolTimeout:
+        raise
+    except (RouterConnectionError, RouterOsApiConnectionError, FatalRouterOsApiError, OSError) as e:
+        health.record_failure(router, e)
+        raise
@@ -0,0 +1,258 @@
+import asyncio
+import random
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from .aio_routeros import encode_sentence, read_sentence, parse_attributes
+
+logger = logging.getLogger(__name__)
+
+# Resource paths the simulator serves, with the attribute that must be unique per table.
+TABLES = {
+    '/ip/hotspot/user': 'name',
+    '/ppp/secret': 'name',
+    '/queue/simple': 'name',
+    '/ip/dhcp-server/lease': 'address',
+    '/ip/hotspot/active': 'user',
+    '/ppp/active': 'name',
+}
+
+# Values RouterOS accepts for a PPP secret's service; anything else is rejected.
+PPP_SERVICES = {'any', 'async', 'l2tp', 'ovpn', 'pppoe', 'pptp', 'sstp'}
+
+_FLAGS = {'yes': 'true', 'no': 'false', 'true': 'true', 'false': 'false'}
+
+
+class SimulatedTrap(Exception):
+    """Becomes a !trap reply."""
+
+
+class SimulatedRouter:
+    """In-memory state and command handling for one simulated MikroTik router."""
+
+    def __init__(self, name, username='admin', password='', latency=0.0, failure_rate=0.0, drop_rate=0.0, seed=None):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.down = False
+        self.tables = {path: {} for path in TABLES}
+        self.commands = Counter()
+        self.rng = random.Random(seed)
+        self._next_id = 1
+
+    def _new_id(self):
+        row_id = f"*{self._next_id:X}"
+        self._next_id += 1
+        return row_id
+
+    def seed(self, path, rows):
+        for row in rows:
+            self._add(path, dict(row))
+
+    def _add(self, path, attributes):
+        table = self.tables[path]
+        key = TABLES[path]
+        value = attributes.get(key)
+        if value is not None and any(row.get(key) == value for row in table.values()):
+            raise SimulatedTrap(f"failure: already have entry with such {key}")
+        if path == '/ppp/secret' and attributes.get('service', 'any') not in PPP_SERVICES:
+            raise SimulatedTrap("input does not match any value of service")
+        row_id = self._new_id()
+        row = {'disabled': 'false'}
+        row.update({k: _FLAGS.get(v, v) if k == 'disabled' else v for k, v in attributes.items()})
+        row['.id'] = row_id
+        table[row_id] = row
+        return row_id
+
+    def _resolve(self, path, numbers):
+        table = self.tables[path]
+        key = TABLES[path]
+        ids = []
+        for item in numbers.split(','):
+            if item in table:
+                ids.append(item)
+                continue
+            match = next((row_id for row_id, row in table.items() if row.get(key) == item), None)
+            if match is None:
+                raise SimulatedTrap(f"no such item ({item})")
+            ids.append(match)
+        return ids
+
+    def _print(self, path, attributes, queries):
+        rows = []
+        for row in self.tables[path].values():
+            if all(_matches(row, query) for query in queries):
+                rows.append(row)
+        proplist = attributes.get('.proplist')
+        if proplist:
+            fields = proplist.split(',')
+            rows = [{k: v for k, v in row.items() if k in fields} for row in rows]
+        return [dict(row) for row in rows]
+
+    def execute(self, command, attributes, queries):
+        """Run one API command; returns (rows, done_attributes)."""
+        self.commands[command] += 1
+        if command == '/system/identity/print':
+            return [{'name': self.name}], {}
+        path, _, verb = command.rpartition('/')
+        if path not in TABLES:
+            raise SimulatedTrap(f"no such command prefix ({command})")
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            raise SimulatedTrap("failure: simulated failure")
+        if verb in ('print', 'getall'):
+            return self._print(path, attributes, queries), {}
+        if verb == 'add':
+            return [], {'ret': self._add(path, attributes)}
+        numbers = attributes.pop('.id', None) or attributes.pop('numbers', None)
+        if not numbers:
+            raise SimulatedTrap("missing value for numbers")
+        ids = self._resolve(path, numbers)
+        table = self.tables[path]
+        if verb == 'remove':
+            for row_id in ids:
+                del table[row_id]
+        elif verb == 'set':
+            for row_id in ids:
+                table[row_id].update({k: _FLAGS.get(v, v) if k == 'disabled' else v for k, v in attributes.items()})
+        elif verb in ('enable', 'disable'):
+            for row_id in ids:
+                table[row_id]['disabled'] = 'true' if verb == 'disable' else 'false'
+        else:
+            raise SimulatedTrap(f"no such command ({command})")
+        return [], {}
+
+
+def _matches(row, query):
+    if query.startswith('?-'):
+        return query[2:] not in row
+    body = query[1:]
+    if '=' not in body:
+        return body in row
+    key, _, value = body.partition('=')
+    return row.get(key) == value
+
+
+class RouterSimulator:
+    """Serves any number of SimulatedRouters over the RouterOS API protocol on localhost.
+
+    Each router listens on its own port (``base_port + index``, or an
+    ephemeral port when ``base_port`` is 0). Runs either inside an existing
+    event loop (``await start()``) or in a background thread (``running()``)
+    so blocking code such as routeros_api can talk to it.
+    """
+
+    def __init__(self, count=1, host='127.0.0.1', base_port=0, **router_options):
+        self.host = host
+        self.base_port = base_port
+        seed = router_options.pop('seed', None)
+        self.routers = [
+            SimulatedRouter(f"sim-{index}", seed=None if seed is None else seed + index, **router_options)
+            for index in range(count)
+        ]
+        self.ports = []
+        self._servers = []
+        self._loop = None
+        self._thread = None
+
+    @property
+    def endpoints(self):
+        return [(router, self.host, port) for router, port in zip(self.routers, self.ports)]
+
+    async def start(self):
+        for index, router in enumerate(self.routers):
+            port = self.base_port + index if self.base_port else 0
+            server = await asyncio.start_server(
+                lambda reader, writer, router=router: self._serve(router, reader, writer), self.host, port
+            )
+            self._servers.append(server)
+            self.ports.append(server.sockets[0].getsockname()[1])
+        logger.info(f"RouterOS simulator serving {len(self.routers)} routers on {self.host}")
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    async def _serve(self, router, reader, writer):
+        logged_in = False
+        try:
+            if router.down:
+                return
+            while True:
+                words = await read_sentence(reader)
+                if not words:
+                    continue
+                command = words[0]
+                attributes, tag = parse_attributes(words[1:])
+                queries = [word for word in words[1:] if word.startswith('?')]
+                suffix = [f".tag={tag}"] if tag is not None else []
+                if router.latency:
+                    await asyncio.sleep(router.latency)
+                if router.drop_rate and router.rng.random() < router.drop_rate:
+                    return
+                if command == '/login':
+                    if attributes.get('name') == router.username and attributes.get('password', '') == router.password:
+                        logged_in = True
+                        writer.write(encode_sentence(['!done'] + suffix))
+                    else:
+                        writer.write(encode_sentence(['!trap', '=message=invalid user name or password (6)'] + suffix))
+                        writer.write(encode_sentence(['!done'] + suffix))
+                elif command == '/quit':
+                    writer.write(encode_sentence(['!fatal', 'session terminated on request']))
+                    return
+                elif not logged_in:
+                    writer.write(encode_sentence(['!fatal', 'not logged in']))
+                    return
+                else:
+                    try:
+                        rows, done = router.execute(command, attributes, queries)
+                        for row in rows:
+                            writer.write(encode_sentence(['!re'] + [f"={k}={v}" for k, v in row.items()] + suffix))
+                        writer.write(encode_sentence(['!done'] + [f"={k}={v}" for k, v in done.items()] + suffix))
+                    except SimulatedTrap as e:
+                        writer.write(encode_sentence(['!trap', f"=message={e}"] + suffix))
+                        writer.write(encode_sentence(['!done'] + suffix))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @contextmanager
+    def running(self):
+        """Run the simulator on a background event loop for the duration of the block."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        errors = []
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='routeros-sim', daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread.join()
+            self._loop.close()
+            raise errors[0]
+        try:
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
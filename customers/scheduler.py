@@ -0,0 +1,168 @@
+import heapq
+import time
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import Subscription, SubscriptionChange
+from .expiry import expire_subscriptions
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """In-memory priority queue of upcoming Subscription.end_date deadlines.
+
+    The heap holds (end_date, subscription_id) for active subscriptions that
+    expire within ``horizon`` seconds and is rebuilt from the database on
+    start and every time the horizon is half used up. Extensions, renewals and
+    new subscriptions are picked up by tailing the SubscriptionChange outbox;
+    superseded heap entries are skipped lazily when popped. Outbox ids are
+    allocated at insert but become visible at commit, so ids skipped over by
+    the tail are re-read for ``gap_timeout`` seconds in case their transaction
+    commits late. Due subscriptions
+    are handed to expire_subscriptions(), which re-checks end_date and is_active
+    under a row lock, so firing early or twice is harmless.
+    """
+
+    # Jumps larger than this come from sequence caching, not in-flight transactions.
+    MAX_GAPS = 1000
+
+    def __init__(self, horizon=3600, poll_interval=5, batch_size=500, gap_timeout=60):
+        self.horizon = horizon
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.heap = []
+        self.deadlines = {}
+        self.last_change_id = 0
+        self.gaps = {}
+        self.loaded_until = None
+
+    def schedule(self, subscription_id, end_date):
+        if self.deadlines.get(subscription_id) == end_date:
+            return
+        self.deadlines[subscription_id] = end_date
+        heapq.heappush(self.heap, (end_date, subscription_id))
+
+    def unschedule(self, subscription_id):
+        self.deadlines.pop(subscription_id, None)
+
+    def note_gaps(self, after, ids):
+        """Remember the ids between ``after`` and max(``ids``) that were not seen."""
+        present = set(ids)
+        missing = [change_id for change_id in range(after + 1, max(ids)) if change_id not in present]
+        now = time.monotonic()
+        for change_id in missing[-self.MAX_GAPS:]:
+            self.gaps.setdefault(change_id, now)
+
+    def rebuild(self):
+        """Reload every active subscription expiring within the horizon."""
+        now = timezone.now()
+        self.loaded_until = now + timedelta(seconds=self.horizon)
+        self.heap, self.deadlines = [], {}
+        self.last_change_id = SubscriptionChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        # Changes still uncommitted below the newest id are not in the snapshot either.
+        self.gaps = {}
+        recent = list(SubscriptionChange.objects.filter(
+            id__gt=self.last_change_id - self.MAX_GAPS
+        ).values_list('id', flat=True))
+        if recent:
+            self.note_gaps(max(self.last_change_id - self.MAX_GAPS, 0), recent)
+        upcoming = Subscription.objects.filter(
+            is_active=True, end_date__lt=self.loaded_until
+        ).values_list('id', 'end_date')
+        for subscription_id, end_date in upcoming.iterator(chunk_size=2000):
+            self.deadlines[subscription_id] = end_date
+            self.heap.append((end_date, subscription_id))
+        heapq.heapify(self.heap)
+        logger.info(f"Expiry scheduler loaded {len(self.heap)} deadlines up to {self.loaded_until}")
+
+    def poll_changes(self):
+        """Reschedule subscriptions recorded in the outbox since the last poll, or committed late."""
+        now = time.monotonic()
+        self.gaps = {change_id: seen for change_id, seen in self.gaps.items() if now - seen < self.gap_timeout}
+        query = Q(id__gt=self.last_change_id)
+        if self.gaps:
+            query |= Q(id__in=list(self.gaps))
+        changes = list(
+            SubscriptionChange.objects.filter(query)
+            .order_by('id').values_list('id', 'subscription_id', 'change_type')[:self.batch_size * 10]
+        )
+        if not changes:
+            return 0
+        for change_id, _, _ in changes:
+            self.gaps.pop(change_id, None)
+        new_ids = [change_id for change_id, _, _ in changes if change_id > self.last_change_id]
+        if new_ids:
+            self.note_gaps(self.last_change_id, new_ids)
+            self.last_change_id = new_ids[-1]
+        touched = {subscription_id for _, subscription_id, _ in changes}
+        current = dict(
+            Subscription.objects.filter(id__in=touched, is_active=True).values_list('id', 'end_date')
+        )
+        for subscription_id in touched:
+            end_date = current.get(subscription_id)
+            if end_date is None:
+                self.unschedule(subscription_id)
+            elif end_date < self.loaded_until:
+                self.schedule(subscription_id, end_date)
+            else:
+                self.unschedule(subscription_id)
+        return len(changes)
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] < now and len(due) < self.batch_size:
+            end_date, subscription_id = heapq.heappop(self.heap)
+            if self.deadlines.get(subscription_id) == end_date:
+                del self.deadlines[subscription_id]
+                due.append(subscription_id)
+        return due
+
+    def seconds_until_next(self, now):
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, (self.heap[0][0] - now).total_seconds()))
+
+    def run_once(self, on_expired=None):
+        close_old_connections()
+        now = timezone.now()
+        if self.loaded_until is None or now + timedelta(seconds=self.horizon / 2) >= self.loaded_until:
+            self.rebuild()
+        self.poll_changes()
+        expired = 0
+        now = timezone.now()
+        due = self.pop_due(now)
+        while due:
+            stats = expire_subscriptions(now=now, ids=due)
+            expired += stats['expired']
+            now = timezone.now()
+            due = self.pop_due(now)
+        if expired and on_expired:
+            on_expired()
+        return expired
+
+    def run_forever(self, on_expired=None):
+        while True:
+            try:
+                self.run_once(on_expired)
+            except Exception as e:
+                logger.error(f"Expiry scheduler iteration failed: {e}")
+                self.loaded_until = None
+                time.sleep(self.poll_interval)
+                continue
+            time.sleep(self.seconds_until_next(timezone.now()))
+
+
+def build_scheduler():
+    return ExpiryScheduler(
+        horizon=settings.EXPIRY_SCHEDULER_HORIZON,
+        poll_interval=settings.EXPIRY_SCHEDULER_POLL_INTERVAL,
+        batch_size=settings.EXPIRY_SCHEDULER_BATCH_SIZE,
+        gap_timeout=settings.EXPIRY_SCHEDULER_GAP_TIMEOUT,
+    )
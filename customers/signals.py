@@ -0,0 +1,42 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from celery.signals import task_postrun, worker_process_shutdown, worker_shutdown
+from .models import Subscription, SubscriptionChange
+from . import audit
+
+
+@receiver(post_init, sender=Subscription)
+def remember_subscription_end_date(sender, instance, **kwargs):
+    instance._original_end_date = instance.__dict__.get('end_date')
+
+
+@receiver(post_save, sender=Subscription)
+def record_subscription_save(sender, instance, created, **kwargs):
+    if created:
+        change_type = 'CREATED'
+    elif not instance.is_active:
+        change_type = 'EXPIRED'
+    elif instance._original_end_date and instance.end_date > instance._original_end_date:
+        change_type = 'EXTENDED'
+    else:
+        change_type = 'UPDATED'
+    SubscriptionChange.record(instance, change_type)
+    instance._original_end_date = instance.end_date
+
+
+@receiver(post_delete, sender=Subscription)
+def record_subscription_delete(sender, instance, **kwargs):
+    SubscriptionChange.record(instance, 'DELETED')
+
+
+# Buffered audit entries are written at the end of every task and before a
+# worker process exits; requests flush from customers.middleware.
+@task_postrun.connect
+def flush_audit_after_task(**kwargs):
+    audit.flush()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_audit_on_shutdown(**kwargs):
+    audit.flush()
@@ -0,0 +1,221 @@
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from .models import Router, Subscription
+from .reconcile import (
+    build_desired_state, managed_names, read_router_state, plan_changes, apply_changes, summarize,
+    username_of,
+)
+from .routeros import router_api
+from . import audit, health, retry
+
+logger = logging.getLogger(__name__)
+
+
+def router_concurrency(router):
+    """Number of parallel API sessions to use for one router, capped by the pool size."""
+    concurrency = router.sync_concurrency or settings.ROUTER_SYNC_PER_ROUTER_CONCURRENCY
+    return max(1, min(concurrency, settings.ROUTEROS_POOL_MAX_CONNECTIONS))
+
+
+def _connection_types(router_ids, usernames):
+    """{router_id: {username: connection types}} of every subscription, active or not, with those usernames."""
+    types = defaultdict(lambda: defaultdict(set))
+    usernames = list(usernames)
+    for i in range(0, len(usernames), 500):
+        rows = Subscription.objects.filter(
+            router_id__in=router_ids, username__in=usernames[i:i + 500]
+        ).values_list('router_id', 'username', 'connection_type')
+        for router_id, username, connection_type in rows:
+            types[router_id][username].add(connection_type)
+    return types
+
+
+def failed_subscriptions(result, subs):
+    """Return {subscription_id: error} for the subscriptions a router result failed on."""
+    failed = {change.subscription_id: error for change, error in result['failed'] if change.subscription_id}
+    if result['error']:
+        failed.update({sub.id: result['error'] for sub in subs})
+    return failed
+
+
+def _apply_chunk(router, changes):
+    with router_api(router) as api:
+        return apply_changes(api, changes)
+
+
+def chunk_by_user(changes, count):
+    """Split changes into ``count`` chunks, keeping each user's changes together and in order.
+
+    A subscriber's secret or hotspot user and its queue then go through the
+    same session, and the chunks are balanced by number of changes.
+    """
+    by_user = defaultdict(list)
+    for change in changes:
+        by_user[username_of(change.path, change.name)].append(change)
+    chunks = [[] for _ in range(count)]
+    for group in sorted(by_user.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(group)
+    return [chunk for chunk in chunks if chunk]
+
+
+def _reconcile_router(router, subs, retired_usernames, dry_run, types=None):
+    started = time.monotonic()
+    result = {
+        'router': router.name,
+        'subscriptions': len(subs),
+        'planned': {'add': 0, 'set': 0, 'remove': 0},
+        'applied': [],
+        'failed': [],
+        'error': None,
+    }
+    try:
+        desired, owners = build_desired_state(subs)
+        desired_usernames = {sub.username for sub in subs}
+        names = desired_usernames | set(retired_usernames or ())
+        if types is None:
+            types = _connection_types([router.id], names)[router.id]
+        with router_api(router) as api:
+            if retired_usernames is None:
+                current = read_router_state(api)
+                # Any other name on the router that a subscription of this router has used.
+                unknown = {username_of(path, name) for path, rows in current.items() for name in rows} - names
+                if unknown:
+                    types = {**types, **_connection_types([router.id], unknown)[router.id]}
+                managed = managed_names(types)
+            else:
+                managed = managed_names({name: types.get(name) for name in names})
+                current = read_router_state(api, managed)
+            changes = plan_changes(desired, current, owners, managed)
+            result['planned'] = summarize(changes)
+            if dry_run:
+                result['changes'] = [change.as_dict() for change in changes]
+            else:
+                concurrency = min(router_concurrency(router), max(1, len(changes)))
+                result['concurrency'] = concurrency
+                if concurrency == 1:
+                    applied, failed = apply_changes(api, changes)
+                    result['applied'].extend(applied)
+                    result['failed'].extend(failed)
+        if not dry_run and result.get('concurrency', 1) > 1:
+            chunks = chunk_by_user(changes, concurrency)
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"sync-router-{router.id}") as pool:
+                for applied, failed in pool.map(lambda chunk: _apply_chunk(router, chunk), chunks):
+                    result['applied'].extend(applied)
+                    result['failed'].extend(failed)
+    except Exception as e:
+        logger.error(f"Error reconciling router {router.name}: {e}")
+        result['error'] = str(e)
+    finally:
+        connection.close()
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def sync_routers(subscriptions, retired=None, dry_run=False):
+    """Reconcile routers against the given active subscriptions, one worker per router.
+
+    Each router's users, secrets and queues are read once and only the adds,
+    sets and removals needed are sent. ``retired`` maps router_id to usernames
+    that should no longer exist on that router; when it is None (full sync)
+    every billing-created username on the router that is not active is removed.
+    Subscriptions are grouped by ``router_id`` so a slow or unreachable router
+    only delays its own group; RADIUS-only routers and routers whose circuit is
+    open are skipped. Subscriptions that fail are queued in SyncRetry. Returns
+    per-router timing, change and error stats; with ``dry_run`` nothing is
+    written and the planned changes are returned instead.
+    """
+    started = time.monotonic()
+    groups = defaultdict(list)
+    routers = {}
+    for sub in subscriptions:
+        if not sub.router_id:
+            logger.warning(f"No router assigned for subscription {sub.id}")
+            continue
+        if sub.router.connection_type == 'RADIUS':
+            continue
+        routers[sub.router_id] = sub.router
+        groups[sub.router_id].append(sub)
+    if retired:
+        for router in Router.objects.filter(id__in=set(retired) - set(routers)).exclude(connection_type='RADIUS'):
+            routers[router.id] = router
+            groups[router.id] = []
+
+    # Routers with an open circuit are skipped without tying up a worker.
+    down = health.unavailable(routers.values())
+    types = _connection_types(
+        [router_id for router_id in groups if router_id not in down],
+        {sub.username for subs in groups.values() for sub in subs} | {
+            name for names in (retired or {}).values() for name in names
+        },
+    )
+    workers = max(1, min(settings.ROUTER_SYNC_CONCURRENCY, len(groups) - len(down)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync-router') as pool:
+        futures = {
+            router_id: pool.submit(
+                _reconcile_router, routers[router_id], subs,
+                None if retired is None else retired.get(router_id, ()), dry_run, types[router_id]
+            )
+            for router_id, subs in groups.items() if router_id not in down
+        }
+        results = {router_id: future.result() for router_id, future in futures.items()}
+    for router_id in down:
+        logger.warning(f"Skipping router {routers[router_id].name}: circuit open")
+        results[router_id] = {
+            'router': routers[router_id].name,
+            'subscriptions': len(groups[router_id]),
+            'planned': {'add': 0, 'set': 0, 'remove': 0},
+            'applied': [],
+            'failed': [],
+            'error': 'Router unavailable (circuit open)',
+            'seconds': 0,
+        }
+
+    audit_entries = []
+    retries = []
+    stats = {'routers': {}, 'applied': 0, 'failed': 0, 'unavailable': len(down), 'dry_run': dry_run}
+    for router_id, result in results.items():
+        synced_ids = {change.subscription_id for change in result['applied'] if change.subscription_id}
+        failed = failed_subscriptions(result, groups[router_id])
+        failed_ids = set(failed)
+        if not dry_run:
+            usernames = {sub.id: sub.username for sub in groups[router_id]}
+            retries.extend(
+                (sub_id, router_id, usernames[sub_id], error)
+                for sub_id, error in failed.items() if sub_id in usernames
+            )
+            audit_entries.extend(
+                audit.entry('sync_to_router', 'Subscription', sub_id)
+                for sub_id in synced_ids - failed_ids
+            )
+            audit_entries.extend(
+                audit.entry('sync_to_router_failed', 'Subscription', sub_id)
+                for sub_id in failed_ids
+            )
+        stats['applied'] += len(result['applied'])
+        stats['failed'] += len(result['failed'])
+        router_stats = {
+            'router': result['router'],
+            'subscriptions': result['subscriptions'],
+            'planned': result['planned'],
+            'applied': len(result['applied']),
+            'failed': len(result['failed']),
+            'seconds': result['seconds'],
+            'error': result['error'],
+            'errors': sorted({error for _, error in result['failed']})[:5],
+        }
+        if dry_run:
+            router_stats['changes'] = result.get('changes', [])
+        stats['routers'][str(router_id)] = router_stats
+        logger.info(
+            f"{'Planned' if dry_run else 'Applied'} {sum(result['planned'].values())} changes for "
+            f"{result['subscriptions']} subscriptions on router {result['router']} in {result['seconds']}s "
+            f"({len(result['failed'])} failed{', error: ' + result['error'] if result['error'] else ''})"
+        )
+    audit.log_many(audit_entries)
+    stats['retries_queued'] = retry.record_failures('SYNC', retries)
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
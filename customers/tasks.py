@@ -1,9 +1,16 @@
 from celery import shared_task
 from django.utils import timezone
-from .models import Subscription, Package, Router, AuditLog, Voucher
-import MySQLdb
-import routeros_api
+from .models import Subscription, SubscriptionChange, Router, Voucher
+from .sync import sync_routers
+from .expiry import expire_subscriptions
+from . import radius
+from .radius_pool import credentials, radius_db
+from .coalesce import single_flight, trigger
+from . import health, retry, timeseries, datacap, archive, audit
+from .accounting import ingest_accounting
+from .utils import send_sms
 import logging
+import time
 from datetime import timedelta
 from django.conf import settings
 from twilio.rest import Client
@@ -11,176 +18,218 @@ from twilio.rest import Client
 logger = logging.getLogger(__name__)
 
 @shared_task
-def sync_subscriptions_to_routers():
-    for sub in Subscription.objects.filter(is_active=True):
-        if not sub.router:
-            logger.warning(f"No router assigned for subscription {sub.id}")
-            continue
-        try:
-            api = routeros_api.RouterOsApiPool(
-                sub.router.ip_address,
-                username=sub.router.username,
-                password=sub.router.password,
-                port=8728,
-                use_ssl=False,
-                plaintext_login=True
-            ).get_api()
-            
-            if sub.connection_type == 'HOTSPOT':
-                api.get_resource('/ip/hotspot/user').call('remove', {'numbers': sub.username})
-                api.get_resource('/ip/hotspot/user').call('add', {
-                    'name': sub.username,
-                    'password': sub.password,
-                    'profile': sub.package.name.lower(),
-                    'limit-bytes-in': int(sub.package.download_bandwidth * 1024 * 1024 * 1000),
-                    'limit-bytes-out': int(sub.package.upload_bandwidth * 1024 * 1024 * 1000),
-                    'shared-users': str(sub.package.shared_users),
-                    'disabled': 'no'
-                })
-            elif sub.connection_type == 'PPPOE':
-                api.get_resource('/ppp/secret').call('remove', {'numbers': sub.username})
-                api.get_resource('/queue/simple').call('remove', {'name': f"q_{sub.username}"})
-                api.get_resource('/ppp/secret').call('add', {
-                    'name': sub.username,
-                    'password': sub.password,
-                    'service': 'pppoe',
-                    'disabled': 'no'
-                })
-                api.get_resource('/queue/simple').call('add', {
-                    'name': f"q_{sub.username}",
-                    'target': sub.username,
-                    'max-limit': f"{int(sub.package.upload_bandwidth * 1000000)}/{int(sub.package.download_bandwidth * 1000000)}"
-                })
-            elif sub.connection_type.startswith('VPN'):
-                api.get_resource('/ppp/secret').call('remove', {'numbers': sub.username})
-                api.get_resource('/ppp/secret').call('add', {
-                    'name': sub.username,
-                    'password': sub.password,
-                    'service': sub.connection_type.lower().replace('vpn_', ''),
-                    'remote-address': sub.static_ip or '',
-                    'disabled': 'no'
-                })
-                if sub.package.upload_bandwidth and sub.package.download_bandwidth:
-                    api.get_resource('/queue/simple').call('add', {
-                        'name': f"q_{sub.username}",
-                        'target': sub.username,
-                        'max-limit': f"{int(sub.package.upload_bandwidth * 1000000)}/{int(sub.package.download_bandwidth * 1000000)}"
-                    })
-            
-            AuditLog.objects.create(
-                action='sync_to_router',
-                model='Subscription',
-                object_id=str(sub.id),
-                user=None
-            )
-            logger.info(f"Synced subscription {sub.id} to router {sub.router.name}")
-        except Exception as e:
-            logger.error(f"Error syncing subscription {sub.id} to router {sub.router.name}: {e}")
-            AuditLog.objects.create(
-                action='sync_to_router_failed',
-                model='Subscription',
-                object_id=str(sub.id),
-                user=None
-            )
+@single_flight(bypass=lambda dry_run=False: dry_run)
+def sync_subscriptions_to_routers(dry_run=False):
+    """Reconcile every router against the active subscriptions, routers processed in parallel.
+
+    With ``dry_run`` the planned adds, sets and removals are returned without
+    touching the routers.
+    """
+    subscriptions = Subscription.objects.filter(is_active=True).select_related('router', 'package')
+    stats = sync_routers(subscriptions, dry_run=dry_run)
+    logger.info(f"Router sync finished in {stats['seconds']}s: {stats['applied']} changes applied, {stats['failed']} failed")
+    return stats
 
 @shared_task
-def sync_subscriptions_to_radius():
+@single_flight()
+def sync_subscriptions_to_radius(mode=None):
+    """Sync every active subscription to FreeRADIUS.
+
+    ``mode`` is 'incremental' (default, applies only the differences),
+    'swap' (rebuild into shadow tables and rename them in atomically) or
+    'truncate' (legacy empty-and-reload).
+    """
+    mode = mode or settings.RADIUS_SYNC_MODE
     try:
-        db = MySQLdb.connect(
-            host="localhost",
-            user="radius_user",
-            passwd="radius_pass",
-            db="radius"
-        )
-        cursor = db.cursor()
-        cursor.execute("TRUNCATE TABLE radcheck")
-        cursor.execute("TRUNCATE TABLE radgroupcheck")
-        cursor.execute("TRUNCATE TABLE radusergroup")
-        
-        for sub in Subscription.objects.filter(is_active=True):
-            cursor.execute(
-                "INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                (sub.username, 'Cleartext-Password', ':=', sub.password)
-            )
-            groupname = f"{sub.package.name}_{sub.connection_type}"
-            cursor.execute(
-                "INSERT INTO radgroupcheck (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                (groupname, 'Auth-Type', ':=', 'Accept')
-            )
-            if sub.connection_type == 'HOTSPOT':
-                cursor.execute(
-                    "INSERT INTO radgroupcheck (groupname, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                    (groupname, 'Simultaneous-Use', ':=', str(sub.package.shared_users))
-                )
-            cursor.execute(
-                "INSERT INTO radusergroup (username, groupname, priority) VALUES (%s, %s, %s)",
-                (sub.username, groupname, 1)
-            )
-        
-        db.commit()
-        db.close()
-        AuditLog.objects.create(
-            action='sync_to_radius',
-            model='Subscription',
-            object_id='all',
-            user=None
-        )
-        logger.info("Synced subscriptions to FreeRADIUS")
+        started = time.monotonic()
+        snapshot_at = timezone.now()
+        subscriptions = Subscription.objects.filter(is_active=True).select_related('package')
+        with radius_db() as db:
+            if mode == 'incremental':
+                stats = radius.incremental_sync(db, subscriptions, batch_size=settings.RADIUS_SYNC_BATCH_SIZE)
+            elif mode == 'swap':
+                stats = radius.swap_sync(db, subscriptions, batch_size=settings.RADIUS_SYNC_BATCH_SIZE)
+                # Rows written to the live tables during the rebuild were lost by
+                # the swap; rewrite every subscription that changed since the snapshot.
+                changed = SubscriptionChange.objects.filter(created_at__gte=snapshot_at)
+                changed_subs = Subscription.objects.filter(
+                    id__in=changed.values('subscription_id')
+                ).select_related('package')
+                active = [sub for sub in changed_subs if sub.is_active]
+                removed = set(changed.values_list('username', flat=True)) - {sub.username for sub in active}
+                removed -= set(Subscription.objects.filter(
+                    is_active=True, username__in=removed
+                ).values_list('username', flat=True))
+                radius.sync_users(db.cursor(), active, removed)
+                db.commit()
+                stats['replayed'] = len(active) + len(removed)
+            elif mode == 'truncate':
+                stats = radius.truncate_sync(db, subscriptions, batch_size=settings.RADIUS_SYNC_BATCH_SIZE)
+            else:
+                raise ValueError(f"Unsupported RADIUS sync mode: {mode}")
+        audit.log('sync_to_radius', 'Subscription', 'all')
+        logger.info(f"Synced subscriptions to FreeRADIUS ({mode}) in {time.monotonic() - started:.2f}s: {stats}")
+        return stats
     except Exception as e:
         logger.error(f"Error syncing subscriptions to FreeRADIUS: {e}")
-        AuditLog.objects.create(
-            action='sync_to_radius_failed',
-            model='Subscription',
-            object_id='all',
-            user=None
-        )
+        audit.log('sync_to_radius_failed', 'Subscription', 'all')
+
+def _sync_changes_to_radius(active, retired, owners):
+    """Write changed subscriptions to the FreeRADIUS database serving each one's router.
+
+    ``retired`` is {router_id: usernames}; ``owners`` maps (router_id, username)
+    to the subscription id a retry is recorded under. Servers that fail get a
+    RADIUS retry per subscription instead of waiting for the nightly repair.
+    """
+    routers = Router.objects.in_bulk({sub.router_id for sub in active} | set(retired))
+    groups = {}
+
+    def group(router_id):
+        router = routers.get(router_id)
+        key = tuple(sorted(credentials(router).items()))
+        return groups.setdefault(key, {'router': router, 'active': [], 'retired': {}})
+
+    for sub in active:
+        group(sub.router_id)['active'].append(sub)
+    for router_id, usernames in retired.items():
+        group(router_id)['retired'].update((username, router_id) for username in usernames)
+    stats = {'servers': len(groups), 'failed': 0, 'retries_queued': 0}
+    for members in groups.values():
+        try:
+            with radius_db(members['router']) as db:
+                radius.sync_users(db.cursor(), members['active'], set(members['retired']))
+                db.commit()
+        except Exception as e:
+            logger.error(f"Error syncing changed subscriptions to FreeRADIUS at {members['router'] or 'default'}: {e}")
+            stats['failed'] += 1
+            stats['retries_queued'] += retry.record_failures('RADIUS', [
+                (sub.id, sub.router_id, sub.username, e) for sub in members['active']
+            ] + [
+                (owners[(router_id, username)], router_id, username, e)
+                for username, router_id in members['retired'].items() if (router_id, username) in owners
+            ])
+            audit.log('sync_to_radius_failed', 'Subscription', 'changes')
+    return stats
+
+@shared_task
+@single_flight()
+def sync_subscription_changes(batch_size=1000):
+    """Push only the subscriptions recorded in the SubscriptionChange outbox.
+
+    Active subscriptions are reconciled on their router and rewritten in
+    their router's RADIUS database; expired and deleted ones are removed from
+    both. Failures are queued as retries, so the rows are marked processed
+    either way. The full syncs above remain as periodic repair jobs.
+    """
+    changes = list(SubscriptionChange.objects.filter(processed_at__isnull=True).order_by('id')[:batch_size])
+    if not changes:
+        return {'changes': 0}
+    subscriptions = Subscription.objects.filter(
+        id__in={change.subscription_id for change in changes}
+    ).select_related('router', 'package')
+    active = [sub for sub in subscriptions if sub.is_active]
+    active_usernames = {sub.username for sub in active}
+    retired = {}
+    for change in changes:
+        if change.username not in active_usernames and change.router_id:
+            retired.setdefault(change.router_id, set()).add(change.username)
+    for sub in subscriptions:
+        if not sub.is_active:
+            retired.setdefault(sub.router_id, set()).add(sub.username)
+    # A username can outlive one subscription (e.g. a renewal reusing it).
+    still_active = Subscription.objects.filter(
+        is_active=True, username__in={name for names in retired.values() for name in names}
+    ).exclude(username__in=active_usernames).values_list('router_id', 'username')
+    for router_id, username in still_active:
+        retired.get(router_id, set()).discard(username)
+
+    stats = {'changes': len(changes), 'routers': sync_routers(active, retired=retired)}
+    owners = {(change.router_id, change.username): change.subscription_id for change in changes}
+    owners.update({(sub.router_id, sub.username): sub.id for sub in subscriptions if not sub.is_active})
+    stats['radius'] = _sync_changes_to_radius(active, retired, owners)
+    SubscriptionChange.objects.filter(id__in=[change.id for change in changes]).update(processed_at=timezone.now())
+    logger.info(f"Processed {len(changes)} subscription changes ({len(active)} active, {sum(len(names) for names in retired.values())} retired)")
+    if len(changes) == batch_size:
+        # A full batch means there is probably a backlog; keep draining it.
+        trigger(sync_subscription_changes)
+    return stats
 
 @shared_task
 def disable_expired_subscriptions():
+    """Deactivate every expired subscription in bulk and disable it on its router."""
     try:
-        expired = Subscription.objects.filter(end_date__lt=timezone.now(), is_active=True)
-        for sub in expired:
-            sub.is_active = False
-            sub.save()
-            if sub.router:
-                try:
-                    api = routeros_api.RouterOsApiPool(
-                        sub.router.ip_address,
-                        username=sub.router.username,
-                        password=sub.router.password,
-                        port=8728,
-                        use_ssl=False,
-                        plaintext_login=True
-                    ).get_api()
-                    if sub.connection_type == 'HOTSPOT':
-                        api.get_resource('/ip/hotspot/user').call('set', {
-                            'numbers': sub.username,
-                            'disabled': 'yes'
-                        })
-                    elif sub.connection_type in ['PPPOE'] or sub.connection_type.startswith('VPN'):
-                        api.get_resource('/ppp/secret').call('set', {
-                            'numbers': sub.username,
-                            'disabled': 'yes'
-                        })
-                        api.get_resource('/queue/simple').call('remove', {'name': f"q_{sub.username}"})
-                    AuditLog.objects.create(
-                        action='disable_subscription',
-                        model='Subscription',
-                        object_id=str(sub.id),
-                        user=None
-                    )
-                    logger.info(f"Disabled subscription {sub.id}")
-                except Exception as e:
-                    logger.error(f"Error disabling subscription {sub.id} on router: {e}")
-        sync_subscriptions_to_radius.delay()
+        stats = expire_subscriptions()
+        if stats['expired']:
+            trigger(sync_subscription_changes)
+        return stats
     except Exception as e:
         logger.error(f"Error disabling subscriptions: {e}")
-        AuditLog.objects.create(
-            action='disable_subscriptions_failed',
-            model='Subscription',
-            object_id='all',
-            user=None
-        )
+        audit.log('disable_subscriptions_failed', 'Subscription', 'all')
+
+@shared_task
+@single_flight()
+def prune_subscription_changes():
+    """Delete outbox rows processed more than SUBSCRIPTION_CHANGE_RETENTION_DAYS ago."""
+    cutoff = timezone.now() - timedelta(days=settings.SUBSCRIPTION_CHANGE_RETENTION_DAYS)
+    deleted, _ = SubscriptionChange.objects.filter(processed_at__lt=cutoff).delete()
+    if deleted:
+        logger.info(f"Pruned {deleted} processed subscription changes")
+    return {'deleted': deleted}
+
+@shared_task
+@single_flight()
+def probe_router_health():
+    """Probe routers whose circuit is open and close the circuit on the ones that answer."""
+    routers = health.due_for_probe(Router.objects.exclude(connection_type='RADIUS'))
+    recovered = [router.name for router in routers if health.probe(router)]
+    if routers:
+        logger.info(f"Probed {len(routers)} unavailable routers, {len(recovered)} recovered")
+    return {'probed': len(routers), 'recovered': recovered}
+
+@shared_task
+@single_flight()
+def process_sync_retries():
+    """Retry failed per-subscription router/RADIUS operations that are due."""
+    return retry.process_retries()
+
+@shared_task
+@single_flight()
+def ingest_radius_accounting():
+    """Copy new and updated FreeRADIUS radacct rows into SessionLog."""
+    return ingest_accounting()
+
+@shared_task
+@single_flight()
+def prune_usage_series():
+    """Delete usage time-series blocks older than their resolution's retention."""
+    return timeseries.prune()
+
+@shared_task
+@single_flight()
+def archive_session_logs():
+    """Move sessions older than SESSION_ARCHIVE_AFTER_DAYS into the compressed archive."""
+    return archive.archive_sessions()
+
+@shared_task
+@single_flight()
+def enforce_data_caps():
+    """Warn subscribers nearing their package's data limit and suspend the ones past it."""
+    stats = datacap.enforce()
+    if stats['suspended']:
+        trigger(sync_subscription_changes)
+    return stats
+
+@shared_task
+def send_data_cap_notices(subscription_ids, level):
+    """SMS one batch of subscribers that reached ``level`` percent of their data limit."""
+    sent = 0
+    for subscription in Subscription.objects.filter(id__in=subscription_ids).select_related('customer__company', 'package'):
+        if not subscription.customer.phone:
+            continue
+        result = send_sms(subscription.customer.phone, datacap.notice(subscription, level))
+        if result.get('status') != 'error':
+            sent += 1
+    return {'level': level, 'sent': sent, 'total': len(subscription_ids)}
 
 @shared_task
 def update_subscription_from_compensation(compensation_id):
@@ -188,26 +237,31 @@ def update_subscription_from_compensation(compensation_id):
     try:
         comp = Compensation.objects.get(id=compensation_id)
         if comp.subscription and comp.subscription.is_active:
-            duration = timedelta(hours=comp.extra_hours or 0) + timedelta(days=comp.extra_days or 0)
+            duration = timedelta(minutes=comp.duration_minutes or 0) + timedelta(hours=comp.duration_hours or 0)
             comp.subscription.end_date += duration
             comp.subscription.save()
-            AuditLog.objects.create(
-                action='apply_compensation',
-                model='Subscription',
-                object_id=str(comp.subscription.id),
-                user=None
-            )
+            audit.log('apply_compensation', 'Subscription', str(comp.subscription.id))
             logger.info(f"Applied compensation {comp.id} to subscription {comp.subscription.id}")
-            sync_subscriptions_to_routers.delay()
-            sync_subscriptions_to_radius.delay()
+            trigger(sync_subscription_changes)
     except Exception as e:
         logger.error(f"Error applying compensation {compensation_id}: {e}")
-        AuditLog.objects.create(
-            action='apply_compensation_failed',
-            model='Compensation',
-            object_id=str(compensation_id),
-            user=None
-        )
+        audit.log('apply_compensation_failed', 'Compensation', str(compensation_id))
+
+@shared_task
+def run_provisioning_job(job_id):
+    """Push a new subscription to its router/RADIUS server and notify the customer."""
+    from .models import ProvisioningJob
+    from .provisioning import run_job
+    try:
+        job = ProvisioningJob.objects.select_related(
+            'subscription__customer', 'subscription__package__company', 'subscription__router'
+        ).get(id=job_id)
+    except ProvisioningJob.DoesNotExist:
+        logger.error(f"Provisioning job {job_id} not found")
+        return
+    job = run_job(job)
+    logger.info(f"Provisioning job {job.id} for {job.subscription.username} finished: {job.status}")
+    return job.status
 
 @shared_task
 def send_voucher_sms(voucher_id):
@@ -220,17 +274,7 @@ def send_voucher_sms(voucher_id):
             to=voucher.package.location.company.phone or '+254123456789'
         )
         logger.info(f"Sent SMS for voucher {voucher.code}: {message.sid}")
-        AuditLog.objects.create(
-            action='send_voucher_sms',
-            model='Voucher',
-            object_id=str(voucher.id),
-            user=None
-        )
+        audit.log('send_voucher_sms', 'Voucher', str(voucher.id))
     except Exception as e:
         logger.error(f"Error sending SMS for voucher {voucher_id}: {e}")
-        AuditLog.objects.create(
-            action='send_voucher_sms_failed',
-            model='Voucher',
-            object_id=str(voucher_id),
-            user=None
-        )
\ No newline at end of file
+        audit.log('send_voucher_sms_failed', 'Voucher', str(voucher_id))
\ No newline at end of file
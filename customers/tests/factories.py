@@ -0,0 +1,60 @@
+import uuid
+from datetime import timedelta
+from django.utils import timezone
+from companies.models import Company
+from customers.models import Customer, Location, Package, Router, Subscription
+from customers.routeros import get_router_pool
+from customers.routeros_sim import RouterSimulator
+
+
+def create_company():
+    marker = uuid.uuid4().hex[:8]
+    company = Company.objects.create(name=f"Test ISP {marker}", email=f"isp-{marker}@test.invalid")
+    location = Location.objects.create(company=company, name='Test site')
+    customer = Customer.objects.create(
+        company=company, name='Test customer', email=f"customer-{marker}@test.invalid", raw_phone='0700000000',
+        password='secret'
+    )
+    return company, location, customer
+
+
+def create_router(company, location, name='router', **kwargs):
+    kwargs.setdefault('connection_type', 'API')
+    kwargs.setdefault('ip_address', '127.0.0.1')
+    return Router.objects.create(company=company, location=location, name=name, **kwargs)
+
+
+def create_package(router, connection_type='HOTSPOT', name=None, **kwargs):
+    kwargs.setdefault('download_bandwidth', 10)
+    kwargs.setdefault('upload_bandwidth', 5)
+    kwargs.setdefault('price', 1)
+    kwargs.setdefault('duration_days', 1)
+    return Package.objects.create(
+        company=router.company, location=router.location, router=router, name=name or f"Test {connection_type}",
+        connection_type=connection_type, **kwargs
+    )
+
+
+def create_subscription(customer, package, username, days=1, **kwargs):
+    now = timezone.now()
+    kwargs.setdefault('start_date', now)
+    kwargs.setdefault('end_date', now + timedelta(days=days))
+    return Subscription.objects.create(
+        customer=customer, package=package, router=package.router, connection_type=package.connection_type,
+        username=username, password=kwargs.pop('password', f"pw-{username}"), **kwargs
+    )
+
+
+def start_simulator(test, company, location, count=1, **options):
+    """Serve ``count`` simulated routers for the duration of ``test``; returns (simulator, routers)."""
+    simulator = RouterSimulator(count=count, **options)
+    test.enterContext(simulator.running())
+    routers = []
+    for sim_router, host, port in simulator.endpoints:
+        router = create_router(
+            company, location, name=sim_router.name, ip_address=host, api_port=port,
+            username=sim_router.username, password=sim_router.password
+        )
+        test.addCleanup(get_router_pool().close_router, router.id)
+        routers.append(router)
+    return simulator, routers
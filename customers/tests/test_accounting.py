@@ -0,0 +1,56 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from customers.accounting import SubscriptionIndex, ingest
+from customers.models import AccountingCursor, SessionLog
+from .factories import create_company, create_package, create_router, create_subscription
+from .test_radius import SqliteRadius
+
+
+@override_settings(RADIUS_DB_TIMEZONE='UTC', RADIUS_ACCT_UNMATCHED_GRACE=600)
+class IngestTests(TestCase):
+    def setUp(self):
+        company, location, self.customer = create_company()
+        self.package = create_package(create_router(company, location, connection_type='RADIUS'))
+        self.started = timezone.now() - timedelta(hours=2)
+        for username in ('alice', 'bob'):
+            create_subscription(self.customer, self.package, username, start_date=self.started)
+        self.db = SqliteRadius()
+
+    def radacct(self, username, start, octets=100):
+        start = start.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        self.db.db.execute(
+            "INSERT INTO radacct (acctuniqueid, acctsessionid, username, acctstarttime, acctinputoctets, acctoutputoctets) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (f"{username}-{start:%H%M%S}", f"s-{username}", username, start, octets, octets),
+        )
+        self.db.commit()
+
+    def ingest(self):
+        return ingest(self.db, 'test', SubscriptionIndex(), batch_size=100, max_batches=10)
+
+    def test_cursor_waits_for_a_recent_unknown_username(self):
+        now = timezone.now()
+        self.radacct('alice', now - timedelta(minutes=5))
+        self.radacct('carol', now - timedelta(minutes=1))
+        self.radacct('bob', now)
+        stats = self.ingest()
+        self.assertEqual((stats['sessions'], stats['held'], stats['unmatched']), (1, 1, 0))
+        self.assertEqual(AccountingCursor.objects.get(name='test').last_id, 1)
+
+        # Carol's subscription shows up; her session and everything after it is picked up.
+        create_subscription(self.customer, self.package, 'carol', start_date=self.started)
+        stats = self.ingest()
+        self.assertEqual((stats['sessions'], stats['held']), (2, 0))
+        self.assertEqual(AccountingCursor.objects.get(name='test').last_id, 3)
+        self.assertEqual(
+            sorted(SessionLog.objects.values_list('username', flat=True)), ['alice', 'bob', 'carol']
+        )
+
+    def test_unknown_username_is_skipped_after_the_grace_window(self):
+        now = timezone.now()
+        self.radacct('dave', now - timedelta(hours=1))
+        self.radacct('alice', now)
+        stats = self.ingest()
+        self.assertEqual((stats['sessions'], stats['held'], stats['unmatched']), (1, 0, 1))
+        self.assertEqual(AccountingCursor.objects.get(name='test').last_id, 2)
@@ -0,0 +1,85 @@
+import asyncio
+from django.test import TestCase
+from customers.aio_routeros import AsyncRouterOsError, AsyncRouterOsConnectionError, client_for, run_on_routers
+from .factories import create_company, start_simulator
+
+USERS = '/ip/hotspot/user'
+
+
+class AsyncClientTests(TestCase):
+    def setUp(self):
+        company, location, _ = create_company()
+        self.simulator, self.routers = start_simulator(self, company, location, count=2)
+        self.router = self.routers[0]
+        self.sim_router = self.simulator.routers[0]
+
+    def run_client(self, operation, router=None, timeout=5):
+        async def main():
+            async with client_for(router or self.router, timeout=timeout) as client:
+                return await operation(client)
+        return asyncio.run(main())
+
+    def test_login(self):
+        async def identity(client):
+            rows, _ = await client.talk('/system/identity/print')
+            return rows
+        self.assertEqual(self.run_client(identity), [{'name': 'sim-0'}])
+
+    def test_bad_login_is_rejected(self):
+        self.router.password = 'wrong'
+        with self.assertRaisesRegex(AsyncRouterOsError, 'invalid user name or password'):
+            self.run_client(lambda client: client.print(USERS))
+        self.assertEqual(sum(self.sim_router.commands.values()), 0)
+
+    def test_print_with_filters_and_proplist(self):
+        self.sim_router.seed(USERS, [
+            {'name': 'alice', 'password': 'a', 'profile': 'daily'},
+            {'name': 'bob', 'password': 'b', 'profile': 'weekly'},
+            {'name': 'carol', 'password': 'c', 'profile': 'daily'},
+        ])
+        rows = self.run_client(lambda client: client.print(USERS, proplist=['.id', 'name'], profile='daily'))
+        self.assertEqual([row['name'] for row in rows], ['alice', 'carol'])
+        self.assertEqual({key for row in rows for key in row}, {'id', 'name'})
+        self.assertEqual(len(self.run_client(lambda client: client.print(USERS))), 3)
+
+    def test_add_set_remove(self):
+        async def operations(client):
+            alice = await client.add(USERS, {'name': 'alice', 'password': 'a'})
+            bob = await client.add(USERS, {'name': 'bob', 'password': 'b'})
+            await client.set(USERS, alice, {'password': 'changed', 'disabled': True})
+            [row] = await client.print(USERS, name='alice')
+            await client.remove(USERS, bob)
+            return alice, row
+        alice, row = self.run_client(operations)
+        self.assertEqual(row, dict(row, id=alice, password='changed', disabled='true'))
+        self.assertEqual([row['name'] for row in self.sim_router.tables[USERS].values()], ['alice'])
+
+    def test_duplicate_add_traps_and_keeps_the_connection(self):
+        async def operations(client):
+            await client.add(USERS, {'name': 'alice', 'password': 'a'})
+            with self.assertRaisesRegex(AsyncRouterOsError, 'already have entry') as trap:
+                await client.add(USERS, {'name': 'alice', 'password': 'b'})
+            self.assertNotIsInstance(trap.exception, AsyncRouterOsConnectionError)
+            return await client.print(USERS)
+        self.assertEqual(len(self.run_client(operations)), 1)
+
+    def test_per_call_timeout(self):
+        async def operations(client):
+            self.sim_router.latency = 0.5
+            with self.assertRaisesRegex(AsyncRouterOsConnectionError, 'timed out'):
+                await client.talk(f"{USERS}/print", timeout=0.1)
+            return await client.print(USERS)
+        self.assertEqual(self.run_client(operations), [])
+
+    def test_run_on_routers_isolates_failures(self):
+        self.simulator.routers[1].down = True
+        self.sim_router.seed(USERS, [{'name': 'alice', 'password': 'a'}])
+
+        async def count(router, client):
+            return len(await client.print(USERS))
+        results = asyncio.run(run_on_routers(self.routers, count, timeout=2))
+        self.assertEqual(results[self.router.id]['result'], 1)
+        self.assertIsNone(results[self.router.id]['error'])
+        self.assertIsNone(results[self.routers[1].id]['result'])
+        self.assertTrue(results[self.routers[1].id]['error'])
+        self.assertEqual([results[router.id]['unreachable'] for router in self.routers], [False, True])
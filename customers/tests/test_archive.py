@@ -0,0 +1,59 @@
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from customers import archive
+from customers.accounting import upsert_session_logs
+from customers.models import SessionLog
+from .factories import create_company, create_package, create_router, create_subscription
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        company, location, customer = create_company()
+        package = create_package(create_router(company, location, connection_type='RADIUS'))
+        self.subscription = create_subscription(customer, package, 'alice')
+        self.archive_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(SESSION_ARCHIVE_DIR=self.archive_dir, SESSION_ARCHIVE_AFTER_DAYS=90))
+        self.started = timezone.now() - timedelta(days=100)
+
+    def session(self, unique_id, data_used=100):
+        return SessionLog(
+            subscription=self.subscription, username='alice', acct_unique_id=unique_id,
+            start_time=self.started, data_used=data_used,
+        )
+
+    def create_stale(self, unique_id, data_used=100):
+        log = self.session(unique_id, data_used)
+        log.save()
+        SessionLog.objects.filter(id=log.id).update(updated_at=self.started)
+        return log
+
+    def test_row_updated_after_it_was_read_is_kept(self):
+        self.create_stale('a')
+        self.create_stale('b')
+        save_manifest = archive._save_manifest
+
+        def late_stop(*args):
+            save_manifest(*args)
+            upsert_session_logs([self.session('b', data_used=500)], 10, archived_before=timezone.now())
+        with mock.patch.object(archive, '_save_manifest', late_stop):
+            stats = archive.archive_sessions()
+        self.assertEqual((stats['archived'], stats['kept']), (2, 1))
+        self.assertEqual(list(SessionLog.objects.values_list('acct_unique_id', 'data_used')), [('b', 500)])
+
+        # Once idle again it is archived a second time, and the newer copy wins.
+        SessionLog.objects.update(updated_at=self.started)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=1)):
+            self.assertEqual(archive.archive_sessions()['kept'], 0)
+        self.assertEqual(
+            sorted((record['acct_unique_id'], record['data_used']) for record in archive.read_sessions()),
+            [('a', 100), ('b', 500)],
+        )
+
+    def test_late_stop_does_not_recreate_an_archived_row(self):
+        self.create_stale('a')
+        self.assertEqual(archive.archive_sessions()['archived'], 1)
+        upsert_session_logs([self.session('a', data_used=500)], 10, archived_before=timezone.now() - timedelta(days=90))
+        self.assertFalse(SessionLog.objects.exists())
@@ -0,0 +1,51 @@
+from celery import shared_task
+from django.http import HttpResponse
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import path
+from customers import audit
+from customers.models import AuditLog
+
+
+def logging_view(request):
+    audit.log('viewed', 'Subscription', 1)
+    return HttpResponse('ok')
+
+
+urlpatterns = [path('audit/', logging_view)]
+
+
+@shared_task
+def logging_task():
+    audit.log('ran', 'Subscription', 2)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AuditFlushTests(TestCase):
+    def setUp(self):
+        # Only the end-of-request/task hooks may write, not the size or age triggers.
+        max_size, max_age = audit._buffer.max_size, audit._buffer.max_age
+        audit._buffer.max_size, audit._buffer.max_age = 10 ** 6, 10 ** 6
+        self.addCleanup(setattr, audit._buffer, 'max_size', max_size)
+        self.addCleanup(setattr, audit._buffer, 'max_age', max_age)
+        self.addCleanup(audit._buffer.entries.clear)
+
+    def test_request_flushes_the_buffer(self):
+        self.assertEqual(self.client.get('/audit/').status_code, 200)
+        self.assertEqual(audit._buffer.entries, [])
+        self.assertEqual(list(AuditLog.objects.values_list('action', 'object_id')), [('viewed', '1')])
+
+    def test_task_flushes_the_buffer(self):
+        logging_task.apply()
+        self.assertEqual(audit._buffer.entries, [])
+        self.assertEqual(list(AuditLog.objects.values_list('action', 'object_id')), [('ran', '2')])
+
+    def test_size_flush_waits_for_the_transaction(self):
+        audit._buffer.max_size = 1
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            audit.log('failed', 'Subscription', 3)
+            raise RuntimeError
+        # Nothing was written inside the rolled-back block; the entry is still buffered.
+        self.assertEqual(len(audit._buffer.entries), 1)
+        audit.flush()
+        self.assertEqual(list(AuditLog.objects.values_list('action', flat=True)), ['failed'])
@@ -0,0 +1,35 @@
+from io import StringIO
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from customers.management.commands.benchmark_router_sync import Command
+from customers.models import Router, Subscription, SyncRetry
+from customers.routeros import get_router_pool
+from customers.routeros_sim import RouterSimulator
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BenchmarkPhasesTests(TransactionTestCase):
+    """The benchmark's phases as a regression check: correct change counts and no failures."""
+
+    def setUp(self):
+        cache.clear()
+        self.simulator = RouterSimulator(count=2, seed=1)
+        self.enterContext(self.simulator.running())
+        self.command = Command(stdout=StringIO())
+        self.company = self.command.create_fixtures(self.simulator, 20)
+        for router in Router.objects.filter(company=self.company):
+            self.addCleanup(get_router_pool().close_router, router.id)
+
+    def test_phases(self):
+        phases = self.command.run_phases(self.company)
+        self.assertEqual({phase: failed for phase, (_, _, failed) in phases.items()}, dict.fromkeys(phases, 0))
+        # Every fifth subscription is PPPoE: a secret plus a queue.
+        self.assertEqual(phases['full sync (cold)'][1], 2 * (16 + 4 * 2))
+        self.assertEqual(phases['full sync (no-op)'][1], 0)
+        self.assertEqual(phases['targeted sync (10%)'][1], 4)
+        self.assertEqual(phases['bulk expiry'][1], 40)
+        self.assertFalse(Subscription.objects.filter(router__company=self.company, is_active=True).exists())
+        self.assertFalse(SyncRetry.objects.exists())
+        for sim_router in self.simulator.routers:
+            self.assertEqual(len(sim_router.tables['/ip/hotspot/user']), 16)
+            self.assertTrue(all(row['disabled'] == 'true' for row in sim_router.tables['/ip/hotspot/user'].values()))
@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from customers.bulk_state import resolve_ids, set_users_disabled
+from customers.reconcile import HOTSPOT_USERS, PPP_SECRETS, QUEUES, bulk_call
+from customers.routeros import router_api
+from .factories import create_company, start_simulator
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BulkStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, _ = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.sim_router = self.simulator.routers[0]
+        self.sim_router.seed(HOTSPOT_USERS, [{'name': f"h{i}", 'password': 'x'} for i in range(5)])
+        self.sim_router.seed(PPP_SECRETS, [{'name': 'p0', 'password': 'x'}, {'name': 'p1', 'password': 'x'}])
+        self.sim_router.seed(QUEUES, [{'name': 'q_p0', 'target': 'p0'}, {'name': 'q_p1', 'target': 'p1'}])
+
+    def disabled(self, path):
+        return sorted(row['name'] for row in self.sim_router.tables[path].values() if row['disabled'] == 'true')
+
+    def test_disable_uses_one_print_and_one_command_per_table(self):
+        rows = [(i, self.router.id, f"h{i}", 'HOTSPOT') for i in range(5)]
+        rows += [(10, self.router.id, 'p0', 'PPPOE'), (11, self.router.id, 'p1', 'VPN'), (12, self.router.id, 'gone', 'HOTSPOT')]
+        with router_api(self.router) as api:
+            done, failed = set_users_disabled(api, rows)
+        self.assertEqual((sorted(done), failed), ([0, 1, 2, 3, 4, 10, 11, 12], []))
+        self.assertEqual(self.disabled(HOTSPOT_USERS), [f"h{i}" for i in range(5)])
+        self.assertEqual(self.disabled(PPP_SECRETS), ['p0', 'p1'])
+        self.assertEqual(self.sim_router.tables[QUEUES], {})
+        for path, command in ((HOTSPOT_USERS, 'disable'), (PPP_SECRETS, 'disable'), (QUEUES, 'remove')):
+            self.assertEqual(self.sim_router.commands[f"{path}/print"], 1)
+            self.assertEqual(self.sim_router.commands[f"{path}/{command}"], 1)
+
+    def test_enable_keeps_queues(self):
+        self.sim_router.commands.clear()
+        with router_api(self.router) as api:
+            set_users_disabled(api, [(1, self.router.id, 'p0', 'PPPOE')], disabled=True)
+            done, failed = set_users_disabled(api, [(1, self.router.id, 'p0', 'PPPOE')], disabled=False)
+        self.assertEqual((done, failed), ([1], []))
+        self.assertEqual(self.disabled(PPP_SECRETS), [])
+        self.assertEqual(sorted(row['name'] for row in self.sim_router.tables[QUEUES].values()), ['q_p1'])
+
+    def test_bulk_call_isolates_rejected_entries(self):
+        with router_api(self.router) as api:
+            resource = api.get_resource(HOTSPOT_USERS)
+            ids = list(resolve_ids(resource, {f"h{i}" for i in range(5)}).values())
+            failed = bulk_call(resource, 'disable', ids[:2] + ['*FFFF'] + ids[2:], chunk_size=10)
+        self.assertEqual(list(failed), ['*FFFF'])
+        self.assertEqual(self.disabled(HOTSPOT_USERS), [f"h{i}" for i in range(5)])
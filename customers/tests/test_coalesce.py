@@ -0,0 +1,80 @@
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from customers.coalesce import metrics, single_flight, trigger
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SYNC_COALESCE_WINDOW=5, SYNC_COALESCE_PENDING_GRACE=5, SYNC_LOCK_TIMEOUT=60,
+)
+class CoalesceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def test_triggers_merge_into_one_pending_run(self):
+        task = mock.Mock()
+        task.name = 'job'
+        trigger(task)
+        trigger(task)
+        task.apply_async.assert_called_once_with(countdown=5)
+        counts = metrics(['job'])['job']
+        self.assertEqual((counts['triggered'], counts['scheduled'], counts['merged']), (2, 1, 1))
+        self.assertTrue(counts['pending'])
+
+    def test_run_clears_the_pending_marker(self):
+        task = mock.Mock()
+        task.name = 'job'
+
+        @single_flight('job')
+        def job():
+            trigger(task)
+        trigger(task)
+        job()
+        # The trigger made during the run scheduled a fresh one.
+        self.assertEqual(task.apply_async.call_count, 2)
+
+    def test_skipped_call_is_rerun_by_the_lock_holder(self):
+        @single_flight('job')
+        def job(size=10):
+            self.calls.append(size)
+            if len(self.calls) == 1:
+                # Another worker asks for a run while this one holds the lock.
+                self.assertEqual(job(), {'skipped': True})
+            return len(self.calls)
+        self.assertEqual(job(), 2)
+        self.assertEqual(self.calls, [10, 10])
+        counts = metrics(['job'])['job']
+        self.assertEqual((counts['ran'], counts['skipped'], counts['running']), (2, 1, False))
+
+    def test_calls_with_different_arguments_do_not_coalesce(self):
+        @single_flight('job')
+        def job(mode=None):
+            self.calls.append(mode)
+            if len(self.calls) == 1:
+                self.assertEqual(job(mode='swap'), 'swap')
+            return mode
+        self.assertIsNone(job())
+        # The swap ran with its own arguments and did not trigger a rerun of the default call.
+        self.assertEqual(self.calls, [None, 'swap'])
+
+    def test_default_arguments_passed_explicitly_coalesce(self):
+        @single_flight('job')
+        def job(mode=None):
+            self.calls.append(mode)
+            if len(self.calls) == 1:
+                self.assertEqual(job(mode=None), {'skipped': True})
+        job()
+        self.assertEqual(self.calls, [None, None])
+
+    def test_bypassed_calls_run_without_the_lock(self):
+        @single_flight('job', bypass=lambda dry_run=False: dry_run)
+        def job(dry_run=False):
+            self.calls.append(dry_run)
+            if len(self.calls) == 1:
+                self.assertEqual(job(dry_run=True), 'planned')
+            return 'planned' if dry_run else 'applied'
+        self.assertEqual(job(), 'applied')
+        self.assertEqual(self.calls, [False, True])
+        self.assertEqual(metrics(['job'])['job']['ran'], 1)
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from customers import datacap, timeseries
+from customers.models import SessionLog, SubscriptionUsage
+from .factories import create_company, create_package, create_router, create_subscription
+
+MB = 1024 * 1024
+
+
+@override_settings(DATA_CAP_WARNING_PERCENT=80, DATA_CAP_ACTION='notify')
+class DataCapTests(TestCase):
+    def setUp(self):
+        company, location, self.customer = create_company()
+        self.api_package = create_package(create_router(company, location), data_limit=100)
+        self.radius_package = create_package(
+            create_router(company, location, name='radius', connection_type='RADIUS'), data_limit=100
+        )
+        self.now = timezone.now()
+
+    def subscription(self, package, username, days_ago=0):
+        return create_subscription(self.customer, package, username, start_date=self.now - timedelta(days=days_ago))
+
+    def test_usage_comes_from_the_time_series(self):
+        light = self.subscription(self.api_package, 'light', days_ago=3)
+        heavy = self.subscription(self.api_package, 'heavy', days_ago=2)
+        timeseries.add({light.id: (10 * MB, 10 * MB), heavy.id: (40 * MB, 5 * MB)}, self.now - timedelta(days=2))
+        timeseries.add({heavy.id: (30 * MB, 10 * MB)}, self.now)
+        # The live counters are no longer read.
+        SubscriptionUsage.objects.create(subscription=light, bytes_in=500 * MB)
+
+        ids, limits, used, notified = datacap.load()
+        self.assertEqual(dict(zip(ids.tolist(), used.tolist())), {light.id: 20 * MB, heavy.id: 85 * MB})
+        self.assertEqual(limits.tolist(), [100 * MB, 100 * MB])
+        self.assertEqual(notified.tolist(), [0, 0])
+
+    def test_radius_subscriptions_use_accounting(self):
+        sub = self.subscription(self.radius_package, 'radius')
+        SessionLog.objects.create(subscription=sub, username='radius', start_time=self.now, data_used=90 * MB)
+        ids, _, used, _ = datacap.load()
+        self.assertEqual(dict(zip(ids.tolist(), used.tolist())), {sub.id: 90 * MB})
+
+    def test_enforce_acts_once_per_threshold(self):
+        sub = self.subscription(self.api_package, 'heavy')
+        timeseries.add({sub.id: (85 * MB, 0)}, self.now)
+        with mock.patch('customers.tasks.send_data_cap_notices.delay') as delay:
+            self.assertEqual(datacap.enforce()['warned'], 1)
+            self.assertEqual(datacap.enforce()['warned'], 0)
+            timeseries.add({sub.id: (20 * MB, 0)}, self.now)
+            self.assertEqual(datacap.enforce()['exceeded'], 1)
+        self.assertEqual(delay.call_args_list, [mock.call([sub.id], 80), mock.call([sub.id], 100)])
@@ -0,0 +1,80 @@
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from customers import health
+from customers.routeros import RouterUnavailable, router_api
+from .factories import create_company, start_simulator
+
+
+def at(now):
+    # Only health's clock: the locmem cache would expire entries under a global patch.
+    return mock.patch('customers.health.time', **{'time.return_value': now})
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ROUTER_CIRCUIT_FAILURE_THRESHOLD=2, ROUTER_CIRCUIT_PROBE_INTERVAL=30, ROUTER_CIRCUIT_MAX_PROBE_INTERVAL=100,
+    ROUTER_CIRCUIT_PROBE_TIMEOUT=2, ROUTEROS_POOL_ACQUIRE_TIMEOUT=2, ROUTEROS_SOCKET_TIMEOUT=2,
+)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, _ = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.sim_router = self.simulator.routers[0]
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        health.record_failure(self.router, 'timeout')
+        self.assertFalse(health.is_open(health.get_health(self.router.id)))
+        self.assertEqual(health.unavailable([self.router]), set())
+        with at(1000):
+            record = health.record_failure(self.router, 'timeout')
+        self.assertTrue(health.is_open(record))
+        self.assertEqual((record['opened_at'], record['next_probe']), (1000, 1030))
+        self.assertEqual(health.unavailable([self.router]), {self.router.id})
+
+    def test_success_resets_the_failure_count(self):
+        health.record_failure(self.router, 'timeout')
+        health.record_success(self.router, 0.1)
+        health.record_failure(self.router, 'timeout')
+        self.assertFalse(health.is_open(health.get_health(self.router.id)))
+
+    def test_latency_is_a_moving_average(self):
+        health.record_success(self.router, 0.1)
+        record = health.record_success(self.router, 0.2)
+        self.assertEqual(record['latency_ms'], 120.0)
+        self.assertEqual(health.describe(record), 'OK (120.0 ms)')
+
+    def test_failed_probes_back_off_up_to_the_cap(self):
+        for _ in range(2):
+            health.record_failure(self.router, 'timeout')
+        delays = []
+        for _ in range(3):
+            with at(1000):
+                delays.append(health.record_failure(self.router, 'timeout')['next_probe'] - 1000)
+        self.assertEqual(delays, [60, 100, 100])
+
+    def test_due_for_probe(self):
+        with at(1000):
+            for _ in range(2):
+                health.record_failure(self.router, 'timeout')
+        with at(1029):
+            self.assertEqual(health.due_for_probe([self.router]), [])
+        with at(1030):
+            self.assertEqual(health.due_for_probe([self.router]), [self.router])
+
+    def test_router_api_fails_fast_while_open_and_probe_closes_it(self):
+        self.sim_router.down = True
+        for _ in range(2):
+            with self.assertRaises(Exception), router_api(self.router):
+                pass
+        self.assertTrue(health.is_open(health.get_health(self.router.id)))
+        with self.assertRaises(RouterUnavailable), router_api(self.router):
+            pass
+        self.assertFalse(health.probe(self.router))
+
+        self.sim_router.down = False
+        self.assertTrue(health.probe(self.router))
+        self.assertFalse(health.is_open(health.get_health(self.router.id)))
+        with router_api(self.router) as api:
+            self.assertEqual(api.get_resource('/ip/hotspot/user').get(), [])
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from customers import retry as retry_queue, tasks
+from customers.models import SubscriptionChange, SyncRetry
+from .factories import create_company, create_package, create_router, create_subscription
+from .test_radius import SqliteRadius
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class OutboxTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, self.customer = create_company()
+        self.default = create_package(create_router(company, location, name='default', connection_type='RADIUS'))
+        self.own = create_package(create_router(
+            company, location, name='own', connection_type='RADIUS', radius_server='10.0.0.5'
+        ))
+        self.servers = {'127.0.0.1': SqliteRadius(), '10.0.0.5': SqliteRadius()}
+        self.down = set()
+
+        @contextmanager
+        def radius_db(router=None):
+            host = router.radius_server if router is not None and router.radius_server else '127.0.0.1'
+            if host in self.down:
+                raise OSError(f"{host} unreachable")
+            yield self.servers[host]
+
+        self.enterContext(mock.patch.object(tasks, 'radius_db', radius_db))
+        self.enterContext(mock.patch('customers.radius_pool.radius_db', radius_db))
+        self.enterContext(override_settings(RADIUS_DB_HOST='127.0.0.1'))
+
+    def usernames(self, host):
+        return [row[0] for row in self.servers[host].rows('radcheck')]
+
+    def test_changes_go_to_each_routers_radius_server(self):
+        alice = create_subscription(self.customer, self.default, 'alice')
+        bob = create_subscription(self.customer, self.own, 'bob')
+        stats = tasks.sync_subscription_changes()
+        self.assertEqual(stats['radius'], {'servers': 2, 'failed': 0, 'retries_queued': 0})
+        self.assertEqual(self.usernames('127.0.0.1'), ['alice'])
+        self.assertEqual(self.usernames('10.0.0.5'), ['bob'])
+        self.assertFalse(SubscriptionChange.objects.filter(processed_at__isnull=True).exists())
+
+        bob.is_active = False
+        bob.save()
+        alice.delete()
+        tasks.sync_subscription_changes()
+        self.assertEqual(self.usernames('127.0.0.1'), [])
+        self.assertEqual(self.usernames('10.0.0.5'), [])
+
+    def test_failed_server_queues_radius_retries(self):
+        create_subscription(self.customer, self.default, 'alice')
+        bob = create_subscription(self.customer, self.own, 'bob')
+        self.down.add('10.0.0.5')
+        stats = tasks.sync_subscription_changes()
+        self.assertEqual(stats['radius'], {'servers': 2, 'failed': 1, 'retries_queued': 1})
+        self.assertEqual(self.usernames('127.0.0.1'), ['alice'])
+        retry = SyncRetry.objects.get()
+        self.assertEqual((retry.subscription_id, retry.router_id, retry.operation), (bob.id, bob.router_id, 'RADIUS'))
+
+        # The change is processed; the retry delivers it once the server is back.
+        self.assertFalse(SubscriptionChange.objects.filter(processed_at__isnull=True).exists())
+        self.down.clear()
+        self.assertEqual(retry_queue.process_retries(now=timezone.now() + timedelta(hours=1))['succeeded'], 1)
+        self.assertEqual(self.usernames('10.0.0.5'), ['bob'])
+
+    def test_processed_changes_are_pruned(self):
+        create_subscription(self.customer, self.default, 'alice')
+        tasks.sync_subscription_changes()
+        create_subscription(self.customer, self.default, 'bob')
+        SubscriptionChange.objects.filter(username='alice').update(processed_at=timezone.now() - timedelta(days=8))
+        with override_settings(SUBSCRIPTION_CHANGE_RETENTION_DAYS=7):
+            self.assertEqual(tasks.prune_subscription_changes(), {'deleted': 1})
+        self.assertEqual(list(SubscriptionChange.objects.values_list('username', flat=True)), ['bob'])
@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from customers import provisioning
+from customers.models import ProvisioningJob, SyncRetry
+from customers.reconcile import RESOURCES, build_desired_state, plan_changes, managed_names
+from customers.sync import sync_routers
+from .factories import create_company, create_package, create_router, create_subscription, start_simulator
+from .test_radius import SqliteRadius
+
+
+class RouterEntriesTests(TestCase):
+    def setUp(self):
+        company, location, self.customer = create_company()
+        self.router = create_router(company, location)
+
+    def test_entries_created_by_provisioning_need_no_reconcile(self):
+        subs = [
+            create_subscription(self.customer, create_package(self.router, 'HOTSPOT', data_limit=200), 'hotspot'),
+            create_subscription(self.customer, create_package(self.router, 'PPPOE'), 'pppoe'),
+            create_subscription(self.customer, create_package(self.router, 'VPN'), 'vpn'),
+        ]
+        current = {path: {} for path in RESOURCES}
+        for sub in subs:
+            for path, params in provisioning.router_entries(provisioning.account_for(sub)):
+                current[path][params['name']] = dict(params, id=f"*{len(current[path])}")
+        desired, owners = build_desired_state(subs)
+        self.assertEqual(plan_changes(desired, current, owners, managed_names({sub.username: {sub.connection_type} for sub in subs})), [])
+
+    def test_vpn_secret_uses_a_routeros_service(self):
+        sub = create_subscription(self.customer, create_package(self.router, 'VPN'), 'vpn')
+        entries = dict(provisioning.router_entries(provisioning.account_for(sub)))
+        self.assertEqual(entries['/ppp/secret']['service'], 'l2tp')
+
+    def test_hotspot_extras_are_only_sent_on_create(self):
+        sub = create_subscription(self.customer, create_package(self.router, 'HOTSPOT', data_limit=200), 'hotspot')
+        [(path, params)] = provisioning.router_entries(provisioning.account_for(sub))
+        self.assertEqual(path, '/ip/hotspot/user')
+        self.assertEqual(params['limit-bytes-total'], str(200 * 1024 * 1024))
+        self.assertTrue(params['comment'].startswith('Created='))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProvisionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, self.customer = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.sim_router = self.simulator.routers[0]
+        self.hotspot = create_package(self.router, 'HOTSPOT')
+        self.pppoe = create_package(self.router, 'PPPOE')
+
+    def entries(self, path):
+        return [row for row in self.sim_router.tables[path].values()]
+
+    def test_provision_after_outbox_sync_does_not_duplicate(self):
+        subs = [
+            create_subscription(self.customer, self.hotspot, 'alice'),
+            create_subscription(self.customer, self.pppoe, 'bob'),
+        ]
+        # The outbox sync gets there first.
+        self.assertEqual(sync_routers(subs)['failed'], 0)
+        result = provisioning.provision(subs)
+        self.assertEqual((result['ok'], result['failed']), (2, 0))
+        self.assertEqual(len(self.entries('/ip/hotspot/user')), 1)
+        self.assertEqual(len(self.entries('/ppp/secret')), 1)
+        self.assertEqual(len(self.entries('/queue/simple')), 1)
+        self.assertEqual(self.sim_router.commands['/ip/hotspot/user/add'], 1)
+
+    def test_provision_vpn_subscription(self):
+        sub = create_subscription(self.customer, create_package(self.router, 'VPN'), 'carol')
+        self.assertTrue(provisioning.provision([sub])['results'][0]['ok'])
+        [row] = self.entries('/ppp/secret')
+        self.assertEqual((row['name'], row['service']), ('carol', 'l2tp'))
+
+    def test_provision_updates_a_stale_entry(self):
+        sub = create_subscription(self.customer, self.hotspot, 'alice')
+        self.sim_router.seed('/ip/hotspot/user', [{'name': 'alice', 'password': 'old', 'disabled': 'yes'}])
+        self.assertTrue(provisioning.provision([sub])['results'][0]['ok'])
+        [row] = self.entries('/ip/hotspot/user')
+        self.assertEqual((row['password'], row['disabled']), (sub.password, 'false'))
+        # Nothing left for the next reconcile to change.
+        self.assertEqual(sync_routers([sub])['routers'][str(self.router.id)]['planned'], {'add': 0, 'set': 0, 'remove': 0})
+
+    def test_run_job_succeeds_when_the_entry_exists(self):
+        sub = create_subscription(self.customer, self.hotspot, 'alice')
+        sync_routers([sub])
+        job = ProvisioningJob.objects.create(subscription=sub, event='PAYMENT')
+        with mock.patch.object(provisioning, 'send_sms', return_value={'status': 'success'}), \
+                mock.patch.object(provisioning, 'send_email', return_value={'status': 'success'}):
+            job = provisioning.run_job(job)
+        self.assertEqual((job.status, job.network_status), ('SUCCESS', 'SUCCESS'))
+        self.assertFalse(SyncRetry.objects.exists())
+
+    def test_provision_on_radius_is_idempotent(self):
+        radius_router = create_router(self.router.company, self.router.location, name='radius', connection_type='RADIUS')
+        package = create_package(radius_router, 'HOTSPOT', data_limit=100)
+        sub = create_subscription(self.customer, package, 'carol')
+        db = SqliteRadius()
+
+        @contextmanager
+        def radius_db(router=None):
+            yield db
+
+        with mock.patch.object(provisioning, 'radius_db', radius_db):
+            for _ in range(2):
+                self.assertTrue(provisioning.provision([sub])['results'][0]['ok'])
+        self.assertEqual(db.rows('radcheck'), [('carol', 'Cleartext-Password', ':=', sub.password)])
+        self.assertEqual(len(db.rows('radusergroup')), 1)
+        self.assertEqual(db.rows('radreply'), [('carol', 'Mikrotik-Total-Limit', ':=', str(100 * 1024 * 1024))])
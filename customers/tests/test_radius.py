@@ -0,0 +1,144 @@
+import sqlite3
+from unittest import mock
+from django.test import TestCase
+from customers import radius
+from .factories import create_company, create_package, create_router, create_subscription
+
+SCHEMA = """
+CREATE TABLE radcheck (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, attribute TEXT, op TEXT, value TEXT);
+CREATE TABLE radgroupcheck (id INTEGER PRIMARY KEY AUTOINCREMENT, groupname TEXT, attribute TEXT, op TEXT, value TEXT);
+CREATE TABLE radusergroup (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, groupname TEXT, priority INTEGER);
+CREATE TABLE radreply (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, attribute TEXT, op TEXT, value TEXT);
+CREATE TABLE radacct (
+    radacctid INTEGER PRIMARY KEY AUTOINCREMENT, acctuniqueid TEXT, acctsessionid TEXT, username TEXT,
+    acctstarttime TIMESTAMP, acctstoptime TIMESTAMP, acctupdatetime TIMESTAMP,
+    acctinputoctets INTEGER, acctoutputoctets INTEGER
+);
+"""
+
+
+class SqliteCursor:
+    """DB-API cursor speaking MySQLdb's ``%s`` paramstyle on top of sqlite3."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self.cursor.execute(sql.replace('%s', '?'), params)
+
+    def executemany(self, sql, rows):
+        return self.cursor.executemany(sql.replace('%s', '?'), rows)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SqliteRadius:
+    """In-memory stand-in for the FreeRADIUS database."""
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.db.executescript(SCHEMA)
+
+    def cursor(self):
+        return SqliteCursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def rows(self, table):
+        key_columns, value_columns = radius.TABLES.get(table, (('username', 'attribute'), ('op', 'value')))
+        return sorted(
+            tuple(str(value) for value in row)
+            for row in self.db.execute(f"SELECT {', '.join(key_columns + value_columns)} FROM {table}")
+        )
+
+    def tables(self):
+        return {name for name, in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+class RecordingMySQL:
+    """Records the statements a MySQL connection would receive."""
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class RadiusSyncTests(TestCase):
+    def setUp(self):
+        company, location, self.customer = create_company()
+        router = create_router(company, location, connection_type='RADIUS')
+        self.hotspot = create_package(router, 'HOTSPOT', name='Daily')
+        self.pppoe = create_package(router, 'PPPOE', name='Home')
+        self.subscriptions = [
+            create_subscription(self.customer, self.hotspot, 'alice'),
+            create_subscription(self.customer, self.hotspot, 'bob'),
+            create_subscription(self.customer, self.pppoe, 'carol'),
+        ]
+        self.db = SqliteRadius()
+
+    def expected(self, subscriptions):
+        return {table: sorted(radius.flatten(rows)) for table, rows in radius.desired_rows(subscriptions).items()}
+
+    def current(self):
+        return {table: self.db.rows(table) for table in radius.TABLES}
+
+    def test_incremental_sync_only_writes_differences(self):
+        stats = radius.incremental_sync(self.db, self.subscriptions)
+        self.assertEqual(stats['radcheck']['inserted'], 3)
+        self.assertEqual(self.current(), self.expected(self.subscriptions))
+
+        alice, bob, carol = self.subscriptions
+        alice.password = 'changed'
+        stats = radius.incremental_sync(self.db, [alice, carol])
+        self.assertEqual(stats['radcheck'], dict(stats['radcheck'], inserted=0, updated=1, deleted=1))
+        self.assertEqual(stats['radusergroup'], dict(stats['radusergroup'], inserted=0, updated=0, deleted=1))
+        self.assertEqual(self.current(), self.expected([alice, carol]))
+
+        stats = radius.incremental_sync(self.db, [alice, carol])
+        self.assertFalse(any(
+            counts['inserted'] or counts['updated'] or counts['deleted'] for counts in stats.values()
+        ))
+
+    def test_sync_users_rewrites_only_given_users(self):
+        radius.incremental_sync(self.db, self.subscriptions)
+        alice, bob, carol = self.subscriptions
+        alice.password = 'changed'
+        radius.sync_users(self.db.cursor(), [alice], removed_usernames=['bob'])
+        self.assertEqual(self.current(), self.expected([alice, carol]))
+
+    def test_swap_sync_falls_back_to_incremental_off_mysql(self):
+        self.assertFalse(radius.supports_swap(self.db))
+        radius.incremental_sync(self.db, self.subscriptions[:1])
+        stats = radius.swap_sync(self.db, self.subscriptions)
+        self.assertEqual(stats['radcheck']['inserted'], 2)
+        self.assertEqual(self.current(), self.expected(self.subscriptions))
+        self.assertEqual(self.db.tables() - {'sqlite_sequence', 'radreply', 'radacct'}, set(radius.TABLES))
+
+    def test_swap_sync_renames_all_tables_at_once_on_mysql(self):
+        db = RecordingMySQL()
+        with mock.patch.object(radius, 'supports_swap', return_value=True):
+            stats = radius.swap_sync(db, self.subscriptions)
+        self.assertEqual(stats['radcheck']['inserted'], 3)
+        for table in radius.TABLES:
+            self.assertIn(f"CREATE TABLE {table}_new LIKE {table}", db.statements)
+        renames = [sql for sql in db.statements if sql.startswith('RENAME TABLE')]
+        self.assertEqual(renames, ["RENAME TABLE " + ', '.join(
+            f"{table} TO {table}_old, {table}_new TO {table}" for table in radius.TABLES
+        )])
+        self.assertEqual(db.statements[-3:], [f"DROP TABLE IF EXISTS {table}_old" for table in radius.TABLES])
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from customers import health, retry
+from customers.models import SyncRetry
+from .factories import create_company, create_package, create_subscription, start_simulator
+
+USERS = '/ip/hotspot/user'
+
+
+@override_settings(SYNC_RETRY_BASE_DELAY=5, SYNC_RETRY_MAX_DELAY=60)
+class BackoffTests(SimpleTestCase):
+    def test_exponential_with_equal_jitter_and_a_cap(self):
+        for attempts, delay in ((0, 5), (1, 10), (3, 40), (4, 60), (10, 60)):
+            with mock.patch('random.uniform', side_effect=lambda low, high: high):
+                self.assertEqual(retry.backoff(attempts), delay)
+            with mock.patch('random.uniform', side_effect=lambda low, high: low):
+                self.assertEqual(retry.backoff(attempts), delay / 2)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SYNC_RETRY_BASE_DELAY=5, SYNC_RETRY_MAX_DELAY=60, SYNC_RETRY_MAX_ATTEMPTS=2,
+    ROUTER_CIRCUIT_FAILURE_THRESHOLD=100, ROUTEROS_POOL_ACQUIRE_TIMEOUT=2, ROUTEROS_SOCKET_TIMEOUT=2,
+)
+class RetryQueueTests(TransactionTestCase):
+    """process_retries works on routers in threads, hence real transactions."""
+
+    def setUp(self):
+        cache.clear()
+        company, location, customer = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.sim_router = self.simulator.routers[0]
+        self.sub = create_subscription(customer, create_package(self.router, 'HOTSPOT'), 'alice')
+
+    def queue(self, operation='SYNC'):
+        retry.record_failures(operation, [(self.sub.id, self.router.id, self.sub.username, 'timed out')])
+        return SyncRetry.objects.get(subscription_id=self.sub.id, operation=operation)
+
+    def process(self, minutes=10):
+        return retry.process_retries(now=timezone.now() + timedelta(minutes=minutes))
+
+    def test_record_failures_keeps_an_existing_retry(self):
+        first = self.queue()
+        self.assertEqual((first.status, first.attempts), ('PENDING', 0))
+        self.assertLessEqual(first.next_attempt_at, timezone.now() + timedelta(seconds=5))
+        SyncRetry.objects.filter(id=first.id).update(attempts=3, last_error='old')
+        self.assertEqual(self.queue().last_error, 'old')
+        self.assertEqual(SyncRetry.objects.count(), 1)
+
+    def test_not_due_yet(self):
+        self.queue()
+        self.assertEqual(retry.process_retries(now=timezone.now() - timedelta(minutes=1))['attempted'], 0)
+
+    def test_successful_retry_is_deleted(self):
+        self.queue()
+        stats = self.process()
+        self.assertEqual((stats['attempted'], stats['succeeded']), (1, 1))
+        self.assertFalse(SyncRetry.objects.exists())
+        self.assertEqual([row['name'] for row in self.sim_router.tables[USERS].values()], ['alice'])
+
+    def test_failures_back_off_then_become_dead_letters(self):
+        self.queue()
+        self.sim_router.down = True
+        stats = self.process()
+        self.assertEqual((stats['failed'], stats['dead']), (1, 0))
+        pending = SyncRetry.objects.get()
+        self.assertEqual((pending.status, pending.attempts), ('PENDING', 1))
+        self.assertTrue(pending.last_error)
+
+        stats = self.process(minutes=20)
+        self.assertEqual((stats['failed'], stats['dead']), (0, 1))
+        self.assertEqual(SyncRetry.objects.get().status, 'DEAD')
+        # Dead letters are not attempted again until replayed.
+        self.assertEqual(self.process(minutes=30)['attempted'], 0)
+
+        self.sim_router.down = False
+        self.assertEqual(retry.replay(SyncRetry.objects.filter(status='DEAD')), 1)
+        self.assertEqual(self.process()['succeeded'], 1)
+
+    def test_open_circuit_postpones_without_spending_an_attempt(self):
+        self.queue()
+        with override_settings(ROUTER_CIRCUIT_FAILURE_THRESHOLD=1):
+            health.record_failure(self.router, 'down')
+            stats = self.process()
+        self.assertEqual((stats['attempted'], stats['postponed']), (0, 1))
+        self.assertEqual(SyncRetry.objects.get().attempts, 0)
+
+    def test_retries_for_deleted_routers_are_dropped(self):
+        self.queue()
+        SyncRetry.objects.update(router_id=self.router.id + 1000)
+        self.assertEqual(self.process()['dropped'], 1)
+        self.assertFalse(SyncRetry.objects.exists())
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from customers.models import Subscription, SubscriptionChange
+from customers.scheduler import ExpiryScheduler
+from .factories import create_company, create_package, create_router, create_subscription
+
+
+class PollChangesTests(TestCase):
+    def setUp(self):
+        company, location, customer = create_company()
+        package = create_package(create_router(company, location))
+        self.soon = create_subscription(customer, package, 'soon', days=0, end_date=timezone.now() + timedelta(minutes=5))
+        self.later = create_subscription(customer, package, 'later', days=30)
+        self.scheduler = ExpiryScheduler(horizon=3600)
+        self.scheduler.rebuild()
+
+    def change(self, change_id, subscription):
+        return SubscriptionChange.objects.create(
+            id=change_id, subscription_id=subscription.id, router_id=subscription.router_id,
+            username=subscription.username, change_type='UPDATED'
+        )
+
+    def shorten(self, subscription):
+        Subscription.objects.filter(id=subscription.id).update(end_date=timezone.now() + timedelta(minutes=10))
+
+    def test_rebuild_loads_deadlines_within_horizon(self):
+        self.assertEqual(set(self.scheduler.deadlines), {self.soon.id})
+
+    def test_change_committed_after_a_higher_id_is_not_skipped(self):
+        first = self.scheduler.last_change_id + 1
+        self.change(first + 1, self.soon)
+        self.assertEqual(self.scheduler.poll_changes(), 1)
+        self.assertEqual(self.scheduler.last_change_id, first + 1)
+        self.assertIn(first, self.scheduler.gaps)
+
+        # The transaction holding the lower id commits only now.
+        self.shorten(self.later)
+        self.change(first, self.later)
+        self.assertEqual(self.scheduler.poll_changes(), 1)
+        self.assertIn(self.later.id, self.scheduler.deadlines)
+        self.assertEqual(self.scheduler.gaps, {})
+        self.assertEqual(self.scheduler.poll_changes(), 0)
+
+    def test_gaps_are_forgotten_after_the_timeout(self):
+        self.scheduler.gap_timeout = 0
+        first = self.scheduler.last_change_id + 1
+        self.change(first + 1, self.soon)
+        self.scheduler.poll_changes()
+        self.shorten(self.later)
+        self.change(first, self.later)
+        self.assertEqual(self.scheduler.poll_changes(), 0)
+        self.assertNotIn(self.later.id, self.scheduler.deadlines)
+
+    def test_rebuild_remembers_recent_gaps(self):
+        top = self.scheduler.last_change_id
+        self.change(top + 2, self.soon)
+        self.scheduler.rebuild()
+        self.assertEqual(set(self.scheduler.gaps), {top + 1})
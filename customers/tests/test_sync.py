@@ -0,0 +1,86 @@
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from customers.reconcile import HOTSPOT_USERS, PPP_SECRETS, QUEUES, Change
+from customers.sync import chunk_by_user, sync_routers
+from .factories import create_company, create_package, create_subscription, start_simulator
+
+
+class ChunkByUserTests(SimpleTestCase):
+    def test_each_users_changes_stay_together_in_order(self):
+        changes = [
+            Change('add', PPP_SECRETS, 'alice'),
+            Change('add', PPP_SECRETS, 'bob'),
+            Change('add', HOTSPOT_USERS, 'carol'),
+            Change('add', QUEUES, 'q_alice'),
+            Change('remove', QUEUES, 'q_bob'),
+        ]
+        chunks = chunk_by_user(changes, 2)
+        self.assertEqual(sorted(len(chunk) for chunk in chunks), [2, 3])
+        for chunk in chunks:
+            names = [change.name for change in chunk]
+            for user in ('alice', 'bob'):
+                if user in names:
+                    self.assertEqual(names[names.index(user):names.index(user) + 2], [user, f"q_{user}"])
+
+    def test_no_empty_chunks(self):
+        self.assertEqual(len(chunk_by_user([Change('add', PPP_SECRETS, 'alice')], 4)), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ParallelSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, self.customer = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.router.sync_concurrency = 3
+        self.router.save()
+
+    def test_parallel_sessions_apply_every_change(self):
+        package = create_package(self.router, 'PPPOE')
+        subs = [create_subscription(self.customer, package, f"user{i}") for i in range(10)]
+        with mock.patch('customers.sync.chunk_by_user', wraps=chunk_by_user) as chunker:
+            stats = sync_routers(subs)
+        self.assertEqual(chunker.call_args.args[1], 3)
+        self.assertEqual((stats['applied'], stats['failed']), (20, 0))
+        tables = self.simulator.routers[0].tables
+        self.assertEqual(len(tables[PPP_SECRETS]), 10)
+        self.assertEqual(len(tables[QUEUES]), 10)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RemovalScopeTests(TransactionTestCase):
+    """Full syncs look up the names found on a router from the sync worker thread, hence real transactions."""
+
+    def setUp(self):
+        cache.clear()
+        company, location, self.customer = create_company()
+        self.simulator, [self.router] = start_simulator(self, company, location)
+        self.sim_router = self.simulator.routers[0]
+        self.hotspot = create_package(self.router, 'HOTSPOT')
+        self.pppoe = create_package(self.router, 'PPPOE')
+
+    def names(self, path):
+        return sorted(row['name'] for row in self.sim_router.tables[path].values())
+
+    def test_retiring_a_hotspot_user_keeps_a_same_named_secret(self):
+        carol = create_subscription(self.customer, self.hotspot, 'carol')
+        for retired in ({self.router.id: {'bob'}}, None):
+            sub = create_subscription(self.customer, self.hotspot, 'bob')
+            sync_routers([carol, sub])
+            self.sim_router.seed(PPP_SECRETS, [{'name': 'bob', 'password': 'manual'}])
+            sub.is_active = False
+            sub.save()
+            self.assertEqual(sync_routers([carol], retired=retired)['failed'], 0)
+            self.assertEqual((self.names(HOTSPOT_USERS), self.names(PPP_SECRETS)), (['carol'], ['bob']))
+            self.sim_router.tables[PPP_SECRETS].clear()
+
+    def test_type_change_removes_the_old_entry(self):
+        old = create_subscription(self.customer, self.hotspot, 'alice')
+        sync_routers([old])
+        old.is_active = False
+        old.save()
+        new = create_subscription(self.customer, self.pppoe, 'alice')
+        sync_routers([new], retired={self.router.id: {'alice'}})
+        self.assertEqual((self.names(HOTSPOT_USERS), self.names(PPP_SECRETS)), ([], ['alice']))
+        self.assertEqual(self.names(QUEUES), ['q_alice'])
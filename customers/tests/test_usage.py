@@ -0,0 +1,46 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from customers import health
+from customers.models import SubscriptionUsage
+from customers.usage import HOTSPOT_ACTIVE, UsageCollector
+from .factories import create_company, create_package, create_subscription, start_simulator
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    ROUTER_CIRCUIT_FAILURE_THRESHOLD=2,
+)
+class UsageCollectorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        company, location, customer = create_company()
+        self.simulator, self.routers = start_simulator(self, company, location, count=2)
+        self.subscription = create_subscription(customer, create_package(self.routers[0], 'HOTSPOT'), 'alice')
+        self.collector = UsageCollector(timeout=2)
+
+    def session(self, bytes_in, bytes_out):
+        table = self.simulator.routers[0].tables[HOTSPOT_ACTIVE]
+        table.clear()
+        table['*1'] = {'.id': '*1', 'user': 'alice', 'bytes-in': str(bytes_in), 'bytes-out': str(bytes_out)}
+
+    def test_usage_is_the_difference_between_polls(self):
+        self.session(1000, 500)
+        self.assertEqual(self.collector.collect()['subscriptions'], 0)
+        self.session(4000, 700)
+        stats = self.collector.collect()
+        self.assertEqual((stats['subscriptions'], stats['bytes']), (1, 3200))
+        usage = SubscriptionUsage.objects.get(subscription=self.subscription)
+        self.assertEqual((usage.bytes_in, usage.bytes_out), (3000, 200))
+
+    def test_poll_outcomes_drive_the_circuit(self):
+        good, bad = self.routers
+        self.simulator.routers[1].down = True
+        for _ in range(2):
+            stats = self.collector.collect()
+            self.assertEqual((stats['routers'], stats['failed']), (2, 1))
+        self.assertTrue(health.is_open(health.get_health(bad.id)))
+        self.assertIsNotNone(health.get_health(good.id)['last_success'])
+
+        # The open circuit keeps the dead router out of the next poll.
+        stats = self.collector.collect()
+        self.assertEqual((stats['routers'], stats['failed'], stats['skipped']), (1, 0, 1))
@@ -0,0 +1,37 @@
+import os
+import ipaddress
+import tempfile
+from django.test import TestCase, override_settings
+from customers.vpn import VpnTunnelError, WireGuardTunnel, wireguard_address
+from .factories import create_company, create_router
+
+
+class WireGuardAddressTests(TestCase):
+    def setUp(self):
+        company, location, _ = create_company()
+        self.routers = [
+            create_router(
+                company, location, name=f"wg-{i}", connection_type='VPN', vpn_protocol='WIREGUARD',
+                vpn_server='203.0.113.1', ip_address=f"192.168.{i}.1",
+            )
+            for i in range(2)
+        ]
+        self.config_dir = self.enterContext(tempfile.TemporaryDirectory())
+
+    def interface_address(self, router):
+        tunnel = WireGuardTunnel(router, self.config_dir)
+        with open(tunnel.config_file) as f:
+            return next(line for line in f.read().splitlines() if line.startswith('Address = '))
+
+    @override_settings(VPN_WG_ADDRESS_POOL='10.0.0.0/16')
+    def test_each_router_gets_its_own_address(self):
+        first, second = self.routers
+        self.assertEqual(self.interface_address(first), f"Address = {ipaddress.ip_network('10.0.0.0/16')[first.id + 1]}/32")
+        self.assertNotEqual(self.interface_address(first), self.interface_address(second))
+        self.assertEqual(len(os.listdir(self.config_dir)), 2)
+
+    def test_exhausted_pool_is_an_error(self):
+        with override_settings(VPN_WG_ADDRESS_POOL='10.0.0.0/30'):
+            with self.assertRaisesRegex(VpnTunnelError, 'no address left'):
+                for router in self.routers:
+                    wireguard_address(router)
@@ -0,0 +1,152 @@
+import zlib
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import UsageBlock
+
+logger = logging.getLogger(__name__)
+
+# Seconds per bucket -> buckets per UsageBlock. Every sample is added at all
+# three resolutions, so hourly and daily figures never wait for a rollup.
+RESOLUTIONS = {
+    300: 288,    # 5 minutes, one block per day
+    3600: 168,   # hourly, one block per week
+    86400: 366,  # daily, one block per 366 days
+}
+
+Series = namedtuple('Series', ['resolution', 'times', 'values'])
+
+
+def retention():
+    """Seconds each resolution is kept for."""
+    return {
+        300: settings.USAGE_SERIES_RETENTION_5M * 86400,
+        3600: settings.USAGE_SERIES_RETENTION_HOURLY * 86400,
+        86400: settings.USAGE_SERIES_RETENTION_DAILY * 86400,
+    }
+
+
+def _epoch(value):
+    return int(value.timestamp())
+
+
+def _datetime(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def block_start(epoch, resolution):
+    """Epoch second at which the block containing ``epoch`` starts; blocks are aligned to the Unix epoch."""
+    span = resolution * RESOLUTIONS[resolution]
+    return epoch - epoch % span
+
+
+def encode(array):
+    return zlib.compress(np.ascontiguousarray(array, dtype='<i8').tobytes(), 1)
+
+
+def decode(data, resolution):
+    return np.frombuffer(zlib.decompress(bytes(data)), dtype='<i8').reshape(RESOLUTIONS[resolution], 2).copy()
+
+
+def add(usage, at, batch_size=1000):
+    """Add {subscription_id: (bytes_in, bytes_out)} to the buckets containing ``at`` at every resolution.
+
+    Each chunk of ``batch_size`` subscriptions costs one locked SELECT per
+    resolution and a single upsert. Returns the number of subscriptions.
+    """
+    if not usage:
+        return 0
+    epoch = _epoch(at)
+    unique_fields = ['subscription_id', 'resolution', 'start'] if connection.features.supports_update_conflicts_with_target else None
+    subscription_ids = list(usage)
+    for i in range(0, len(subscription_ids), batch_size):
+        chunk = subscription_ids[i:i + batch_size]
+        values = np.array([usage[subscription_id] for subscription_id in chunk], dtype=np.int64)
+        blocks = []
+        with transaction.atomic():
+            for resolution, buckets in RESOLUTIONS.items():
+                start = block_start(epoch, resolution)
+                bucket = (epoch - start) // resolution
+                stored = dict(
+                    UsageBlock.objects.filter(resolution=resolution, start=_datetime(start), subscription_id__in=chunk)
+                    .select_for_update().values_list('subscription_id', 'data')
+                )
+                for row, subscription_id in enumerate(chunk):
+                    data = stored.get(subscription_id)
+                    array = decode(data, resolution) if data is not None else np.zeros((buckets, 2), dtype=np.int64)
+                    array[bucket] += values[row]
+                    blocks.append(UsageBlock(
+                        subscription_id=subscription_id, resolution=resolution, start=_datetime(start), data=encode(array)
+                    ))
+            UsageBlock.objects.bulk_create(
+                blocks, update_conflicts=True, unique_fields=unique_fields, update_fields=['data', 'updated_at']
+            )
+    return len(subscription_ids)
+
+
+def pick_resolution(start, now=None):
+    """The finest resolution whose retention still covers ``start``."""
+    age = ((now or timezone.now()) - start).total_seconds()
+    kept = retention()
+    for resolution in sorted(RESOLUTIONS):
+        if age <= kept[resolution]:
+            return resolution
+    return max(RESOLUTIONS)
+
+
+def query(subscription_ids, start, end=None, resolution=None):
+    """Return a Series of per-bucket usage between ``start`` and ``end`` (default now).
+
+    ``times`` holds the epoch second each bucket starts at and ``values``
+    maps every requested subscription to an int64 array of (bytes_in,
+    bytes_out) rows, one per bucket, zero where nothing was recorded. The
+    first bucket is the one containing ``start``. Without ``resolution``
+    the finest one still retained for ``start`` is used.
+    """
+    end = end or timezone.now()
+    resolution = resolution or pick_resolution(start)
+    first = _epoch(start) // resolution * resolution
+    count = max(0, -(-(_epoch(end) - first) // resolution))
+    times = first + np.arange(count, dtype=np.int64) * resolution
+    subscription_ids = list(subscription_ids)
+    values = {subscription_id: np.zeros((count, 2), dtype=np.int64) for subscription_id in subscription_ids}
+    if not count:
+        return Series(resolution, times, values)
+    span = resolution * RESOLUTIONS[resolution]
+    starts = [_datetime(epoch) for epoch in range(block_start(first, resolution), first + count * resolution, span)]
+    for i in range(0, len(subscription_ids), 1000):
+        rows = UsageBlock.objects.filter(
+            subscription_id__in=subscription_ids[i:i + 1000], resolution=resolution, start__in=starts
+        ).values_list('subscription_id', 'start', 'data')
+        for subscription_id, start_at, data in rows:
+            offset = (_epoch(start_at) - first) // resolution
+            low, high = max(0, -offset), min(RESOLUTIONS[resolution], count - offset)
+            if low < high:
+                values[subscription_id][offset + low:offset + high] += decode(data, resolution)[low:high]
+    return Series(resolution, times, values)
+
+
+def totals(subscription_ids, start, end=None, resolution=None):
+    """Return {subscription_id: (bytes_in, bytes_out)} summed over a query() range."""
+    series = query(subscription_ids, start, end, resolution)
+    return {
+        subscription_id: tuple(int(total) for total in array.sum(axis=0))
+        for subscription_id, array in series.values.items()
+    }
+
+
+def prune(now=None):
+    """Delete blocks that ended before their resolution's retention period; returns {resolution: rows deleted}."""
+    now = now or timezone.now()
+    deleted = {}
+    for resolution, seconds in retention().items():
+        span = resolution * RESOLUTIONS[resolution]
+        cutoff = now - timedelta(seconds=seconds + span)
+        deleted[resolution], _ = UsageBlock.objects.filter(resolution=resolution, start__lt=cutoff).delete()
+    if any(deleted.values()):
+        logger.info(f"Pruned usage blocks past retention: {deleted}")
+    return deleted
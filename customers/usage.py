@@ -0,0 +1,229 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from .aio_routeros import run_on_routers
+from .models import Router, Subscription, SubscriptionUsage
+from .reconcile import QUEUES
+from .routeros import RouterConnectionError, ensure_available
+from . import health, timeseries
+
+logger = logging.getLogger(__name__)
+
+HOTSPOT_ACTIVE = '/ip/hotspot/active'
+PPP_ACTIVE = '/ppp/active'
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _queue_bytes(value):
+    """A simple queue's ``bytes`` is "upload/download" as seen from its target."""
+    upload, _, download = (value or '').partition('/')
+    return _int(upload), _int(download)
+
+
+async def read_counters(router, client):
+    """Read one router's live byte counters with three concurrent prints.
+
+    Returns (counters, online): counters maps a counter key to (username,
+    bytes_in, bytes_out) and online is the number of active sessions.
+    Hotspot sessions carry their own counters; PPP sessions don't, so PPPoE
+    traffic is read from the subscription's ``q_<username>`` queue, whose
+    counters survive reconnects.
+    """
+    hotspot, ppp, queues = await asyncio.gather(
+        client.print(HOTSPOT_ACTIVE, proplist=['.id', 'user', 'bytes-in', 'bytes-out']),
+        client.print(PPP_ACTIVE, proplist=['.id', 'name']),
+        client.print(QUEUES, proplist=['.id', 'name', 'bytes']),
+    )
+    counters = {}
+    for row in hotspot:
+        if row.get('user'):
+            counters[f"hotspot:{row.get('id')}"] = (row['user'], _int(row.get('bytes-in')), _int(row.get('bytes-out')))
+    for row in queues:
+        name = row.get('name') or ''
+        if name.startswith('q_'):
+            counters[f"queue:{row.get('id')}"] = (name[2:], *_queue_bytes(row.get('bytes')))
+    return counters, len(hotspot) + len(ppp)
+
+
+def deltas(previous, current):
+    """Return {username: [bytes_in, bytes_out]} transferred between two counter snapshots.
+
+    A counter that is new (a session that started since the last poll) or
+    lower than before (reset by a reconnect or reboot) counts from zero.
+    Whatever a session transfers after the last poll before it ends is
+    lost; RADIUS accounting has the exact totals.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for key, (username, bytes_in, bytes_out) in current.items():
+        before = previous.get(key)
+        if before is not None and before[0] == username and bytes_in >= before[1] and bytes_out >= before[2]:
+            bytes_in, bytes_out = bytes_in - before[1], bytes_out - before[2]
+        if bytes_in or bytes_out:
+            totals[username][0] += bytes_in
+            totals[username][1] += bytes_out
+    return totals
+
+
+def _subscription_ids(keys):
+    """Map (router_id, username) pairs to subscription ids, preferring the most recent subscription."""
+    usernames = list({username for _, username in keys})
+    router_ids = {router_id for router_id, _ in keys}
+    ids = {}
+    for i in range(0, len(usernames), 1000):
+        rows = Subscription.objects.filter(
+            username__in=usernames[i:i + 1000], router_id__in=router_ids
+        ).order_by('start_date').values_list('router_id', 'username', 'id')
+        for router_id, username, subscription_id in rows:
+            if (router_id, username) in keys:
+                ids[(router_id, username)] = subscription_id
+    return ids
+
+
+def record_usage(usage, now, batch_size=1000):
+    """Add {(router_id, username): [bytes_in, bytes_out]} to SubscriptionUsage in bulk.
+
+    Totals are read and written back in chunks of ``batch_size`` (one SELECT
+    and one upsert each), so only one collector may run at a time. Returns
+    {subscription_id: (bytes_in, bytes_out)} for the added traffic;
+    usernames without a subscription are logged and skipped.
+    """
+    ids = _subscription_ids(usage)
+    added = defaultdict(lambda: [0, 0])
+    for key, (bytes_in, bytes_out) in usage.items():
+        if key in ids:
+            added[ids[key]][0] += bytes_in
+            added[ids[key]][1] += bytes_out
+    unknown = len(usage) - len(ids)
+    if unknown:
+        logger.debug(f"Ignoring traffic of {unknown} users without a subscription")
+    unique_fields = ['subscription'] if connection.features.supports_update_conflicts_with_target else None
+    subscription_ids = list(added)
+    for i in range(0, len(subscription_ids), batch_size):
+        chunk = subscription_ids[i:i + batch_size]
+        with transaction.atomic():
+            totals = {
+                subscription_id: (bytes_in, bytes_out)
+                for subscription_id, bytes_in, bytes_out in SubscriptionUsage.objects.filter(
+                    subscription_id__in=chunk
+                ).select_for_update().values_list('subscription_id', 'bytes_in', 'bytes_out')
+            }
+            SubscriptionUsage.objects.bulk_create([
+                SubscriptionUsage(
+                    subscription_id=subscription_id,
+                    bytes_in=totals.get(subscription_id, (0, 0))[0] + added[subscription_id][0],
+                    bytes_out=totals.get(subscription_id, (0, 0))[1] + added[subscription_id][1],
+                    last_seen=now,
+                )
+                for subscription_id in chunk
+            ], update_conflicts=True, unique_fields=unique_fields, update_fields=['bytes_in', 'bytes_out', 'last_seen', 'updated_at'])
+    return {subscription_id: tuple(value) for subscription_id, value in added.items()}
+
+
+class UsageCollector:
+    """Polls every API-managed router in parallel and turns counter snapshots into usage.
+
+    The previous snapshot of each router is kept in memory, so this has to
+    live in one long-running process (manage.py run_usage_collector). The
+    first poll of a router after start-up only records a baseline; a router
+    that fails a poll or is skipped for an open circuit keeps its old
+    snapshot, so its next successful poll covers the gap. Poll outcomes feed
+    the same health registry (and circuit breaker) as routeros.router_api.
+    """
+
+    def __init__(self, concurrency=100, timeout=15, batch_size=1000):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.snapshots = {}
+
+    def routers(self):
+        """Return (routers to poll, ids of all API-managed routers).
+
+        Routers that routeros.ensure_available() rejects (open circuit, VPN
+        tunnel down) are skipped.
+        """
+        routers = list(Router.objects.exclude(connection_type='RADIUS'))
+        available = []
+        for router in routers:
+            try:
+                ensure_available(router)
+            except RouterConnectionError as e:
+                logger.debug(f"Not polling {router.name}: {e}")
+                continue
+            available.append(router)
+        return available, {router.id for router in routers}
+
+    def poll(self, routers):
+        return asyncio.run(run_on_routers(routers, read_counters, concurrency=self.concurrency, timeout=self.timeout))
+
+    def collect(self):
+        """Run one polling cycle; returns stats including per-router timings."""
+        started = time.monotonic()
+        routers, known = self.routers()
+        results = self.poll(routers) if routers else {}
+        polled_at = timezone.now()
+        stats = {
+            'routers': len(routers), 'failed': 0, 'skipped': len(known) - len(routers), 'sessions': 0,
+            'subscriptions': 0, 'bytes': 0, 'timings': {},
+        }
+        usage = {}
+        for router in routers:
+            result = results[router.id]
+            stats['timings'][router.name] = result['seconds']
+            if result['unreachable']:
+                health.record_failure(router, result['error'])
+            else:
+                health.record_success(router, result['seconds'])
+            if result['error']:
+                stats['failed'] += 1
+                continue
+            counters, online = result['result']
+            stats['sessions'] += online
+            previous = self.snapshots.get(router.id)
+            self.snapshots[router.id] = counters
+            if previous is None:
+                continue
+            for username, value in deltas(previous, counters).items():
+                usage[(router.id, username)] = value
+        for router_id in set(self.snapshots) - known:
+            del self.snapshots[router_id]
+
+        added = record_usage(usage, polled_at, self.batch_size)
+        timeseries.add(added, polled_at, self.batch_size)
+        stats['subscriptions'] = len(added)
+        stats['bytes'] = sum(bytes_in + bytes_out for bytes_in, bytes_out in added.values())
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        slowest = sorted(stats['timings'].items(), key=lambda item: item[1], reverse=True)[:5]
+        logger.info(
+            f"Usage collected from {stats['routers']} routers ({stats['failed']} failed) in {stats['seconds']}s: "
+            f"{stats['bytes']} bytes for {stats['subscriptions']} subscriptions; slowest {slowest}"
+        )
+        return stats
+
+    def run_forever(self, interval):
+        while True:
+            started = time.monotonic()
+            close_old_connections()
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"Usage collection failed: {e}")
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def build_collector():
+    return UsageCollector(
+        concurrency=settings.USAGE_POLL_CONCURRENCY,
+        timeout=settings.USAGE_POLL_TIMEOUT,
+        batch_size=settings.USAGE_WRITE_BATCH_SIZE,
+    )
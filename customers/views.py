@@ -1,13 +1,18 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
 from django.contrib.auth.decorators import user_passes_test
+from django.http import JsonResponse
 from django.db.models import Sum, Count
 from django.db.models.functions import TruncDate, TruncMonth
-from datetime import timedelta, datetime
-from .models import Customer, Package, Subscription, Invoice, SupportTicket, Voucher, Compensation, AuditLog
+from datetime import timedelta
+from .models import Customer, Package, Subscription, Invoice, SupportTicket, Voucher, Compensation, ProvisioningJob
 from .utils import send_sms, send_email
+from . import provisioning
+from . import coalesce
+from . import audit
 from payments.models import Payment
 from plugins.models import PluginConfig
 from plugins.base import PaymentPlugin
@@ -17,10 +22,6 @@ from rest_framework.response import Response
 from rest_framework import serializers
 import json
 import logging
-import routeros_api
-import MySQLdb
-import subprocess
-import os
 
 logger = logging.getLogger(__name__)
 
@@ -37,83 +38,21 @@ def hotspot_plans_api(request):
     serializer = PackageSerializer(packages, many=True)
     return Response(serializer.data)
 
-def connect_to_router(router):
-    """Utility to connect to MikroTik router via API, VPN, or RADIUS."""
-    if router.connection_type == 'API':
-        return routeros_api.RouterOsApiPool(
-            router.ip_address, username=router.username,
-            password=router.password, port=router.api_port
-        ).get_api()
-    elif router.connection_type == 'VPN':
-        try:
-            if router.vpn_protocol == 'L2TP':
-                logger.info(f"Connecting to router {router.name} via L2TP")
-                return routeros_api.RouterOsApiPool(
-                    router.ip_address, username=router.username,
-                    password=router.password, port=router.api_port
-                ).get_api()
-            elif router.vpn_protocol == 'OPENVPN':
-                vpn_dir = os.path.join(os.getcwd(), 'vpn_configs')
-                os.makedirs(vpn_dir, exist_ok=True)
-                cred_file = os.path.join(vpn_dir, f"{router.id}.txt")
-                with open(cred_file, 'w') as f:
-                    f.write(f"{router.vpn_username}\n{router.vpn_password}")
-                ovpn_file = os.path.join(vpn_dir, f"{router.id}.ovpn")
-                with open(ovpn_file, 'w') as f:
-                    f.write(f"# OpenVPN config for {router.name}\n")
-                    f.write(f"client\n")
-                    f.write(f"dev tun\n")
-                    f.write(f"proto tcp\n")
-                    f.write(f"remote {router.vpn_server} 1194\n")
-                    f.write(f"auth-user-pass {cred_file}\n")
-                subprocess.run([
-                    'openvpn', '--config', ovpn_file,
-                    '--auth-user-pass', cred_file,
-                    '--daemon'
-                ], check=True)
-                logger.info(f"Started OpenVPN for router {router.name}")
-                return routeros_api.RouterOsApiPool(
-                    router.ip_address, username=router.username,
-                    password=router.password, port=router.api_port
-                ).get_api()
-            elif router.vpn_protocol == 'WIREGUARD':
-                wg_dir = os.path.join(os.getcwd(), 'wg_configs')
-                os.makedirs(wg_dir, exist_ok=True)
-                wg_conf = os.path.join(wg_dir, f"wg_{router.id}.conf")
-                with open(wg_conf, 'w') as f:
-                    f.write(f"[Interface]\n")
-                    f.write(f"PrivateKey = {router.vpn_wg_private_key}\n")
-                    f.write(f"Address = 10.0.0.2/24\n")
-                    f.write(f"[Peer]\n")
-                    f.write(f"PublicKey = {router.vpn_wg_public_key}\n")
-                    f.write(f"Endpoint = {router.vpn_server}:{router.vpn_wg_endpoint_port}\n")
-                    f.write(f"AllowedIPs = 0.0.0.0/0\n")
-                subprocess.run(['wg-quick', 'up', wg_conf], check=True)
-                logger.info(f"Started WireGuard for router {router.name}")
-                return routeros_api.RouterOsApiPool(
-                    router.ip_address, username=router.username,
-                    password=router.password, port=router.api_port
-                ).get_api()
-            elif router.vpn_protocol == 'PPTP':
-                logger.info(f"Connecting to router {router.name} via PPTP")
-                return routeros_api.RouterOsApiPool(
-                    router.ip_address, username=router.username,
-                    password=router.password, port=router.api_port
-                ).get_api()
-            else:
-                raise ValueError(f"Unsupported VPN protocol: {router.vpn_protocol}")
-        except Exception as e:
-            logger.error(f"VPN connection failed for {router.name}: {e}")
-            raise
-    elif router.connection_type == 'RADIUS':
-        return None
-    raise ValueError(f"Unsupported connection type: {router.connection_type}")
+def provisioning_status_payload(request, job):
+    return {
+        'job': str(job.token),
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('provisioning_status', args=[job.token])),
+    }
 
-def get_rate_limit(package):
-    """Generate MikroTik rate-limit string for bandwidth settings."""
-    if package.download_bandwidth and package.upload_bandwidth:
-        return f"{package.upload_bandwidth}k/{package.download_bandwidth}k"
-    return ""
+def provisioning_status(request, token):
+    """Lightweight poll endpoint for the captive portal: where is this provisioning job?"""
+    job = ProvisioningJob.objects.filter(token=token).values(
+        'status', 'network_status', 'notification_status', 'attempts', 'finished_at'
+    ).first()
+    if job is None:
+        return JsonResponse({'error': 'Provisioning job not found'}, status=404)
+    return JsonResponse(job)
 
 @api_view(['GET', 'POST'])
 def hotspot_pay_api(request):
@@ -171,93 +110,13 @@ def hotspot_pay_api(request):
                     voucher.is_active = False
                     voucher.save()
                     
-                    router = package.router
-                    data_limit_bytes = package.data_limit * 1024 * 1024 if package.data_limit else None
-                    if router.connection_type in ['API', 'VPN']:
-                        try:
-                            api = connect_to_router(router)
-                            if package.connection_type == 'HOTSPOT':
-                                params = {
-                                    'name': username,
-                                    'password': 'user123',
-                                    'profile': package.name,
-                                    'limit-uptime': f"{package.duration_days or 0}d",
-                                    'comment': f"Created={timezone.now():%b/%d/%Y %H:%M:%S} Expire={(timezone.now() + duration):%b/%d/%Y %H:%M:%S}"
-                                }
-                                rate_limit = get_rate_limit(package)
-                                if rate_limit:
-                                    params['rate-limit'] = rate_limit
-                                if data_limit_bytes:
-                                    params['limit-bytes-total'] = str(data_limit_bytes)
-                                api.get_resource('/ip/hotspot/user').add(**params)
-                            elif package.connection_type == 'PPPOE':
-                                api.get_resource('/ppp/secret').add(
-                                    name=username, password='user123', service='pppoe',
-                                    profile=package.name
-                                )
-                            elif package.connection_type == 'STATIC':
-                                api.get_resource('/ip/dhcp-server/lease').add(
-                                    address=package.ip_address or '192.168.1.100',
-                                    mac_address='',
-                                    comment=f"Subscription {username}",
-                                    server='all',
-                                    lease_time=f"{package.duration_days or 30}d"
-                                )
-                            elif package.connection_type == 'VPN':
-                                api.get_resource('/ppp/secret').add(
-                                    name=username, password='user123', service='l2tp',
-                                    profile=package.name
-                                )
-                            logger.info(f"Synced {username} to MikroTik for {package.connection_type}")
-                        except Exception as e:
-                            logger.error(f"Failed to sync {username} to MikroTik: {e}")
-                    elif router.connection_type == 'RADIUS':
-                        try:
-                            db = MySQLdb.connect(
-                                host=router.radius_server, user='radius_user',
-                                passwd=router.radius_secret, db='radius'
-                            )
-                            cursor = db.cursor()
-                            cursor.execute(
-                                "INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                (username, 'Cleartext-Password', ':=', 'user123')
-                            )
-                            if data_limit_bytes:
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Mikrotik-Total-Limit', ':=', str(data_limit_bytes))
-                                )
-                            if package.connection_type == 'STATIC':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Framed-IP-Address', ':=', package.ip_address or '192.168.1.100')
-                                )
-                            elif package.connection_type == 'VPN':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Service-Type', ':=', 'Framed-User')
-                                )
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Framed-Protocol', ':=', 'L2TP')
-                                )
-                            db.commit()
-                            db.close()
-                            logger.info(f"Synced {username} to RADIUS for {package.connection_type}")
-                        except Exception as e:
-                            logger.error(f"Failed to sync {username} to RADIUS: {e}")
-                    
-                    send_sms(customer.phone, f"Voucher redeemed! Username: {subscription.username}, Password: {subscription.password}")
-                    send_email(
-                        customer.email,
-                        f"Voucher Redeemed for {package.name}",
-                        f"Dear {customer.name},\n\nYour voucher has been redeemed. Username: {subscription.username}, Password: {subscription.password}\n\nBest,\n{package.company.name}"
-                    )
+                    job = provisioning.enqueue(subscription, 'VOUCHER')
                     return Response({
                         'status': 'success',
                         'username': subscription.username,
                         'password': subscription.password,
-                        'login_method': package.company.hotspot_login_method
+                        'login_method': package.company.hotspot_login_method,
+                        'provisioning': provisioning_status_payload(request, job)
                     })
                 except Voucher.DoesNotExist:
                     return Response({'error': 'Invalid or already used voucher'}, status=400)
@@ -345,93 +204,15 @@ def hotspot_pay_api(request):
                     payment.invoice.subscription = subscription
                     payment.invoice.save()
                     
-                    router = package.router
-                    data_limit_bytes = package.data_limit * 1024 * 1024 if package.data_limit else None
-                    if router.connection_type in ['API', 'VPN']:
-                        try:
-                            api = connect_to_router(router)
-                            if package.connection_type == 'HOTSPOT':
-                                params = {
-                                    'name': username,
-                                    'password': 'user123',
-                                    'profile': package.name,
-                                    'limit-uptime': f"{package.duration_days or 0}d",
-                                    'comment': f"Created={timezone.now():%b/%d/%Y %H:%M:%S} Expire={(timezone.now() + duration):%b/%d/%Y %H:%M:%S}"
-                                }
-                                rate_limit = get_rate_limit(package)
-                                if rate_limit:
-                                    params['rate-limit'] = rate_limit
-                                if data_limit_bytes:
-                                    params['limit-bytes-total'] = str(data_limit_bytes)
-                                api.get_resource('/ip/hotspot/user').add(**params)
-                            elif package.connection_type == 'PPPOE':
-                                api.get_resource('/ppp/secret').add(
-                                    name=username, password='user123', service='pppoe',
-                                    profile=package.name
-                                )
-                            elif package.connection_type == 'STATIC':
-                                api.get_resource('/ip/dhcp-server/lease').add(
-                                    address=package.ip_address or '192.168.1.100',
-                                    mac_address='',
-                                    comment=f"Subscription {username}",
-                                    server='all',
-                                    lease_time=f"{package.duration_days or 30}d"
-                                )
-                            elif package.connection_type == 'VPN':
-                                api.get_resource('/ppp/secret').add(
-                                    name=username, password='user123', service='l2tp',
-                                    profile=package.name
-                                )
-                            logger.info(f"Synced {username} to MikroTik for {package.connection_type}")
-                        except Exception as e:
-                            logger.error(f"Failed to sync {username} to MikroTik: {e}")
-                    elif router.connection_type == 'RADIUS':
-                        try:
-                            db = MySQLdb.connect(
-                                host=router.radius_server, user='radius_user',
-                                passwd=router.radius_secret, db='radius'
-                            )
-                            cursor = db.cursor()
-                            cursor.execute(
-                                "INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                (username, 'Cleartext-Password', ':=', 'user123')
-                            )
-                            if data_limit_bytes:
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Mikrotik-Total-Limit', ':=', str(data_limit_bytes))
-                                )
-                            if package.connection_type == 'STATIC':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Framed-IP-Address', ':=', package.ip_address or '192.168.1.100')
-                                )
-                            elif package.connection_type == 'VPN':
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Service-Type', ':=', 'Framed-User')
-                                )
-                                cursor.execute(
-                                    "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                                    (username, 'Framed-Protocol', ':=', 'L2TP')
-                                )
-                            db.commit()
-                            db.close()
-                            logger.info(f"Synced {username} to RADIUS for {package.connection_type}")
-                        except Exception as e:
-                            logger.error(f"Failed to sync {username} to RADIUS: {e}")
-                
-                send_sms(payment.customer.phone, f"Payment successful! Username: {subscription.username}, Password: {subscription.password}")
-                send_email(
-                    payment.customer.email,
-                    f"Payment Successful for {subscription.package.name}",
-                    f"Dear {payment.customer.name},\n\nPayment successful! Username: {subscription.username}, Password: {subscription.password}\n\nBest,\n{subscription.package.company.name}"
-                )
+                    job = provisioning.enqueue(subscription, 'PAYMENT')
+                else:
+                    job = subscription.provisioningjob_set.order_by('-id').first()
                 return Response({
                     'status': 'success',
                     'username': subscription.username,
                     'password': subscription.password,
-                    'login_method': subscription.package.company.hotspot_login_method
+                    'login_method': subscription.package.company.hotspot_login_method,
+                    'provisioning': provisioning_status_payload(request, job) if job else None
                 })
             elif payment.status == 'FAILED':
                 return Response({'status': 'failed', 'error': 'Payment failed'})
@@ -606,12 +387,7 @@ def customer_tickets(request):
             status='OPEN',
             is_admin_reply=False
         )
-        AuditLog.objects.create(
-            action='Ticket Created',
-            model='SupportTicket',
-            object_id=ticket.id,
-            user=None,  # Customer action
-        )
+        audit.log('Ticket Created', 'SupportTicket', ticket.id)
         send_sms(customer.phone, f"Support ticket #{ticket.ticket_number} created: {subject}")
         send_email(
             customer.email,
@@ -658,12 +434,7 @@ def customer_ticket_detail(request, ticket_id):
         )
         ticket.status = 'OPEN'
         ticket.save()
-        AuditLog.objects.create(
-            action='Reply Added',
-            model='SupportTicket',
-            object_id=reply.id,
-            user=None,  # Customer action
-        )
+        audit.log('Reply Added', 'SupportTicket', reply.id)
         send_sms(customer.phone, f"Reply added to ticket #{ticket.ticket_number}: {ticket.subject}")
         send_email(
             customer.email,
@@ -773,88 +544,7 @@ def redeem_voucher(request):
             voucher.is_active = False
             voucher.save()
             
-            router = package.router
-            data_limit_bytes = package.data_limit * 1024 * 1024 if package.data_limit else None
-            if router.connection_type in ['API', 'VPN']:
-                try:
-                    api = connect_to_router(router)
-                    if package.connection_type == 'HOTSPOT':
-                        params = {
-                            'name': username,
-                            'password': 'user123',
-                            'profile': package.name,
-                            'limit-uptime': f"{package.duration_days or 0}d",
-                            'comment': f"Created={timezone.now():%b/%d/%Y %H:%M:%S} Expire={(timezone.now() + duration):%b/%d/%Y %H:%M:%S}"
-                        }
-                        rate_limit = get_rate_limit(package)
-                        if rate_limit:
-                            params['rate-limit'] = rate_limit
-                        if data_limit_bytes:
-                            params['limit-bytes-total'] = str(data_limit_bytes)
-                        api.get_resource('/ip/hotspot/user').add(**params)
-                    elif package.connection_type == 'PPPOE':
-                        api.get_resource('/ppp/secret').add(
-                            name=username, password='user123', service='pppoe',
-                            profile=package.name
-                        )
-                    elif package.connection_type == 'STATIC':
-                        api.get_resource('/ip/dhcp-server/lease').add(
-                            address=package.ip_address or '192.168.1.100',
-                            mac_address='',
-                            comment=f"Subscription {username}",
-                            server='all',
-                            lease_time=f"{package.duration_days or 30}d"
-                        )
-                    elif package.connection_type == 'VPN':
-                        api.get_resource('/ppp/secret').add(
-                            name=username, password='user123', service='l2tp',
-                            profile=package.name
-                        )
-                    logger.info(f"Synced {username} to MikroTik for {package.connection_type}")
-                except Exception as e:
-                    logger.error(f"Failed to sync {username} to MikroTik: {e}")
-            elif router.connection_type == 'RADIUS':
-                try:
-                    db = MySQLdb.connect(
-                        host=router.radius_server, user='radius_user',
-                        passwd=router.radius_secret, db='radius'
-                    )
-                    cursor = db.cursor()
-                    cursor.execute(
-                        "INSERT INTO radcheck (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                        (username, 'Cleartext-Password', ':=', 'user123')
-                    )
-                    if data_limit_bytes:
-                        cursor.execute(
-                            "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                        (username, 'Mikrotik-Total-Limit', ':=', str(data_limit_bytes))
-                    )
-                    if package.connection_type == 'STATIC':
-                        cursor.execute(
-                            "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                            (username, 'Framed-IP-Address', ':=', package.ip_address or '192.168.1.100')
-                        )
-                    elif package.connection_type == 'VPN':
-                        cursor.execute(
-                            "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                            (username, 'Service-Type', ':=', 'Framed-User')
-                        )
-                        cursor.execute(
-                            "INSERT INTO radreply (username, attribute, op, value) VALUES (%s, %s, %s, %s)",
-                            (username, 'Framed-Protocol', ':=', 'L2TP')
-                        )
-                    db.commit()
-                    db.close()
-                    logger.info(f"Synced {username} to RADIUS for {package.connection_type}")
-                except Exception as e:
-                    logger.error(f"Failed to sync {username} to RADIUS: {e}")
-            
-            send_sms(customer.phone, f"Voucher redeemed! Username: {subscription.username}, Password: {subscription.password}")
-            send_email(
-                customer.email,
-                f"Voucher Redeemed for {package.name}",
-                f"Dear {customer.name},\n\nYour voucher has been redeemed. Username: {subscription.username}, Password: {subscription.password}\n\nBest,\n{package.company.name}"
-            )
+            provisioning.enqueue(subscription, 'VOUCHER')
             messages.success(request, 'Voucher redeemed successfully.')
             return redirect('customer_dashboard')
         except Voucher.DoesNotExist:
@@ -923,6 +613,16 @@ def monthly_sales_report(request):
         'sales': sales,
     })
 
+@user_passes_test(lambda u: u.is_staff)
+def sync_metrics(request):
+    """Coalescing and lock counters for the sync tasks."""
+    from .tasks import sync_subscriptions_to_routers, sync_subscriptions_to_radius, sync_subscription_changes
+    return JsonResponse(coalesce.metrics([
+        sync_subscriptions_to_routers.name,
+        sync_subscriptions_to_radius.name,
+        sync_subscription_changes.name,
+    ]))
+
 def hotspot_login(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -0,0 +1,352 @@
+import os
+import time
+import ipaddress
+import signal
+import logging
+import subprocess
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from .models import Router
+from .routeros import RouterConnectionError
+
+logger = logging.getLogger(__name__)
+
+TunnelHandle = namedtuple('TunnelHandle', ['router_id', 'protocol', 'interface', 'since'])
+
+
+class VpnTunnelError(RouterConnectionError):
+    """Raised when a VPN router's tunnel is not up."""
+
+
+def _status_key(router_id):
+    return f"vpn-tunnel:{router_id}"
+
+
+def _write_private(path, content):
+    """Write ``content`` to ``path`` readable by the owner only; returns True if it changed."""
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    return True
+
+
+def wireguard_address(router):
+    """This side's tunnel address for ``router``: one host of VPN_WG_ADDRESS_POOL per router id.
+
+    Router 1 gets the pool's second address (10.0.0.2 in the default pool),
+    router 2 the third, and so on; the router's peer entry must allow it.
+    """
+    pool = ipaddress.ip_network(settings.VPN_WG_ADDRESS_POOL)
+    if router.id + 1 >= pool.num_addresses - 1:
+        raise VpnTunnelError(f"VPN_WG_ADDRESS_POOL {pool} has no address left for router {router.name} (id {router.id})")
+    return pool[router.id + 1]
+
+
+class Tunnel:
+    """One tunnel to a VPN router. Subclasses start, stop and health-check it."""
+
+    def __init__(self, router, config_dir):
+        self.router_id = router.id
+        self.protocol = router.vpn_protocol
+        self.name = router.name
+        self.version = router.updated_at
+        self.config_dir = config_dir
+        self.interface = None
+
+    def start(self):
+        """Begin bringing the tunnel up; ``ready()`` reports when it is usable."""
+
+    def ready(self):
+        return True
+
+    def alive(self):
+        return True
+
+    def stop(self):
+        pass
+
+
+class PassthroughTunnel(Tunnel):
+    """L2TP/PPTP routers: the router dials in, so there is nothing to run locally."""
+
+
+class OpenVpnTunnel(Tunnel):
+    """A foreground openvpn child process; OpenVPN's own keepalive handles short outages."""
+
+    def __init__(self, router, config_dir):
+        super().__init__(router, config_dir)
+        self.process = None
+        self.log_path = os.path.join(config_dir, f"{router.id}.log")
+        self.cred_file = os.path.join(config_dir, f"{router.id}.txt")
+        self.config_file = os.path.join(config_dir, f"{router.id}.ovpn")
+        self.interface = f"tun{router.id}"
+        _write_private(self.cred_file, f"{router.vpn_username}\n{router.vpn_password}")
+        _write_private(self.config_file, (
+            f"# OpenVPN config for {router.name}\n"
+            f"client\n"
+            f"dev {self.interface}\n"
+            f"dev-type tun\n"
+            f"proto tcp\n"
+            f"remote {router.vpn_server} 1194\n"
+            f"auth-user-pass {self.cred_file}\n"
+            f"keepalive 10 60\n"
+            f"persist-tun\n"
+        ))
+
+    def start(self):
+        open(self.log_path, 'w').close()
+        self.process = subprocess.Popen(
+            ['openvpn', '--config', self.config_file, '--log', self.log_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+
+    def ready(self):
+        try:
+            with open(self.log_path, errors='replace') as f:
+                return 'Initialization Sequence Completed' in f.read()
+        except FileNotFoundError:
+            return False
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+
+class WireGuardTunnel(Tunnel):
+    """A wg-quick interface, considered dead once its last handshake is too old."""
+
+    def __init__(self, router, config_dir):
+        super().__init__(router, config_dir)
+        self.interface = f"wg{router.id}"
+        self.config_file = os.path.join(config_dir, f"{self.interface}.conf")
+        self.started_at = None
+        # Only the router's address goes through the tunnel and each router
+        # gets its own /32, so several WireGuard routers can be up at once
+        # without fighting over routes or addresses.
+        _write_private(self.config_file, (
+            f"[Interface]\n"
+            f"PrivateKey = {router.vpn_wg_private_key}\n"
+            f"Address = {wireguard_address(router)}/32\n"
+            f"[Peer]\n"
+            f"PublicKey = {router.vpn_wg_public_key}\n"
+            f"Endpoint = {router.vpn_server}:{router.vpn_wg_endpoint_port}\n"
+            f"AllowedIPs = {router.ip_address}/32\n"
+            f"PersistentKeepalive = 25\n"
+        ))
+
+    def start(self):
+        subprocess.run(['wg-quick', 'down', self.config_file], capture_output=True)
+        subprocess.run(['wg-quick', 'up', self.config_file], check=True, capture_output=True, timeout=30)
+        self.started_at = time.time()
+
+    def _last_handshake(self):
+        result = subprocess.run(
+            ['wg', 'show', self.interface, 'latest-handshakes'], capture_output=True, text=True, timeout=10
+        )
+        if result.returncode != 0:
+            return None
+        handshakes = [int(line.split()[1]) for line in result.stdout.splitlines() if len(line.split()) == 2]
+        return max(handshakes, default=0)
+
+    def ready(self):
+        return bool(self._last_handshake())
+
+    def alive(self):
+        handshake = self._last_handshake()
+        if handshake is None:
+            return False
+        newest = max(handshake, self.started_at or 0)
+        return time.time() - newest < settings.VPN_WG_HANDSHAKE_TIMEOUT
+
+    def stop(self):
+        subprocess.run(['wg-quick', 'down', self.config_file], capture_output=True)
+
+
+TUNNEL_TYPES = {
+    'OPENVPN': OpenVpnTunnel,
+    'WIREGUARD': WireGuardTunnel,
+    'L2TP': PassthroughTunnel,
+    'PPTP': PassthroughTunnel,
+}
+
+
+class _Entry:
+    __slots__ = ('tunnel', 'state', 'since', 'deadline', 'failures', 'retry_at', 'error')
+
+    def __init__(self, tunnel):
+        self.tunnel = tunnel
+        self.state = 'down'
+        self.since = None
+        self.deadline = None
+        self.failures = 0
+        self.retry_at = 0
+        self.error = ''
+
+
+class TunnelSupervisor:
+    """Keeps one tunnel up per VPN router.
+
+    Tunnels are started once and reused; every ``check_interval`` seconds each
+    one is checked and dead or stuck tunnels are restarted with exponential
+    backoff. The router list is re-read every ``refresh_interval`` seconds so
+    new, edited and deleted routers are picked up. Tunnel state is published
+    to the shared cache, where tunnel_for() reads it.
+    """
+
+    def __init__(self, config_dir, check_interval=10, refresh_interval=60, connect_timeout=30, max_backoff=300):
+        self.config_dir = config_dir
+        self.check_interval = check_interval
+        self.refresh_interval = refresh_interval
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+        self.entries = {}
+        self.refreshed_at = None
+
+    def refresh(self):
+        """Start tunnels for new routers, restart edited ones and stop removed ones."""
+        os.makedirs(self.config_dir, mode=0o700, exist_ok=True)
+        routers = {router.id: router for router in Router.objects.filter(connection_type='VPN')}
+        for router_id in set(self.entries) - set(routers):
+            self._remove(router_id)
+        for router_id, router in routers.items():
+            entry = self.entries.get(router_id)
+            if entry and entry.tunnel.version == router.updated_at:
+                continue
+            if entry:
+                logger.info(f"Router {router.name} changed, restarting its VPN tunnel")
+                self._remove(router_id)
+            tunnel_type = TUNNEL_TYPES.get(router.vpn_protocol)
+            if tunnel_type is None:
+                logger.error(f"Unsupported VPN protocol for {router.name}: {router.vpn_protocol}")
+                continue
+            try:
+                self.entries[router_id] = _Entry(tunnel_type(router, self.config_dir))
+            except VpnTunnelError as e:
+                logger.error(f"Cannot set up the VPN tunnel for {router.name}: {e}")
+        self.refreshed_at = time.monotonic()
+
+    def _remove(self, router_id):
+        entry = self.entries.pop(router_id)
+        entry.tunnel.stop()
+        cache.delete(_status_key(router_id))
+
+    def _start(self, entry, now):
+        try:
+            entry.tunnel.start()
+            entry.state = 'starting'
+            entry.deadline = now + self.connect_timeout
+            logger.info(f"Starting {entry.tunnel.protocol} tunnel for {entry.tunnel.name}")
+        except Exception as e:
+            self._failed(entry, now, f"start failed: {e}")
+
+    def _failed(self, entry, now, error):
+        entry.tunnel.stop()
+        entry.state = 'down'
+        entry.since = None
+        entry.failures += 1
+        entry.error = error
+        backoff = min(self.max_backoff, 2 ** entry.failures)
+        entry.retry_at = now + backoff
+        logger.warning(f"VPN tunnel for {entry.tunnel.name} down ({error}); retrying in {backoff}s")
+
+    def check(self):
+        """Advance every tunnel one step: start, confirm, health-check or schedule a retry."""
+        now = time.monotonic()
+        for entry in self.entries.values():
+            try:
+                if entry.state == 'down' and now >= entry.retry_at:
+                    self._start(entry, now)
+                if entry.state == 'starting':
+                    if entry.tunnel.ready():
+                        entry.state, entry.since, entry.failures, entry.error = 'up', time.time(), 0, ''
+                        logger.info(f"VPN tunnel for {entry.tunnel.name} is up")
+                    elif not entry.tunnel.alive():
+                        self._failed(entry, now, 'tunnel process exited')
+                    elif now >= entry.deadline:
+                        self._failed(entry, now, f"not ready after {self.connect_timeout}s")
+                elif entry.state == 'up' and not entry.tunnel.alive():
+                    self._failed(entry, now, 'liveness check failed')
+            except Exception as e:
+                self._failed(entry, now, str(e))
+        self.publish()
+
+    def publish(self):
+        timeout = self.check_interval * 3 + 30
+        cache.set_many({
+            _status_key(router_id): {
+                'state': entry.state,
+                'protocol': entry.tunnel.protocol,
+                'interface': entry.tunnel.interface,
+                'since': entry.since,
+                'failures': entry.failures,
+                'error': entry.error,
+            }
+            for router_id, entry in self.entries.items()
+        }, timeout=timeout)
+
+    def run_once(self):
+        close_old_connections()
+        if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            self.refresh()
+        self.check()
+
+    def run_forever(self):
+        try:
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error(f"VPN supervisor iteration failed: {e}")
+                time.sleep(self.check_interval)
+        finally:
+            self.stop_all()
+
+    def stop_all(self):
+        for router_id in list(self.entries):
+            self._remove(router_id)
+
+
+def build_supervisor():
+    return TunnelSupervisor(
+        config_dir=settings.VPN_CONFIG_DIR,
+        check_interval=settings.VPN_CHECK_INTERVAL,
+        refresh_interval=settings.VPN_REFRESH_INTERVAL,
+        connect_timeout=settings.VPN_CONNECT_TIMEOUT,
+        max_backoff=settings.VPN_MAX_BACKOFF,
+    )
+
+
+def tunnel_status(router_id):
+    return cache.get(_status_key(router_id))
+
+
+def tunnel_for(router):
+    """Return a TunnelHandle for ``router``'s running tunnel or raise VpnTunnelError.
+
+    Never starts anything itself: tunnels are owned by the run_vpn_supervisor process.
+    """
+    status = tunnel_status(router.id)
+    if status is None:
+        raise VpnTunnelError(f"No VPN tunnel for {router.name}; is run_vpn_supervisor running?")
+    if status['state'] != 'up':
+        raise VpnTunnelError(f"VPN tunnel for {router.name} is {status['state']}: {status['error']}")
+    return TunnelHandle(router.id, status['protocol'], status['interface'], status['since'])
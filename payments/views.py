@@ -6,7 +6,8 @@ from django.utils import timezone
 from django.core.files.storage import FileSystemStorage
 from .models import Payment
 from customers.models import Invoice, Subscription, Customer, Package, Voucher
-from customers.tasks import sync_subscriptions_to_routers, sync_subscriptions_to_radius
+from customers.tasks import sync_subscription_changes
+from customers.coalesce import trigger
 from .mpesa import initiate_stk_push
 import json
 import logging
@@ -68,8 +69,7 @@ def mpesa_callback(request):
                     )
                     invoice.subscription = subscription
                     invoice.save()
-                    sync_subscriptions_to_routers.delay()
-                    sync_subscriptions_to_radius.delay()
+                    trigger(sync_subscription_changes)
                     logger.info(f"Hotspot subscription created for customer {customer.id}, username: {username}")
             
             payment.save()
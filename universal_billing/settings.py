@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'customers.middleware.AuditFlushMiddleware',  # outermost after CORS, so it flushes after every other middleware
     #'companies.middleware.SimpleTenantMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -172,6 +173,170 @@ CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', 'redis://localhost:6379/
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    # Targeted syncs of changed subscriptions; callers also trigger this directly.
+    'sync-subscription-changes': {
+        'task': 'customers.tasks.sync_subscription_changes',
+        'schedule': 60.0,
+    },
+    # Keeps the outbox small once its rows are processed.
+    'prune-subscription-changes': {
+        'task': 'customers.tasks.prune_subscription_changes',
+        'schedule': 24 * 60 * 60.0,
+    },
+    # Full syncs only repair drift now.
+    'repair-router-sync': {
+        'task': 'customers.tasks.sync_subscriptions_to_routers',
+        'schedule': 6 * 60 * 60.0,
+    },
+    # Runs in RADIUS_SYNC_MODE ('swap' rebuilds through shadow tables, MySQL only).
+    'repair-radius-sync': {
+        'task': 'customers.tasks.sync_subscriptions_to_radius',
+        'schedule': 24 * 60 * 60.0,
+    },
+    # Failed per-subscription operations, retried with backoff.
+    'process-sync-retries': {
+        'task': 'customers.tasks.process_sync_retries',
+        'schedule': 10.0,
+    },
+    # Tails radacct into SessionLog.
+    'ingest-radius-accounting': {
+        'task': 'customers.tasks.ingest_radius_accounting',
+        'schedule': 30.0,
+    },
+    # Warns and suspends subscribers over their package's data limit.
+    'enforce-data-caps': {
+        'task': 'customers.tasks.enforce_data_caps',
+        'schedule': 5 * 60.0,
+    },
+    # Keeps SessionLog small by moving old sessions to gzip'd NDJSON.
+    'archive-session-logs': {
+        'task': 'customers.tasks.archive_session_logs',
+        'schedule': 24 * 60 * 60.0,
+    },
+    # Drops usage buckets past their retention.
+    'prune-usage-series': {
+        'task': 'customers.tasks.prune_usage_series',
+        'schedule': 24 * 60 * 60.0,
+    },
+    # Closes router circuits once the router answers again.
+    'probe-router-health': {
+        'task': 'customers.tasks.probe_router_health',
+        'schedule': 30.0,
+    },
+    # Backstop sweep; the run_expiry_scheduler process disables users on time.
+    'disable-expired-subscriptions': {
+        'task': 'customers.tasks.disable_expired_subscriptions',
+        'schedule': 15 * 60.0,
+    },
+}
+
+# Shared cache (coalesced sync triggers, sync locks and metrics need it to be shared across workers)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
+# Buffered AuditLog writes (customers.audit)
+AUDIT_BUFFER_SIZE = config('AUDIT_BUFFER_SIZE', 500, cast=int)  # entries that force a flush
+AUDIT_FLUSH_INTERVAL = config('AUDIT_FLUSH_INTERVAL', 5, cast=float)  # seconds the oldest entry may wait; requests and tasks also flush when they end
+
+# Sync trigger coalescing
+SYNC_COALESCE_WINDOW = config('SYNC_COALESCE_WINDOW', 10, cast=int)  # seconds; triggers within the window share one run
+SYNC_COALESCE_PENDING_GRACE = 30  # seconds a pending marker outlives its window if the worker is slow to pick it up
+SYNC_LOCK_TIMEOUT = config('SYNC_LOCK_TIMEOUT', 3600, cast=int)  # seconds; upper bound on one sync run
+SUBSCRIPTION_CHANGE_RETENTION_DAYS = config('SUBSCRIPTION_CHANGE_RETENTION_DAYS', 7, cast=int)  # processed outbox rows are kept this long
+
+# MikroTik RouterOS API connection pool
+ROUTEROS_POOL_MAX_CONNECTIONS = config('ROUTEROS_POOL_MAX_CONNECTIONS', 4, cast=int)  # per router
+ROUTEROS_POOL_IDLE_TIMEOUT = config('ROUTEROS_POOL_IDLE_TIMEOUT', 300, cast=int)  # seconds
+ROUTEROS_POOL_HEALTH_CHECK_INTERVAL = config('ROUTEROS_POOL_HEALTH_CHECK_INTERVAL', 30, cast=int)  # seconds idle before re-checking
+ROUTEROS_POOL_ACQUIRE_TIMEOUT = config('ROUTEROS_POOL_ACQUIRE_TIMEOUT', 30, cast=int)  # seconds
+ROUTEROS_SOCKET_TIMEOUT = config('ROUTEROS_SOCKET_TIMEOUT', 15, cast=int)  # seconds
+ROUTEROS_PLAINTEXT_LOGIN = config('ROUTEROS_PLAINTEXT_LOGIN', True, cast=bool)  # RouterOS 6.43+
+
+# Router health registry / circuit breaker
+ROUTER_CIRCUIT_FAILURE_THRESHOLD = config('ROUTER_CIRCUIT_FAILURE_THRESHOLD', 3, cast=int)  # consecutive failures that open the circuit
+ROUTER_CIRCUIT_PROBE_INTERVAL = config('ROUTER_CIRCUIT_PROBE_INTERVAL', 30, cast=int)  # seconds before the first probe
+ROUTER_CIRCUIT_MAX_PROBE_INTERVAL = config('ROUTER_CIRCUIT_MAX_PROBE_INTERVAL', 600, cast=int)  # cap on probe backoff
+ROUTER_CIRCUIT_PROBE_TIMEOUT = config('ROUTER_CIRCUIT_PROBE_TIMEOUT', 5, cast=int)  # seconds
+ROUTER_HEALTH_TTL = 7 * 24 * 60 * 60  # seconds a health record is kept without updates
+
+# Failed-sync retry queue (SyncRetry)
+SYNC_RETRY_BASE_DELAY = config('SYNC_RETRY_BASE_DELAY', 5, cast=int)  # seconds before the first retry, doubled per attempt
+SYNC_RETRY_MAX_DELAY = config('SYNC_RETRY_MAX_DELAY', 3600, cast=int)  # cap on seconds between attempts
+SYNC_RETRY_MAX_ATTEMPTS = config('SYNC_RETRY_MAX_ATTEMPTS', 10, cast=int)  # then dead-lettered
+SYNC_RETRY_BATCH_SIZE = config('SYNC_RETRY_BATCH_SIZE', 2000, cast=int)  # due retries read per pass
+SYNC_RETRY_PER_ROUTER_LIMIT = config('SYNC_RETRY_PER_ROUTER_LIMIT', 200, cast=int)  # retries sent to one router per pass
+
+# VPN tunnel supervisor (manage.py run_vpn_supervisor keeps one tunnel up per VPN router)
+VPN_CONFIG_DIR = config('VPN_CONFIG_DIR', str(BASE_DIR / 'vpn_configs'))  # tunnel configs and credentials (mode 0600)
+VPN_CHECK_INTERVAL = config('VPN_CHECK_INTERVAL', 10, cast=int)  # seconds between liveness checks
+VPN_REFRESH_INTERVAL = config('VPN_REFRESH_INTERVAL', 60, cast=int)  # seconds between router list reloads
+VPN_CONNECT_TIMEOUT = config('VPN_CONNECT_TIMEOUT', 30, cast=int)  # seconds a tunnel may take to come up
+VPN_MAX_BACKOFF = config('VPN_MAX_BACKOFF', 300, cast=int)  # cap on seconds between reconnect attempts
+VPN_WG_HANDSHAKE_TIMEOUT = config('VPN_WG_HANDSHAKE_TIMEOUT', 180, cast=int)  # WireGuard tunnel is dead after this long without a handshake
+VPN_WG_ADDRESS_POOL = config('VPN_WG_ADDRESS_POOL', '10.0.0.0/16')  # WireGuard tunnel addresses on this side, one per router id
+
+# Expiry scheduler (manage.py run_expiry_scheduler)
+EXPIRY_SCHEDULER_HORIZON = config('EXPIRY_SCHEDULER_HORIZON', 3600, cast=int)  # seconds of deadlines kept in memory
+EXPIRY_SCHEDULER_POLL_INTERVAL = config('EXPIRY_SCHEDULER_POLL_INTERVAL', 5, cast=int)  # seconds between outbox polls
+EXPIRY_SCHEDULER_BATCH_SIZE = config('EXPIRY_SCHEDULER_BATCH_SIZE', 500, cast=int)  # subscriptions expired per pass
+EXPIRY_SCHEDULER_GAP_TIMEOUT = config('EXPIRY_SCHEDULER_GAP_TIMEOUT', 60, cast=int)  # seconds an outbox id skipped by the tail is re-read
+
+# FreeRADIUS database (routers with radius_server/radius_secret override host and password)
+RADIUS_DB_HOST = config('RADIUS_DB_HOST', 'localhost')
+RADIUS_DB_PORT = config('RADIUS_DB_PORT', 3306, cast=int)
+RADIUS_DB_USER = config('RADIUS_DB_USER', 'radius_user')
+RADIUS_DB_PASSWORD = config('RADIUS_DB_PASSWORD', 'radius_pass')
+RADIUS_DB_NAME = config('RADIUS_DB_NAME', 'radius')
+RADIUS_DB_CONNECT_TIMEOUT = config('RADIUS_DB_CONNECT_TIMEOUT', 5, cast=int)  # seconds
+RADIUS_DB_QUERY_TIMEOUT = config('RADIUS_DB_QUERY_TIMEOUT', 30, cast=int)  # seconds per read/write
+RADIUS_POOL_MAX_CONNECTIONS = config('RADIUS_POOL_MAX_CONNECTIONS', 4, cast=int)  # per server
+RADIUS_POOL_IDLE_TIMEOUT = config('RADIUS_POOL_IDLE_TIMEOUT', 300, cast=int)  # seconds
+RADIUS_POOL_HEALTH_CHECK_INTERVAL = config('RADIUS_POOL_HEALTH_CHECK_INTERVAL', 30, cast=int)  # seconds idle before pinging
+RADIUS_POOL_ACQUIRE_TIMEOUT = config('RADIUS_POOL_ACQUIRE_TIMEOUT', 10, cast=int)  # seconds
+
+# FreeRADIUS accounting ingestion (radacct -> SessionLog)
+RADIUS_DB_TIMEZONE = config('RADIUS_DB_TIMEZONE', 'UTC')  # timezone of radacct's naive DATETIME columns
+RADIUS_ACCT_BATCH_SIZE = config('RADIUS_ACCT_BATCH_SIZE', 5000, cast=int)  # radacct rows read per query
+RADIUS_ACCT_WRITE_BATCH_SIZE = config('RADIUS_ACCT_WRITE_BATCH_SIZE', 1000, cast=int)  # SessionLog rows per upsert
+RADIUS_ACCT_MAX_BATCHES = config('RADIUS_ACCT_MAX_BATCHES', 50, cast=int)  # per run, so catching up never blocks a worker for long
+RADIUS_ACCT_INDEX_TTL = config('RADIUS_ACCT_INDEX_TTL', 300, cast=int)  # seconds the username -> subscription index is trusted
+RADIUS_ACCT_UNMATCHED_GRACE = config('RADIUS_ACCT_UNMATCHED_GRACE', 600, cast=int)  # seconds after a session starts that an unknown username holds the cursor
+
+# Live usage collector (manage.py run_usage_collector)
+USAGE_POLL_INTERVAL = config('USAGE_POLL_INTERVAL', 60, cast=int)  # seconds between polls of every router
+USAGE_POLL_CONCURRENCY = config('USAGE_POLL_CONCURRENCY', 100, cast=int)  # routers polled at once
+USAGE_POLL_TIMEOUT = config('USAGE_POLL_TIMEOUT', 15, cast=int)  # seconds per router command
+USAGE_WRITE_BATCH_SIZE = config('USAGE_WRITE_BATCH_SIZE', 1000, cast=int)  # SubscriptionUsage rows per upsert
+
+# Usage time series (UsageBlock); every sample is kept at 5-minute, hourly and daily resolution
+USAGE_SERIES_RETENTION_5M = config('USAGE_SERIES_RETENTION_5M', 7, cast=int)  # days
+USAGE_SERIES_RETENTION_HOURLY = config('USAGE_SERIES_RETENTION_HOURLY', 90, cast=int)  # days
+USAGE_SERIES_RETENTION_DAILY = config('USAGE_SERIES_RETENTION_DAILY', 730, cast=int)  # days
+
+# Data-cap enforcement (Package.data_limit)
+DATA_CAP_WARNING_PERCENT = config('DATA_CAP_WARNING_PERCENT', 80, cast=int)  # usage that triggers a warning SMS
+DATA_CAP_ACTION = config('DATA_CAP_ACTION', 'disable')  # at 100%: 'disable' suspends the subscription, 'notify' only sends the SMS
+DATA_CAP_NOTICE_BATCH_SIZE = config('DATA_CAP_NOTICE_BATCH_SIZE', 500, cast=int)  # subscribers per notice task
+
+# SessionLog archive (manage.py archive_sessions; read back with customers.archive.read_sessions)
+SESSION_ARCHIVE_DIR = config('SESSION_ARCHIVE_DIR', str(BASE_DIR / 'session_archive'))  # date-partitioned gzip'd NDJSON plus manifest.json
+SESSION_ARCHIVE_AFTER_DAYS = config('SESSION_ARCHIVE_AFTER_DAYS', 90, cast=int)  # sessions idle this long leave the hot table
+SESSION_ARCHIVE_BATCH_SIZE = config('SESSION_ARCHIVE_BATCH_SIZE', 5000, cast=int)  # rows read and deleted per query
+SESSION_ARCHIVE_MAX_ROWS = config('SESSION_ARCHIVE_MAX_ROWS', 500000, cast=int)  # per run
+
+# FreeRADIUS sync
+RADIUS_SYNC_MODE = config('RADIUS_SYNC_MODE', 'incremental')  # 'incremental', 'swap' (MySQL only) or 'truncate'
+RADIUS_SYNC_BATCH_SIZE = config('RADIUS_SYNC_BATCH_SIZE', 1000, cast=int)  # rows per executemany/DELETE batch
+
+# Router sync
+ROUTER_SYNC_CONCURRENCY = config('ROUTER_SYNC_CONCURRENCY', 16, cast=int)  # routers synced in parallel
+ROUTER_BULK_CHUNK_SIZE = config('ROUTER_BULK_CHUNK_SIZE', 500, cast=int)  # entries per bulk set/disable/remove command
+ROUTER_SYNC_PER_ROUTER_CONCURRENCY = config('ROUTER_SYNC_PER_ROUTER_CONCURRENCY', 1, cast=int)  # sessions per router, overridable via Router.sync_concurrency
 
 # DRF
 REST_FRAMEWORK = {
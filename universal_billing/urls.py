@@ -17,6 +17,7 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/hotspot/plans/', views.hotspot_plans_api, name='hotspot_plans_api'),
     path('api/hotspot/pay/', views.hotspot_pay_api, name='hotspot_pay_api'),
+    path('api/provisioning/<uuid:token>/', views.provisioning_status, name='provisioning_status'),
     path('customer/login/', views.customer_login, name='customer_login'),
     path('customer/logout/', views.customer_logout, name='customer_logout'),
     path('customer/dashboard/', views.customer_dashboard, name='customer_dashboard'),
@@ -33,5 +34,6 @@ urlpatterns = [
     path('customer/select-payment/<int:invoice_id>/', views.select_payment_method, name='select_payment_method'),
     path('reports/daily-sales/', views.daily_sales_report, name='daily_sales_report'),
     path('reports/monthly-sales/', views.monthly_sales_report, name='monthly_sales_report'),
+    path('reports/sync-metrics/', views.sync_metrics, name='sync_metrics'),
     path('hotspot/login/', views.hotspot_login, name='hotspot_login'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file